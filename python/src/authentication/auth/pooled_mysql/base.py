@@ -0,0 +1,23 @@
+# Copied in both services, keep the copies identical (SHARED_MODULES in testing.py)
+"""
+MySQL backend whose connections come from a per process pool (auth.pool)
+
+    'ENGINE': 'auth.pooled_mysql',
+    'CONN_MAX_AGE': 0,
+    'POOL': {'MIN_SIZE': 1, 'MAX_SIZE': 4, 'TIMEOUT': 5, 'MAX_IDLE': 300, 'MAX_LIFETIME': 1800, 'PRE_PING': True},
+"""
+from django.db.backends.mysql import base as mysql
+
+from auth.pool import PooledDatabaseMixin
+
+
+class DatabaseWrapper(PooledDatabaseMixin, mysql.DatabaseWrapper):
+    unpooled_engine = 'django.db.backends.mysql'
+
+    def ping_connection(self, connection):
+        # mysql_ping, one round trip without a result set
+        try:
+            connection.ping()
+            return True
+        except self.Database.Error:
+            return False
@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 from datetime import timedelta
 import os
 from django.utils.translation import gettext_lazy as _
@@ -56,6 +56,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'auth.metrics.PerformanceMiddleware',
+    'auth.replicas.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
@@ -94,17 +96,46 @@ WSGI_APPLICATION = 'auth.wsgi.application'
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
 
+# Connection pool
+# With DB_POOL the threads of a worker share at most DB_POOL_MAX_SIZE connections per alias,
+# checked out for the duration of a request (CONN_MAX_AGE is then 0). Keep
+# pods * WEB_CONCURRENCY * DB_POOL_MAX_SIZE under MySQL max_connections.
+# DB_POOL_MIN_SIZE connections are kept once opened, the pool doesn't open them ahead of requests
+DB_POOL = config('DB_POOL', default=True, cast=bool)
+DATABASE_POOL = {
+    'MIN_SIZE': config('DB_POOL_MIN_SIZE', default=1, cast=int),
+    'MAX_SIZE': config('DB_POOL_MAX_SIZE', default=4, cast=int),
+    'TIMEOUT': config('DB_POOL_TIMEOUT', default=5, cast=float),
+    'MAX_IDLE': config('DB_POOL_MAX_IDLE', default=300, cast=float),
+    'MAX_LIFETIME': config('DB_POOL_MAX_LIFETIME', default=1800, cast=float),
+    'PRE_PING': config('DB_POOL_PRE_PING', default=True, cast=bool),
+}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'auth.pooled_mysql' if DB_POOL else 'django.db.backends.mysql',
         'NAME': config("DB_NAME"),
         'USER':  config("DB_USER"),
         'PASSWORD': config("DB_PASSWORD"),
         'HOST': config("DB_HOST"),
         'PORT': config("DB_PORT"),
-        'CONN_MAX_AGE': int(config('CONN_MAX_AGE')),
+        'CONN_MAX_AGE': 0 if DB_POOL else int(config('CONN_MAX_AGE')),
+        'POOL': DATABASE_POOL,
     }
 }
+DATABASE_ROUTERS = ['auth.replicas.ReplicaRouter']
+
+# Read replicas
+# DB_REPLICA_HOSTS lists hosts replicating the default database with the same credentials.
+# Reads of a request go to one of them until it writes, replicas more than REPLICA_MAX_LAG_SECONDS
+# behind (probed every REPLICA_LAG_CHECK_SECONDS) are left out until they catch up
+DATABASE_REPLICAS = []
+for index, host in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv()), start=1):
+    DATABASES['replica_%d' % index] = dict(DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append('replica_%d' % index)
+REPLICA_MAX_LAG_SECONDS = config('REPLICA_MAX_LAG_SECONDS', default=5, cast=float)
+REPLICA_LAG_CHECK_SECONDS = config('REPLICA_LAG_CHECK_SECONDS', default=10, cast=float)
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=10, cast=int)
 
 # Rest Framework Config
 REST_FRAMEWORK = {
@@ -116,8 +147,21 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.TokenAuthentication',
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+    ),
+    # Sliding window limits of the AllowAny endpoints, see users.throttling
+    'DEFAULT_THROTTLE_RATES': {
+        'login_ip': config('THROTTLE_LOGIN_IP', default='30/min'),
+        'login_email': config('THROTTLE_LOGIN_EMAIL', default='10/min'),
+        'register_ip': config('THROTTLE_REGISTER_IP', default='20/hour'),
+        'register_email': config('THROTTLE_REGISTER_EMAIL', default='5/hour'),
+        'register_username': config('THROTTLE_REGISTER_USERNAME', default='5/hour'),
+        'password_reset_ip': config('THROTTLE_PASSWORD_RESET_IP', default='20/hour'),
+        'password_reset_email': config('THROTTLE_PASSWORD_RESET_EMAIL', default='5/hour'),
+    },
+    'NUM_PROXIES': config('NUM_PROXIES', default=None, cast=lambda value: None if value in (None, '') else int(value)),
 }
+# Counters must be shared, on locmem every worker of every pod counts its own requests
+THROTTLE_CACHE_ALIAS = 'default'
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Authentication Service API',
     'DESCRIPTION': 'This is the Web service api documentation',
@@ -147,6 +191,28 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing
+# PASSWORD_HASHER_POLICY picks the hasher used for new hashes (pbkdf2, argon2 or scrypt).
+# The others stay listed so existing hashes verify, and are upgraded on the next login.
+PASSWORD_HASHER_POLICY = config('PASSWORD_HASHER_POLICY', default='pbkdf2')
+PASSWORD_HASHER_POLICIES = {
+    'pbkdf2': 'users.hashers.TunedPBKDF2PasswordHasher',
+    'argon2': 'users.hashers.TunedArgon2PasswordHasher',
+    'scrypt': 'users.hashers.TunedScryptPasswordHasher',
+}
+PASSWORD_HASHERS = [PASSWORD_HASHER_POLICIES[PASSWORD_HASHER_POLICY]] + [
+    hasher for policy, hasher in PASSWORD_HASHER_POLICIES.items() if policy != PASSWORD_HASHER_POLICY
+] + [
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+PASSWORD_PBKDF2_ITERATIONS = config('PASSWORD_PBKDF2_ITERATIONS', default=390000, cast=int)
+PASSWORD_ARGON2_TIME_COST = config('PASSWORD_ARGON2_TIME_COST', default=2, cast=int)
+PASSWORD_ARGON2_MEMORY_COST = config('PASSWORD_ARGON2_MEMORY_COST', default=65536, cast=int)
+PASSWORD_ARGON2_PARALLELISM = config('PASSWORD_ARGON2_PARALLELISM', default=1, cast=int)
+PASSWORD_SCRYPT_WORK_FACTOR = config('PASSWORD_SCRYPT_WORK_FACTOR', default=2 ** 14, cast=int)
+PASSWORD_HASHING_WORKERS = config('PASSWORD_HASHING_WORKERS', default=0, cast=int)
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.1/topics/i18n/
@@ -195,6 +261,38 @@ CORS_ALLOW_HEADERS = [
     "x-requested-with",
 ]
 
+# Cache Configuration
+# Shared between the workers and pods in production, the manifests point it at redis (manifests/redis.yaml).
+# The locmem default is for tests and a single process development server
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='auth-cache'),
+    }
+}
+# A write only invalidates the cache of its own worker when it is locmem, entries live a few seconds then
+CACHE_SHARED = not CACHES['default']['BACKEND'].endswith('LocMemCache')
+USER_CACHE_ALIAS = 'default'
+USER_CACHE_TIMEOUT = config('USER_CACHE_TIMEOUT', default=300 if CACHE_SHARED else 5, cast=int)
+
+# Email Configuration
+# Emails are queued in the users OutboundEmail table and sent by `manage.py send_queued_mail --loop`
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=25, cast=int)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=False, cast=bool)
+EMAIL_OUTBOX_BATCH_SIZE = config('EMAIL_OUTBOX_BATCH_SIZE', default=50, cast=int)
+EMAIL_OUTBOX_MAX_ATTEMPTS = config('EMAIL_OUTBOX_MAX_ATTEMPTS', default=5, cast=int)
+EMAIL_OUTBOX_BACKOFF_SECONDS = config('EMAIL_OUTBOX_BACKOFF_SECONDS', default=30, cast=int)
+EMAIL_OUTBOX_MAX_BACKOFF_SECONDS = config('EMAIL_OUTBOX_MAX_BACKOFF_SECONDS', default=3600, cast=int)
+
+# User change outbox
+# Every User write appends a UserChange row read by the blog service `replicate_users` consumer,
+# `prune_user_changes` deletes the ones older than USER_CHANGES_RETENTION_DAYS
+USER_CHANGES_RETENTION_DAYS = config('USER_CHANGES_RETENTION_DAYS', default=7, cast=int)
+
 # Simple JWT Configuration
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=30),
@@ -203,9 +301,9 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': True,
     'UPDATE_LAST_LOGIN': True,
 
-    'ALGORITHM': 'HS256',
-    'SIGNING_KEY': SECRET_KEY,
-    'VERIFYING_KEY': None,
+    'ALGORITHM': config('JWT_ALGORITHM', default='HS256'),
+    'SIGNING_KEY': config('JWT_SIGNING_KEY', default=SECRET_KEY),
+    'VERIFYING_KEY': config('JWT_VERIFYING_KEY', default=None),
     'AUDIENCE': None,
     'ISSUER': None,
     'JWK_URL': None,
@@ -219,6 +317,8 @@ SIMPLE_JWT = {
 
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
+    'TOKEN_OBTAIN_SERIALIZER': 'users.serializers.UserTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'users.tokens.CachedTokenRefreshSerializer',
 
     'JTI_CLAIM': 'jti',
 
@@ -226,6 +326,41 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_LIFETIME': timedelta(days=1),
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=5),
 }
+# Blacklisted JTIs are cached until their token expires, a JTI found nowhere at most this long.
+# A logout writes the cache once committed, on a shared cache every worker sees it and a miss
+# is kept as long as the token. On locmem it reaches the worker that served it only
+TOKEN_BLACKLIST_MISS_TIMEOUT = config(
+    'TOKEN_BLACKLIST_MISS_TIMEOUT',
+    default=int(SIMPLE_JWT['REFRESH_TOKEN_LIFETIME'].total_seconds()) if CACHE_SHARED else 5, cast=int,
+)
+# Performance instrumentation
+# Histograms are served on /metrics, requests above either threshold are logged on `performance`
+PERF_SLOW_REQUEST_MS = config('PERF_SLOW_REQUEST_MS', default=500, cast=int)
+PERF_SLOW_REQUEST_QUERIES = config('PERF_SLOW_REQUEST_QUERIES', default=50, cast=int)
+# Required, /metrics answers 403 until it is set
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+# Directory shared by the workers of a server, /metrics then sums them instead of answering for one worker
+# (gunicorn.conf.py clears it on start), snapshots are written every METRICS_FLUSH_SECONDS
+METRICS_DIR = config('METRICS_DIR', default='')
+METRICS_FLUSH_SECONDS = config('METRICS_FLUSH_SECONDS', default=5, cast=int)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'performance': {
+            'handlers': ['console'],
+            'level': config('PERF_LOG_LEVEL', default='WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
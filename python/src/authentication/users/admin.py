@@ -3,7 +3,7 @@ from django.contrib.auth.admin import UserAdmin
 from django.db import models
 from django.forms import Textarea
 
-from users.models import User
+from users.models import OutboundEmail, User
 
 
 @admin.register(User)
@@ -26,4 +26,11 @@ class UserAdmin(UserAdmin):
             'classes': ('wide',),
             'fields': ('first_name', 'last_name', 'username', 'email', 'password1', 'password2', 'address', 'city', 'postal_code', 'groups', 'is_staff', 'is_active', 'is_superuser')}
          ),
-    )
\ No newline at end of file
+    )
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_filter = ('status',)
+    list_display = ('id', 'to', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    ordering = ("-created_at",)
@@ -1,31 +1,91 @@
+import hashlib
+import uuid
+
 from django.contrib.auth import logout
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.mail import EmailMessage
-from django.template.loader import render_to_string
+from django.db import transaction
+from django.db.models import Count, Max
+from django.http import StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from drf_spectacular.utils import extend_schema
 from rest_framework import status
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.generics import (CreateAPIView, DestroyAPIView,
                                      ListAPIView, RetrieveAPIView,
                                      UpdateAPIView)
 from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.views import TokenObtainPairView
 
+from users.cache import cached_user_response
+from users.cache import stats as cache_stats
+from users.export import EXPORT_CONTENT_TYPES, EXPORT_FORMATS, export_users
+from users.mail import queue_email
 from users.models import User
-from users.serializers import UserSerializer
+from users.pagination import UserCursorPagination
+from users.profile import get_profile
+from users.serializers import (ProfileSerializer, UserListSerializer,
+                               UserSerializer)
+from users.throttling import EmailThrottle, IPThrottle, UsernameThrottle
+from users.tokens import CachedRefreshToken
 from auth.utils import account_activation_token
 
 
+def user_list_etag(request, *args, **kwargs):
+    """
+        Validator of the user list built from one aggregate query
+        last_login is auto_now so it moves on every user write
+        return String
+    """
+    state = User.objects.aggregate(count=Count('id'), last_id=Max('id'), last_write=Max('last_login'))
+    raw = "%s|%s|%s|%s" % (state['count'], state['last_id'], state['last_write'], request.META.get('QUERY_STRING', ''))
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
 class UserListAPI(ListAPIView):
     """
-        User list endpoint
+        User list endpoint, cursor paginated
+        ?fields=uuid,email narrows the response and the SQL select
         Role: Is admin user
     """
     permission_classes = [IsAdminUser]
     queryset = User.objects.all()
-    serializer_class = UserSerializer
+    serializer_class = UserListSerializer
+    pagination_class = UserCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.serializer_class.sparse_fields(self.request)
+        if fields is not None:
+            ordering = [name.lstrip('-') for name in self.pagination_class.ordering]
+            queryset = queryset.only(*set(fields) | set(ordering))
+        return queryset
+
+    @method_decorator(condition(etag_func=user_list_etag))
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
     
 
+class UserExportAPI(APIView):
+    """
+        Streamed export of every user, ?output=ndjson|csv
+        Role: Is admin user
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        export_format = request.query_params.get('output', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(export_users(export_format), content_type=EXPORT_CONTENT_TYPES[export_format])
+        response['Content-Disposition'] = 'attachment; filename="users.%s"' % export_format
+        return response
+
+
 class UserAPI(RetrieveAPIView):
     """
         Retrieve a user endpoint
@@ -35,34 +95,60 @@ class UserAPI(RetrieveAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     lookup_field = 'uuid'
-    
+
+    def retrieve(self, request, *args, **kwargs):
+        retrieve = super().retrieve
+        try:
+            # Every spelling of the uuid shares the entry invalidate_user bumps
+            user_uuid = str(uuid.UUID(kwargs['uuid']))
+        except ValueError:
+            return retrieve(request, *args, **kwargs)
+        data = cached_user_response(user_uuid, 'detail', lambda: retrieve(request, *args, **kwargs).data)
+        return Response(data)
+
+
+class UserCacheStatsAPI(APIView):
+    """
+        Hit and miss counters of the user response cache
+        Role: Is admin user
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        return Response(status=status.HTTP_200_OK, data=cache_stats.as_dict())
+
+
+class LoginAPI(TokenObtainPairView):
+    """
+        Login endpoint, throttled before any password hashing
+        Role: Allow Any
+    """
+    throttle_scope = 'login'
+    throttle_classes = [IPThrottle, EmailThrottle]
+
 
 class UserCreateAPI(CreateAPIView):
     """
         User registration endpoint
     """
     permission_classes = [AllowAny]
+    throttle_scope = 'register'
+    throttle_classes = [IPThrottle, EmailThrottle, UsernameThrottle]
     queryset = User.objects.all()
     serializer_class = UserSerializer
     
     def post(self, request, format=None):
         serializer = UserSerializer(data=request.data)
         if serializer.is_valid():
-            new_user = serializer.save()
-            
             current_site = get_current_site(request)
-            mail_subject = "Activate your Fujyn account"
-            message = render_to_string("activation_email.html", {
-                'user': new_user,
-                'domain': current_site.domain,
-                'uid': new_user.uuid,
-                'token': account_activation_token.make_token(new_user),
-            })
-            to_email = new_user.email
-            email = EmailMessage(
-                mail_subject, message, to=[to_email]
-            )
-            email.send()
+            with transaction.atomic():
+                new_user = serializer.save()
+                queue_email("Activate your Fujyn account", "activation_email.html", {
+                    'user': new_user,
+                    'domain': current_site.domain,
+                    'uid': new_user.uuid,
+                    'token': account_activation_token.make_token(new_user),
+                }, new_user.email)
     
             return Response(status=status.HTTP_201_CREATED)
         return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -71,25 +157,24 @@ class UserCreateAPI(CreateAPIView):
 
 class ProfileAPI(APIView):
     """
-        Account activation Endpoint
+        Profile endpoint, the user is read from the token claims
+        and the profile columns fetched with one narrow query
+        Role: Is Authenticated
     """
     permission_classes = [IsAuthenticated]
-    
+    authentication_classes = [SessionAuthentication, JWTStatelessUserAuthentication]
+
+    @extend_schema(responses=ProfileSerializer)
     def get(self, request, format=None):
         user = request.user
-        context={
-            "uuid": user.uuid if user.uuid else None,
-            "firstname": user.first_name if user.first_name else None,
-            "lastname":user.last_name if user.last_name else None,
-            "email":user.email,
-            "username":user.username,
-            "address":user.address if user.address else None,
-            "city":user.city if user.city else None,
-            "postal_code":user.postal_code if user.postal_code else None,
-            "postal_code":user.date_joined if user.date_joined else None,
-        }
-    
-        return Response(status=status.HTTP_200_OK, data=context)
+        user_uuid = getattr(user, 'uuid', None)
+        if user_uuid:
+            data = cached_user_response(user_uuid, 'profile', lambda: get_profile(user.pk))
+        else:
+            data = get_profile(user.pk)
+        if data is None:
+            raise AuthenticationFailed("User not found or inactive")
+        return Response(status=status.HTTP_200_OK, data=data)
 
     
 class ActiveAccountAPI(APIView):
@@ -114,22 +199,18 @@ class ForgotPasswordAPI(APIView):
         Role: Allow Any
     """    
     permission_classes= [AllowAny]
+    throttle_scope = 'password_reset'
+    throttle_classes = [IPThrottle, EmailThrottle]
     
     def post(self, request, format=None):
         user = User.objects.get(email=request.data['email'])
         current_site = get_current_site(request)
-        mail_subject = "Reset your account password"
-        message = render_to_string("password_reset_email.html", {
+        queue_email("Reset your account password", "password_reset_email.html", {
             'user': user,
             'domain': current_site.domain,
             'uid': user.uuid,
             'token': account_activation_token.make_token(user),
-        })
-        to_email = user.email
-        email = EmailMessage(
-            mail_subject, message, to=[to_email]
-        )
-        email.send()
+        }, user.email)
         return Response({'status' : 'Success', 'message': 'We have sent you an email with the link to reset your password'},status=status.HTTP_200_OK)
 
 
@@ -158,7 +239,7 @@ class BlacklistAPI(APIView):
     
     def post(self, request, format=None):
         refresh_token = request.data["refresh_token"]
-        token = RefreshToken(refresh_token)
+        token = CachedRefreshToken(refresh_token)
         token.blacklist()
         logout(request)
         return Response(status=status.HTTP_200_OK)
@@ -0,0 +1,184 @@
+"""
+    Async versions of the I/O bound user endpoints, mounted under async/
+    They only block the event loop for CPU work, database and cache calls
+    are awaited so one ASGI worker can hold many slow clients.
+    Authentication is JWT only (no session, so no CSRF either).
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import logout
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse
+from django.utils.decorators import classonlymethod
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import (
+    JWTAuthentication, JWTStatelessUserAuthentication)
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from auth.utils import account_activation_token
+from users.cache import cached_user_response
+from users.hashers import acheck_password, aset_password
+from users.mail import queue_email
+from users.models import User
+from users.profile import aget_profile, get_profile
+from users.throttling import EmailThrottle, IPThrottle
+from users.tokens import CachedRefreshToken
+
+
+class AsyncAPIView(View):
+    """
+        Minimal async API view: JSON in, JSON out, optional JWT authentication
+    """
+    authentication_required = False
+    load_user = True
+    throttle_scope = None
+    throttle_classes = []
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        request.data = self.parse_body(request)
+        if request.data is None:
+            return JsonResponse({'detail': 'Malformed request body'}, status=status.HTTP_400_BAD_REQUEST)
+        for throttle in [throttle_class() for throttle_class in self.throttle_classes]:
+            if not await sync_to_async(throttle.allow_request)(request, self):
+                response = JsonResponse({'detail': 'Request was throttled.'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+                response['Retry-After'] = '%d' % throttle.wait()
+                return response
+        # Same contract as DRF views, code after dispatch can read request.user.is_authenticated
+        request.user = await self.authenticate(request) or AnonymousUser()
+        if self.authentication_required and not request.user.is_authenticated:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except (User.DoesNotExist, ValidationError, KeyError):
+            return JsonResponse({}, status=status.HTTP_403_FORBIDDEN)
+
+    @staticmethod
+    def parse_body(request):
+        if request.method not in ('POST', 'PUT', 'PATCH'):
+            return {}
+        if request.content_type == 'application/json':
+            try:
+                return json.loads(request.body or b'{}')
+            except ValueError:
+                return None
+        return request.POST
+
+    async def authenticate(self, request):
+        """
+            Validate the bearer token and load its user with one awaited query,
+            or build a stateless TokenUser when load_user is False
+            return User, TokenUser or None
+        """
+        authentication = JWTAuthentication()
+        header = authentication.get_header(request)
+        raw_token = authentication.get_raw_token(header) if header is not None else None
+        if raw_token is None:
+            return None
+        try:
+            validated_token = authentication.get_validated_token(raw_token)
+            if not self.load_user:
+                return JWTStatelessUserAuthentication().get_user(validated_token)
+            user = await User.objects.aget(**{jwt_settings.USER_ID_FIELD: validated_token[jwt_settings.USER_ID_CLAIM]})
+        except (InvalidToken, TokenError, AuthenticationFailed, KeyError, User.DoesNotExist):
+            return None
+        return user if user.is_active else None
+
+
+class AsyncProfileAPI(AsyncAPIView):
+    """
+        Profile endpoint
+        Role: Is Authenticated
+    """
+    authentication_required = True
+    load_user = False
+
+    async def get(self, request):
+        user = request.user
+        if user.uuid:
+            data = await sync_to_async(cached_user_response)(user.uuid, 'profile', lambda: get_profile(user.pk))
+        else:
+            data = await aget_profile(user.pk)
+        if data is None:
+            return JsonResponse({'detail': 'User not found or inactive'}, status=status.HTTP_401_UNAUTHORIZED)
+        return JsonResponse(data, status=status.HTTP_200_OK)
+
+
+class AsyncActiveAccountAPI(AsyncAPIView):
+    """
+        Account activation Endpoint
+        Role: Allow Any
+    """
+    async def get(self, request, uidb64, token):
+        user = await User.objects.aget(uuid=uidb64)
+        if account_activation_token.check_token(user, token):
+            user.is_active = True
+            user.email_verified = True
+            await sync_to_async(user.save)()
+            return JsonResponse({}, status=status.HTTP_202_ACCEPTED)
+        return JsonResponse({}, status=status.HTTP_403_FORBIDDEN)
+
+
+class AsyncForgotPasswordAPI(AsyncAPIView):
+    """
+        Forgot password endpoint, the email is queued in the outbox
+        Role: Allow Any
+    """
+    throttle_scope = 'password_reset'
+    throttle_classes = [IPThrottle, EmailThrottle]
+
+    async def post(self, request):
+        user = await User.objects.aget(email=request.data['email'])
+        current_site = get_current_site(request)
+        await sync_to_async(queue_email)("Reset your account password", "password_reset_email.html", {
+            'user': user,
+            'domain': current_site.domain,
+            'uid': user.uuid,
+            'token': account_activation_token.make_token(user),
+        }, user.email)
+        return JsonResponse({'status' : 'Success', 'message': 'We have sent you an email with the link to reset your password'}, status=status.HTTP_200_OK)
+
+
+class AsyncResetPasswordAPI(AsyncAPIView):
+    """
+        Reset Password API
+        Role: Allow Any
+    """
+    async def post(self, request, uidb64, token):
+        user = await User.objects.aget(uuid=uidb64)
+        password1, password2 = request.data['password1'], request.data['password2']
+        if password1 != password2 or not account_activation_token.check_token(user, token):
+            return JsonResponse({}, status=status.HTTP_403_FORBIDDEN)
+        if await acheck_password(user, password1):
+            return JsonResponse({}, status=status.HTTP_403_FORBIDDEN)
+        await aset_password(user, password1)
+        await sync_to_async(user.save)()
+        return JsonResponse({}, status=status.HTTP_200_OK)
+
+
+class AsyncBlacklistAPI(AsyncAPIView):
+    """
+        Blacklist user tokens
+        Role: Is Authenticated
+    """
+    authentication_required = True
+
+    async def post(self, request):
+        try:
+            token = await sync_to_async(CachedRefreshToken)(request.data['refresh_token'])
+        except TokenError:
+            return JsonResponse({}, status=status.HTTP_400_BAD_REQUEST)
+        await sync_to_async(token.blacklist)()
+        await sync_to_async(logout)(request)
+        return JsonResponse({}, status=status.HTTP_200_OK)
@@ -0,0 +1,93 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from auth.replicas import primary_reads
+from users.models import User
+
+
+class CacheStats:
+    """
+        Hit and miss counters of the user response cache (per process)
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else None,
+            }
+
+
+stats = CacheStats()
+
+
+def get_cache():
+    return caches[settings.USER_CACHE_ALIAS]
+
+
+def version_key(uuid):
+    return "user:version:%s" % uuid
+
+
+def get_version(uuid):
+    return get_cache().get_or_set(version_key(uuid), 1, timeout=None)
+
+
+def bump_version(uuid):
+    """
+        Invalidate every cached response of a user
+    """
+    cache = get_cache()
+    try:
+        cache.incr(version_key(uuid))
+    except ValueError:
+        cache.set(version_key(uuid), 2, timeout=None)
+
+
+def cached_user_response(uuid, kind, build):
+    """
+        Read-through cache of a user response keyed by uuid and version
+        build() reads the primary, a lagging replica would cache the previous
+        row under the current version
+        return Data built by build() or read from the cache
+    """
+    cache = get_cache()
+    key = "user:%s:%s:v%s" % (kind, uuid, get_version(uuid))
+    data = cache.get(key)
+    stats.record(data is not None)
+    if data is None:
+        with primary_reads():
+            data = build()
+        cache.set(key, data, timeout=settings.USER_CACHE_TIMEOUT)
+    return data
+
+
+def invalidate_user(sender, instance, **kwargs):
+    # Bumped before the commit, a concurrent read could cache the old row under the new version
+    if instance.uuid:
+        user_uuid = instance.uuid
+        transaction.on_commit(lambda: bump_version(user_uuid))
+
+post_save.connect(invalidate_user, sender=User)
+post_delete.connect(invalidate_user, sender=User)
@@ -0,0 +1,42 @@
+from django.db.models.signals import post_delete, post_save
+
+from users.models import User, UserChange
+
+# Columns copied to the users table of the blog service
+REPLICATED_FIELDS = (
+    'email', 'username', 'first_name', 'last_name', 'address', 'postal_code', 'city',
+    'email_verified', 'is_active', 'is_staff', 'is_superuser', 'slug',
+)
+
+
+def user_payload(user):
+    return {field: getattr(user, field) for field in REPLICATED_FIELDS}
+
+
+def record_user_changes(users, action):
+    """
+        Append the changes of users to the outbox, in the caller's transaction
+        Bulk writes skip the signals and call it themselves
+    """
+    UserChange.objects.bulk_create([
+        UserChange(
+            user_uuid=user.uuid,
+            action=action,
+            payload={} if action == UserChange.ACTION_DELETE else user_payload(user),
+        )
+        for user in users
+    ])
+
+
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # last_login and password updates aren't replicated
+    if update_fields is not None and not set(update_fields) & set(REPLICATED_FIELDS):
+        return
+    record_user_changes([instance], UserChange.ACTION_CREATE if created else UserChange.ACTION_UPDATE)
+
+
+def user_deleted(sender, instance, **kwargs):
+    record_user_changes([instance], UserChange.ACTION_DELETE)
+
+post_save.connect(user_saved, sender=User)
+post_delete.connect(user_deleted, sender=User)
@@ -0,0 +1,63 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from users.models import User
+
+EXPORT_FIELDS = ('id', 'uuid', 'email', 'username', 'first_name', 'last_name', 'address', 'city', 'postal_code', 'email_verified', 'is_active', 'is_staff', 'date_joined', 'last_login')
+EXPORT_FORMATS = ('ndjson', 'csv')
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class Echo:
+    """
+        File like object handing back what csv.writer writes
+    """
+    def write(self, value):
+        return value
+
+
+def iter_user_rows(chunk_size=2000):
+    """
+        Stream user rows as tuples, chunk_size rows are fetched per round-trip
+        Chunks are keyset queries on id: mysqlclient has no server-side cursor,
+        iterator() would buffer the whole table client-side
+        return Generator
+    """
+    queryset = User.objects.order_by('id').values_list(*EXPORT_FIELDS)
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        # id is the first export field
+        last_id = chunk[-1][0]
+
+
+def iter_ndjson(rows):
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(EXPORT_FIELDS, row))) + "\n"
+
+
+def iter_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def export_users(export_format='ndjson', chunk_size=2000):
+    """
+        Encoded export lines of every user, memory stays flat
+        return Generator of String
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError("Unknown export format %s" % export_format)
+    rows = iter_user_rows(chunk_size=chunk_size)
+    return iter_csv(rows) if export_format == 'csv' else iter_ndjson(rows)
@@ -0,0 +1,78 @@
+"""
+    Password hashers whose cost is read from the settings, see PASSWORD_HASHER_POLICY.
+    They keep the algorithm name of the Django hasher they extend, so stored hashes stay
+    valid and Django rehashes them on the next successful login when the cost changes.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import (Argon2PasswordHasher,
+                                         PBKDF2PasswordHasher,
+                                         ScryptPasswordHasher)
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2_PARALLELISM
+
+
+class TunedScryptPasswordHasher(ScryptPasswordHasher):
+    @property
+    def work_factor(self):
+        return settings.PASSWORD_SCRYPT_WORK_FACTOR
+
+    @property
+    def maxmem(self):
+        # scrypt needs 128 * n * r bytes, leave room above OpenSSL 32 MiB default
+        return max(2 * 128 * self.work_factor * self.block_size * self.parallelism, 32 * 1024 * 1024)
+
+
+_executor = None
+
+
+def get_hashing_executor():
+    """
+        Bounded pool running password hashing (hashlib and argon2 release the GIL)
+        return ThreadPoolExecutor
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.PASSWORD_HASHING_WORKERS or os.cpu_count() or 1,
+            thread_name_prefix='password-hashing',
+        )
+    return _executor
+
+
+async def acheck_password(user, raw_password):
+    """
+        User.check_password off the event loop, rehashing included
+        return Boolean
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hashing_executor(), user.check_password, raw_password)
+
+
+async def aset_password(user, raw_password):
+    """
+        User.set_password off the event loop, the user still has to be saved
+    """
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(get_hashing_executor(), user.set_password, raw_password)
@@ -0,0 +1,91 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from users.models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+
+def queue_email(subject, template_name, context, to):
+    """
+        Render an email and store it in the outbox
+        The row is part of the caller transaction, nothing is sent here
+        return OutboundEmail
+    """
+    return OutboundEmail.objects.create(
+        subject=subject,
+        body=render_to_string(template_name, context),
+        to=to,
+    )
+
+
+def retry_delay(attempts):
+    """
+        Exponential backoff delay after a failed attempt
+        return timedelta
+    """
+    base = settings.EMAIL_OUTBOX_BACKOFF_SECONDS
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), settings.EMAIL_OUTBOX_MAX_BACKOFF_SECONDS))
+
+
+def send_queued_emails(batch_size=None):
+    """
+        Send a batch of due emails over a single backend connection
+        return Tuple (sent, failed)
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    sent = failed = 0
+
+    with transaction.atomic():
+        emails = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboundEmail.STATUS_PENDING, next_attempt_at__lte=timezone.now())
+            .order_by('id')[:batch_size]
+        )
+        if not emails:
+            return sent, failed
+
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as exc:
+            logger.warning("Email backend unavailable: %s", exc)
+            for email in emails:
+                _mark_failed(email, exc)
+            return sent, len(emails)
+
+        try:
+            for email in emails:
+                message = EmailMessage(email.subject, email.body, to=[email.to], connection=connection)
+                try:
+                    message.send()
+                except Exception as exc:
+                    logger.warning("Email %s failed: %s", email.pk, exc)
+                    _mark_failed(email, exc)
+                    failed += 1
+                else:
+                    email.status = OutboundEmail.STATUS_SENT
+                    email.attempts += 1
+                    email.sent_at = timezone.now()
+                    email.save(update_fields=['status', 'attempts', 'sent_at'])
+                    sent += 1
+        finally:
+            connection.close()
+
+    return sent, failed
+
+
+def _mark_failed(email, exc):
+    email.attempts += 1
+    email.last_error = str(exc)
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboundEmail.STATUS_FAILED
+    else:
+        email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
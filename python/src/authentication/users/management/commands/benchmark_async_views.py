@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Compare sync and async profile endpoints with concurrent clients through the ASGI handler"
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help="User the requests are authenticated as")
+        parser.add_argument('--concurrency', type=int, default=100)
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(email=options['email'])
+        except User.DoesNotExist:
+            raise CommandError("Unknown user %s" % options['email'])
+        # AsyncClient (Django < 4.2) takes raw header names, without the HTTP_ prefix
+        headers = {'AUTHORIZATION': 'Bearer %s' % RefreshToken.for_user(user).access_token}
+        for label, url_name in (('sync', 'api-user-profile'), ('async', 'api-async-user-profile')):
+            elapsed, latencies, errors = asyncio.run(self.run(reverse(url_name), headers, options['concurrency'], options['requests']))
+            latencies.sort()
+            self.stdout.write("%-6s %7.1f req/s  p50 %6.1f ms  p99 %6.1f ms  %s error(s)" % (
+                label,
+                options['requests'] / elapsed,
+                latencies[len(latencies) // 2] * 1000,
+                latencies[int(len(latencies) * 0.99) - 1] * 1000,
+                errors,
+            ))
+
+    @staticmethod
+    async def run(path, headers, concurrency, total):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        errors = 0
+
+        async def request():
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(path, **headers)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(request() for _ in range(total)))
+        return time.perf_counter() - start, latencies, errors
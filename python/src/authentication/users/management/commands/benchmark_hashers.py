@@ -0,0 +1,44 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+
+class Command(BaseCommand):
+    help = "Report password checks (logins) per second per core for each hasher policy"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--policies', default=','.join(settings.PASSWORD_HASHER_POLICIES))
+        parser.add_argument('--duration', type=float, default=2.0, help="Seconds spent on each measure")
+        parser.add_argument('--workers', type=int, default=0, help="Also measure a pool of N threads")
+
+    def handle(self, *args, **options):
+        self.stdout.write("%-8s %14s %16s" % ("policy", "logins/s/core", "logins/s (pool)"))
+        for policy in options['policies'].split(','):
+            hasher = settings.PASSWORD_HASHER_POLICIES[policy]
+            with override_settings(PASSWORD_HASHERS=[hasher]):
+                try:
+                    encoded = make_password('benchmark-password')
+                except ValueError as exc:
+                    self.stdout.write("%-8s skipped: %s" % (policy, exc))
+                    continue
+                single = self.measure(encoded, options['duration'])
+                pooled = self.measure_pool(encoded, options['duration'], options['workers']) if options['workers'] else None
+            self.stdout.write("%-8s %14.1f %16s" % (policy, single, "%.1f" % pooled if pooled else "-"))
+
+    @staticmethod
+    def measure(encoded, duration):
+        count = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            check_password('benchmark-password', encoded)
+            count += 1
+        return count / (time.perf_counter() - start)
+
+    def measure_pool(self, encoded, duration, workers):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            rates = list(executor.map(lambda _: self.measure(encoded, duration), range(workers)))
+        return sum(rates)
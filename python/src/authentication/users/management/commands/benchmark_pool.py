@@ -0,0 +1,83 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import RequestFactory
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from auth.pool import PooledDatabaseMixin, pools
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Compare profile request latency with a database connection per request and with the connection pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help="User the requests are authenticated as")
+        parser.add_argument('--threads', type=int, default=4, help="Concurrent requests, like gunicorn --threads")
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(email=options['email'])
+        except User.DoesNotExist:
+            raise CommandError("Unknown user %s" % options['email'])
+        wrapper = connections[DEFAULT_DB_ALIAS]
+        if not isinstance(wrapper, PooledDatabaseMixin):
+            raise CommandError("DATABASES['default'] isn't pooled, run it with DB_POOL=True")
+
+        environ = RequestFactory().get(
+            reverse('api-user-profile'),
+            SERVER_NAME=settings.ALLOWED_HOSTS[0],
+            HTTP_AUTHORIZATION='Bearer %s' % RefreshToken.for_user(user).access_token,
+        ).environ
+        original = connections.settings[DEFAULT_DB_ALIAS]
+        self.stdout.write("%-7s %9s %10s %10s %8s %12s %14s" % (
+            "mode", "req/s", "p50 ms", "p99 ms", "errors", "connections", "pool wait ms",
+        ))
+        try:
+            for label, engine in (('direct', wrapper.unpooled_engine), ('pooled', original['ENGINE'])):
+                # Both modes close the connection at the end of each request, like the WSGI server
+                connections.close_all()
+                connections.settings[DEFAULT_DB_ALIAS] = dict(original, ENGINE=engine, CONN_MAX_AGE=0)
+                connections[DEFAULT_DB_ALIAS] = connections.create_connection(DEFAULT_DB_ALIAS)
+                retired = pools.pop(DEFAULT_DB_ALIAS, None)
+                if retired is not None:
+                    retired.close()
+                elapsed, latencies, errors = self.run(environ, options['threads'], options['requests'])
+                pool = pools.get(DEFAULT_DB_ALIAS)
+                latencies.sort()
+                self.stdout.write("%-7s %9.1f %10.2f %10.2f %8d %12s %14s" % (
+                    label,
+                    options['requests'] / elapsed,
+                    latencies[len(latencies) // 2] * 1000,
+                    latencies[int(len(latencies) * 0.99) - 1] * 1000,
+                    errors,
+                    options['requests'] if pool is None else pool.counters['opened'],
+                    '-' if pool is None else '%.3f' % (pool.wait_time.sum * 1000 / max(pool.wait_time.count, 1)),
+                ))
+        finally:
+            connections.close_all()
+            connections.settings[DEFAULT_DB_ALIAS] = original
+            connections[DEFAULT_DB_ALIAS] = connections.create_connection(DEFAULT_DB_ALIAS)
+
+    @staticmethod
+    def run(environ, threads, total):
+        handler = WSGIHandler()
+
+        def request(_):
+            start = time.perf_counter()
+            response = handler(dict(environ), lambda status, headers: None)
+            # Fires request_finished, which gives the connection back
+            response.close()
+            return time.perf_counter() - start, response.status_code
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(request, range(total)))
+        elapsed = time.perf_counter() - start
+        return elapsed, [latency for latency, _ in results], sum(1 for _, code in results if code != 200)
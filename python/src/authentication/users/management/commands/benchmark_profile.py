@@ -0,0 +1,64 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.models import User
+from users.profile import get_profile
+
+
+def legacy_profile(user_id):
+    """
+        Previous ProfileAPI path: full user row, then a dict built field by field
+    """
+    user = User.objects.get(pk=user_id)
+    return {
+        "uuid": user.uuid if user.uuid else None,
+        "firstname": user.first_name if user.first_name else None,
+        "lastname": user.last_name if user.last_name else None,
+        "email": user.email,
+        "username": user.username,
+        "address": user.address if user.address else None,
+        "city": user.city if user.city else None,
+        "postal_code": user.postal_code if user.postal_code else None,
+        "date_joined": user.date_joined if user.date_joined else None,
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare per-request CPU time and allocations of the legacy and projected profile reads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('email')
+        parser.add_argument('--iterations', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        try:
+            user_id = User.objects.values_list('pk', flat=True).get(email=options['email'])
+        except User.DoesNotExist:
+            raise CommandError("Unknown user %s" % options['email'])
+
+        self.stdout.write("%-10s %14s %18s" % ("path", "cpu us/call", "allocated B/call"))
+        for label, build in (('legacy', legacy_profile), ('projection', get_profile)):
+            build(user_id)
+            cpu = self.cpu_time(build, user_id, options['iterations'])
+            allocated = self.allocations(build, user_id, max(options['iterations'] // 10, 1))
+            self.stdout.write("%-10s %14.1f %18.0f" % (label, cpu, allocated))
+
+    @staticmethod
+    def cpu_time(build, user_id, iterations):
+        start = time.process_time()
+        for _ in range(iterations):
+            build(user_id)
+        return (time.process_time() - start) * 1e6 / iterations
+
+    @staticmethod
+    def allocations(build, user_id, iterations):
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        for _ in range(iterations):
+            build(user_id)
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename') if stat.size_diff > 0)
+        return allocated / iterations
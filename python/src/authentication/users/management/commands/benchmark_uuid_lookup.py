@@ -0,0 +1,51 @@
+import time
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Time User lookups by uuid against table size (rows are rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000', help="Comma separated table sizes")
+        parser.add_argument('--lookups', type=int, default=200)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        password = make_password('benchmark')
+        self.stdout.write("%10s %18s %22s" % ("rows", "uuid (ms/lookup)", "unindexed (ms/lookup)"))
+
+        with transaction.atomic():
+            inserted = 0
+            for size in sizes:
+                users = []
+                for index in range(inserted, size):
+                    users.append(User(
+                        email="bench%s@bench.local" % index,
+                        username="bench%s" % index,
+                        slug="bench-%s" % index,
+                        first_name="bench%s" % index,
+                        password=password,
+                    ))
+                User.objects.bulk_create(users, batch_size=5000)
+                inserted = size
+
+                sample = list(User.objects.order_by('?').values_list('uuid', 'first_name')[:options['lookups']])
+                self.stdout.write("%10s %18.3f %22.3f" % (
+                    size,
+                    self.time_lookups(sample, lambda row: User.objects.get(uuid=row[0])),
+                    self.time_lookups(sample, lambda row: User.objects.filter(first_name=row[1]).first()),
+                ))
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def time_lookups(sample, lookup):
+        start = time.perf_counter()
+        for row in sample:
+            lookup(row)
+        return (time.perf_counter() - start) * 1000 / max(len(sample), 1)
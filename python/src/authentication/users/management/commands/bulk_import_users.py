@@ -0,0 +1,55 @@
+import csv
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.models import User
+
+
+def read_rows(stream, file_format):
+    """
+        Parse a CSV (with header) or JSONL stream lazily
+        return Generator of Dict
+    """
+    if file_format == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+class Command(BaseCommand):
+    help = "Import users from a CSV or JSONL file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="Source file, - for stdin")
+        parser.add_argument('--format', choices=('csv', 'jsonl'), default=None, help="Guessed from the extension by default")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=None, help="Password hashing processes, defaults to the CPU count")
+
+    def handle(self, *args, **options):
+        file_format = options['format']
+        if file_format is None:
+            file_format = 'csv' if options['input'].endswith('.csv') else 'jsonl'
+
+        stream = sys.stdin if options['input'] == '-' else open(options['input'], newline='', encoding='utf-8')
+        start = time.perf_counter()
+        try:
+            report = User.objects.bulk_import(read_rows(stream, file_format), batch_size=options['batch_size'], workers=options['workers'])
+        except (ValueError, csv.Error) as exc:
+            raise CommandError("Invalid input: %s" % exc)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        elapsed = time.perf_counter() - start
+
+        for line, error in report['errors']:
+            self.stderr.write("Line %s: %s" % (line, error))
+        total = report['created'] + report['skipped'] + len(report['errors'])
+        self.stdout.write(
+            "Created %s, skipped %s, rejected %s user(s) in %.2fs (%.0f rows/s)"
+            % (report['created'], report['skipped'], len(report['errors']), elapsed, total / elapsed if elapsed else 0)
+        )
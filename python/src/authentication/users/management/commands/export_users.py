@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from users.export import EXPORT_FORMATS, export_users
+
+
+class Command(BaseCommand):
+    help = "Write every user to a NDJSON or CSV file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Destination file, - for stdout")
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        lines = export_users(options['format'], chunk_size=options['chunk_size'])
+        if options['output'] == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+
+        count = 0
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            for line in lines:
+                output.write(line)
+                count += 1
+        if options['format'] == 'csv':
+            count -= 1
+        self.stderr.write("Exported %s user(s) to %s" % (count, options['output']))
@@ -0,0 +1,30 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from users.models import UserChange
+
+
+class Command(BaseCommand):
+    help = "Delete user changes older than the retention, the blog replica must have consumed them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.USER_CHANGES_RETENTION_DAYS)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.1, help="Pause between chunks, in seconds")
+
+    def handle(self, *args, **options):
+        expired = UserChange.objects.filter(created_at__lt=timezone.now() - timedelta(days=options['days'])).order_by('id')
+        total = 0
+        while True:
+            ids = list(expired.values_list('id', flat=True)[:options['chunk_size']])
+            if not ids:
+                break
+            UserChange.objects.filter(id__in=ids)._raw_delete(UserChange.objects.db)
+            total += len(ids)
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write("Pruned %s user change(s)" % total)
@@ -0,0 +1,40 @@
+# Generated by Django 4.1.7 on 2026-10-18 16:51
+
+from django.db import migrations, models
+from django.db.models import Count
+import uuid
+
+
+def backfill_duplicate_uuids(apps, schema_editor):
+    """
+        Give a fresh uuid to every user sharing one with an older row
+        so the unique index can be built
+    """
+    User = apps.get_model('users', 'User')
+    duplicates = (
+        User.objects.values('uuid').annotate(total=Count('id')).filter(total__gt=1).values_list('uuid', flat=True)
+    )
+    for duplicate in list(duplicates):
+        for user in User.objects.filter(uuid=duplicate).order_by('id')[1:]:
+            user.uuid = uuid.uuid4()
+            user.save(update_fields=['uuid'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_outboundemail'),
+    ]
+
+    # The backfill runs in its own transaction, then the unique index is added
+    # with an in-place ALTER TABLE which MySQL (InnoDB) builds without blocking writes
+    atomic = False
+
+    operations = [
+        migrations.RunPython(backfill_duplicate_uuids, migrations.RunPython.noop, atomic=True),
+        migrations.AlterField(
+            model_name='user',
+            name='uuid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+    ]
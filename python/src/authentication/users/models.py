@@ -1,16 +1,24 @@
 import uuid
 import re
+from concurrent.futures import ProcessPoolExecutor
 
 from django.contrib.auth.models import (AbstractUser, BaseUserManager,
                                         PermissionsMixin)
-from django.db import models
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
 from django.db.models.signals import pre_save
+from django.utils import timezone
 
-from auth.utils import unique_user_slug_generator
+from auth.slugs import (bulk_unique_slugs, save_with_unique_slug,
+                        unique_user_slug_generator)
 
 
 class UserManager(BaseUserManager):
     email_regex = re.compile(r'([A-Za-z0-9]+[.-_])*[A-Za-z0-9]+@[A-Za-z0-9-]+(\.[A-Z|a-z]{2,})+')
+    # Optional columns of an imported row, cleaned by their model field before any write
+    import_fields = ('first_name', 'last_name', 'address', 'city', 'postal_code')
 
     def create_user(self, email, username, password=None):
         if not re.fullmatch(self.email_regex, email):
@@ -26,6 +34,110 @@ class UserManager(BaseUserManager):
         user.save(using=self._db)
         return user
 
+    def bulk_import(self, rows, batch_size=1000, workers=None):
+        """
+            Create users from an iterable of dicts in batches
+            Rows are validated and converted up front, an invalid one is reported with
+            its line and left out. Emails are checked per batch, passwords hashed in a process pool,
+            slugs resolved in memory and rows written with bulk_create
+            return Dict (created, skipped, errors)
+        """
+        report = {'created': 0, 'skipped': 0, 'errors': []}
+        executor = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+        try:
+            batch = []
+            for line, row in enumerate(rows, start=1):
+                batch.append((line, row))
+                if len(batch) >= batch_size:
+                    self._import_batch(batch, batch_size, executor, report)
+                    batch = []
+            if batch:
+                self._import_batch(batch, batch_size, executor, report)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return report
+
+    def clean_import_values(self, row):
+        """
+            Column values of an imported row converted by their model field, empty ones as None
+            A postal code that isn't a number or a value over max_length would fail the whole batch
+            return Dict
+            raise ValidationError naming the field
+        """
+        values = {}
+        for name in ('email', 'username') + self.import_fields:
+            field = self.model._meta.get_field(name)
+            value = row.get(name)
+            if isinstance(value, str):
+                value = value.strip()
+            try:
+                values[name] = field.clean(value, None) if value not in (None, '') else None
+            except ValidationError as error:
+                raise ValidationError("%s: %s" % (name, "; ".join(error.messages)))
+        return values
+
+    def _import_batch(self, batch, batch_size, executor, report):
+        valid = []
+        for line, row in batch:
+            email = (row.get('email') or '').strip()
+            username = (row.get('username') or '').strip()
+            if not username or not self.email_regex.fullmatch(email):
+                report['errors'].append((line, "A valid email and username are required"))
+                continue
+            try:
+                values = self.clean_import_values(dict(row, email=self.normalize_email(email), username=username))
+            except ValidationError as error:
+                report['errors'].append((line, "; ".join(error.messages)))
+                continue
+            valid.append((line, dict(row, **values)))
+
+        emails = [row['email'] for _, row in valid]
+        usernames = [row['username'] for _, row in valid]
+        taken_emails = set(self.filter(email__in=emails).values_list('email', flat=True))
+        taken_usernames = set(self.filter(username__in=usernames).values_list('username', flat=True))
+        new_rows = []
+        for line, row in valid:
+            if row['email'] in taken_emails or row['username'] in taken_usernames:
+                report['skipped'] += 1
+                continue
+            taken_emails.add(row['email'])
+            taken_usernames.add(row['username'])
+            new_rows.append(row)
+        if not new_rows:
+            return
+
+        passwords = [row.get('password') or None for row in new_rows]
+        if executor is not None:
+            hashes = list(executor.map(make_password, passwords, chunksize=max(1, len(passwords) // 64)))
+        else:
+            hashes = [make_password(password) for password in passwords]
+        slugs = bulk_unique_slugs(self.model, [row['username'] for row in new_rows])
+
+        users = [
+            self.model(
+                email=row['email'],
+                username=row['username'],
+                password=password_hash,
+                slug=slug,
+                first_name=row['first_name'],
+                last_name=row['last_name'],
+                address=row['address'],
+                city=row['city'],
+                postal_code=row['postal_code'],
+                is_active=True,
+                email_verified=True,
+            )
+            for row, password_hash, slug in zip(new_rows, hashes, slugs)
+        ]
+        from users.changes import record_user_changes
+
+        with transaction.atomic():
+            self.bulk_create(users, batch_size=batch_size)
+            # bulk_create sends no signal, the blog replica is fed here
+            record_user_changes(users, UserChange.ACTION_CREATE)
+        report['created'] += len(users)
+
     def create_superuser(self, email, username, password):
         user = self.create_user(
             email=self.normalize_email(email),
@@ -54,7 +166,7 @@ class User(AbstractUser, PermissionsMixin):
     is_staff = models.BooleanField(default=False)
     is_superuser = models.BooleanField(default=False)
     slug = models.SlugField(null=True, blank=True, unique=True)
-    uuid = models.UUIDField(default=uuid.uuid4, editable=False)
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username',]
@@ -64,10 +176,17 @@ class User(AbstractUser, PermissionsMixin):
     class Meta:
         verbose_name = "user"
         verbose_name_plural = "users"
+        indexes = [
+            # Keyset of UserCursorPagination
+            models.Index(fields=['date_joined', 'id'], name='users_user_joined_id_idx'),
+        ]
 
     def __str__(self):
         return self.email
 
+    def save(self, *args, **kwargs):
+        return save_with_unique_slug(self, 'username', super().save, *args, **kwargs)
+
     def has_perm(self, perm=None, obj=None):
         return self.is_staff
 
@@ -75,6 +194,67 @@ class User(AbstractUser, PermissionsMixin):
         return True
     
 
+class OutboundEmail(models.Model):
+    """
+        Durable outbox of emails sent by the send_queued_mail worker
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    to = models.EmailField(max_length=80)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "outbound email"
+        verbose_name_plural = "outbound emails"
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return "%s -> %s" % (self.subject, self.to)
+
+
+class UserChange(models.Model):
+    """
+        Transactional outbox of User writes, written in the same transaction as the user
+        The id orders the changes and is the version the blog replica stores per row
+    """
+    ACTION_CREATE = 'create'
+    ACTION_UPDATE = 'update'
+    ACTION_DELETE = 'delete'
+    ACTION_CHOICES = (
+        (ACTION_CREATE, 'Create'),
+        (ACTION_UPDATE, 'Update'),
+        (ACTION_DELETE, 'Delete'),
+    )
+
+    user_uuid = models.UUIDField(db_index=True)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = "user change"
+        verbose_name_plural = "user changes"
+
+    def __str__(self):
+        return "%s %s #%s" % (self.action, self.user_uuid, self.pk)
+
+
 # Slug Generator
 def slug_generator(sender, instance, *args, **kwargs):
     if not instance.slug:
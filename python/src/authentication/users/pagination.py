@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+
+class UserCursorPagination(CursorPagination):
+    """
+        Keyset pagination on (date_joined, id), read from users_user_joined_id_idx
+        so a page deep in the list costs the same range scan as the first
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('-date_joined', '-id')
@@ -0,0 +1,43 @@
+from users.models import User
+
+# Output key -> User column of the profile response
+PROFILE_FIELDS = (
+    ('uuid', 'uuid'),
+    ('firstname', 'first_name'),
+    ('lastname', 'last_name'),
+    ('email', 'email'),
+    ('username', 'username'),
+    ('address', 'address'),
+    ('city', 'city'),
+    ('postal_code', 'postal_code'),
+    ('date_joined', 'date_joined'),
+)
+PROFILE_COLUMNS = tuple(column for _, column in PROFILE_FIELDS)
+
+
+def profile_from_row(row):
+    """
+        Profile dict from a .values() row, empty values become None
+        return Dict
+    """
+    return {key: row[column] or None for key, column in PROFILE_FIELDS}
+
+
+def profile_queryset(user_id):
+    return User.objects.filter(pk=user_id, is_active=True).values(*PROFILE_COLUMNS)
+
+
+def get_profile(user_id):
+    """
+        Profile of an active user, only the profile columns are selected
+        return Dict or None
+    """
+    row = next(iter(profile_queryset(user_id)), None)
+    return profile_from_row(row) if row is not None else None
+
+
+async def aget_profile(user_id):
+    row = None
+    async for row in profile_queryset(user_id):
+        break
+    return profile_from_row(row) if row is not None else None
@@ -1,7 +1,32 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from users.models import User
 
 
+class SparseFieldsMixin:
+    """
+        Restrict a serializer to the `?fields=a,b` requested through the view context
+    """
+    @classmethod
+    def sparse_fields(cls, request):
+        """
+            Readable fields requested in the query string
+            return List or None when every field is wanted
+        """
+        requested = request.query_params.get('fields') if request is not None else None
+        if not requested:
+            return None
+        requested = requested.split(',')
+        return [name for name in cls.Meta.fields if name in requested]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.sparse_fields(self.context.get('request'))
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -17,4 +42,44 @@ class UserSerializer(serializers.ModelSerializer):
         if password is not None:
             instance.set_password(password)
         instance.save()
-        return instance       
\ No newline at end of file
+        return instance
+
+
+class UserListSerializer(SparseFieldsMixin, UserSerializer):
+    """
+        Read only user serializer supporting sparse fieldsets
+    """
+    class Meta(UserSerializer.Meta):
+        fields = [name for name in UserSerializer.Meta.fields if name != 'password']
+        read_only_fields = fields
+
+
+class ProfileSerializer(serializers.Serializer):
+    """
+        Documented schema of the profile response (see users.profile)
+    """
+    uuid = serializers.UUIDField()
+    firstname = serializers.CharField(allow_null=True)
+    lastname = serializers.CharField(allow_null=True)
+    email = serializers.EmailField()
+    username = serializers.CharField()
+    address = serializers.CharField(allow_null=True)
+    city = serializers.CharField(allow_null=True)
+    postal_code = serializers.IntegerField(allow_null=True)
+    date_joined = serializers.DateTimeField()
+
+
+class UserTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+        Token pair serializer embedding the public identity claims
+        so other services can trust the token without a user lookup
+    """
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['uuid'] = str(user.uuid)
+        token['email'] = user.email
+        token['username'] = user.username
+        token['is_staff'] = user.is_staff
+        token['is_superuser'] = user.is_superuser
+        return token
@@ -1,11 +1,54 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from auth.metrics import registry as metrics_registry
+from auth.metrics import retire_worker, write_snapshot
+from auth.pool import PooledDatabaseMixin, PoolTimeout, pools
+from auth.replicas import PIN_COOKIE, ReplicaRoutingMiddleware, lag_monitor
+from auth.testing import (QueryBudgetMixin, SQLiteReplicasMixin,
+                          allow_query_repeats, query_budget,
+                          shared_module_drift)
 from auth.utils import account_activation_token
-from users.models import User
+from django.core import mail
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.http import HttpResponse
+from django.test import (AsyncRequestFactory, RequestFactory, SimpleTestCase,
+                         TestCase, TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from users.async_api import AsyncForgotPasswordAPI
+from users.cache import cached_user_response
+from users.cache import stats as cache_stats
+from users.mail import send_queued_emails
+from users.models import OutboundEmail, User, UserChange
+from users.serializers import (ProfileSerializer,
+                               UserTokenObtainPairSerializer)
+from users.throttling import IPThrottle
+from users.tokens import CachedTokenRefreshSerializer, blacklist_key
 from rest_framework import status
+from rest_framework.settings import api_settings
 from rest_framework.test import APITestCase
 from django.urls import reverse
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.token_blacklist.models import (BlacklistedToken,
+                                                             OutstandingToken)
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
 
-class TestUserApp(APITestCase):
+class TestUserApp(QueryBudgetMixin, APITestCase):
     """
         TEST USER MODEL CLASS
     """
@@ -18,6 +61,13 @@ class TestUserApp(APITestCase):
         test_super_user = User.objects.create_superuser(email="laurent.gina@oasis.com", username="Orangina", password="oasisisgood")
         test_user = User.objects.create_user(email="harry.covert@bomduel.com", username="Aricot", password="sicestboncestbomduel")
         test_user_1 = User.objects.create(email="test.user@bomduel.com", username="Whoao", password="sicestboncestbomduel")
+
+    def setUp(self):
+        """
+            Reset the throttle counters and cached responses between tests
+        """
+        super().setUp()
+        caches['default'].clear()
         
     def test_model_user(self):
         """
@@ -44,6 +94,27 @@ class TestUserApp(APITestCase):
         self.assertNotEqual(superuser.slug, user.slug)
         self.assertNotEqual(superuser.uuid, user.uuid)
 
+    def test_similar_usernames_get_unique_slugs(self):
+        """
+            Test if usernames slugifying to the same value get distinct slugs
+        """
+        first = User.objects.create_user(email="john.doe@oasis.com", username="John Doe", password="oasisisgood")
+        second = User.objects.create_user(email="john.doe2@oasis.com", username="john-doe", password="oasisisgood")
+
+        self.assertEqual(first.slug, "john-doe")
+        self.assertEqual(second.slug, "john-doe-2")
+
+    def test_numbered_username_isnt_a_slug_suffix(self):
+        """
+            Test if a username ending with a number doesn't push the suffixes of its prefix
+        """
+        User.objects.create_user(email="top.ten@oasis.com", username="Top 10", password="oasisisgood")
+        first = User.objects.create_user(email="top@oasis.com", username="Top", password="oasisisgood")
+        second = User.objects.create_user(email="top2@oasis.com", username="top", password="oasisisgood")
+
+        self.assertEqual(first.slug, "top")
+        self.assertEqual(second.slug, "top-2")
+
     def test_add_user_with_dummy_email(self):
         """
             Test if user can be add without email field
@@ -101,10 +172,44 @@ class TestUserApp(APITestCase):
             "password": "oasisisgood"
         }
 
-        response = self.client.post(reverse('api-login'), data=context, format='json')
+        with query_budget(5):
+            response = self.client.post(reverse('api-login'), data=context, format='json')
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_login_token_identity_claims(self):
+        """
+            Test if the access token carries the claims needed by stateless services
+        """
+        context = {
+            "email": "laurent.gina@oasis.com",
+            "password": "oasisisgood"
+        }
+        response = self.client.post(reverse('api-login'), data=context, format='json')
+        token = AccessToken(response.data['access'])
+        superuser = User.objects.get(id=1)
+
+        self.assertEqual(token['uuid'], str(superuser.uuid))
+        self.assertEqual(token['email'], superuser.email)
+        self.assertEqual(token['username'], superuser.username)
+        self.assertTrue(token['is_staff'])
+
+    def test_login_rehashes_password_with_policy(self):
+        """
+            Test if a successful login upgrades the stored hash to the configured cost
+        """
+        with self.settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+            context = {
+                "email": "harry.covert@bomduel.com",
+                "password": "sicestboncestbomduel"
+            }
+            response = self.client.post(reverse('api-login'), data=context, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            user = User.objects.get(id=2)
+            self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+            self.assertTrue(user.check_password("sicestboncestbomduel"))
+
     def test_create_user_endpoint(self):
         """
             Create user through the API Endpoint
@@ -114,7 +219,9 @@ class TestUserApp(APITestCase):
             'username': 'Pasteque',
             "password": 'oasisisgood',
         }
-        response = self.client.post(reverse('api-register'), data=context)
+        # Savepoints of the registration transaction are counted as queries
+        with query_budget(9):
+            response = self.client.post(reverse('api-register'), data=context)
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
@@ -149,6 +256,29 @@ class TestUserApp(APITestCase):
             profile_response = self.client.get(path=reverse('api-user-profile'), **auth_headers)
             self.assertEqual(profile_response.status_code, status.HTTP_200_OK)
 
+    def test_user_profile_projection(self):
+        """
+            Test if the profile is read with one narrow query and matches the schema
+        """
+        superuser = User.objects.get(id=1)
+        superuser.postal_code = 75012
+        superuser.save()
+        auth_headers = {
+            'HTTP_AUTHORIZATION': 'Bearer ' + str(UserTokenObtainPairSerializer.get_token(superuser).access_token),
+        }
+        with CaptureQueriesContext(connection) as context:
+            profile_response = self.client.get(path=reverse('api-user-profile'), **auth_headers)
+
+        self.assertEqual(profile_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(profile_response.data), set(ProfileSerializer().fields))
+        self.assertEqual(profile_response.data['postal_code'], 75012)
+        self.assertEqual(profile_response.data['date_joined'], superuser.date_joined)
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertNotIn('"password"', context.captured_queries[0]['sql'])
+
+        with self.assertNumQueries(0):
+            self.client.get(path=reverse('api-user-profile'), **auth_headers)
+
     def test_unauthorized_user_profile_endpoint(self):
         """
             Test if unauthorized user can't access to profile endpoint
@@ -185,7 +315,8 @@ class TestUserApp(APITestCase):
         context = {
             "email":"laurent.gina@oasis.com"
         }
-        response = self.client.post(reverse('api-forgot-password'), data=context)
+        with query_budget(2):
+            response = self.client.post(reverse('api-forgot-password'), data=context)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
     
@@ -243,4 +374,856 @@ class TestUserApp(APITestCase):
         logout_response = self.client.post(reverse('api-blacklist'), data=context, **auth_headers)
         self.assertEqual(logout_response.status_code, status.HTTP_200_OK)
 
+    def test_register_queues_activation_email(self):
+        """
+            Test if registration stores the activation email instead of sending it
+        """
+        context = {
+            "email": 'lapas.tech@oasis.com',
+            'username': 'Pasteque',
+            "password": 'oasisisgood',
+        }
+        response = self.client.post(reverse('api-register'), data=context)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(mail.outbox), 0)
+        queued = OutboundEmail.objects.get(to='lapas.tech@oasis.com')
+        self.assertEqual(queued.status, OutboundEmail.STATUS_PENDING)
+
+        call_command('send_queued_mail', stdout=StringIO())
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['lapas.tech@oasis.com'])
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, OutboundEmail.STATUS_SENT)
+
+    def test_queued_email_retry_with_backoff(self):
+        """
+            Test if a failed send is rescheduled and given up after max attempts
+        """
+        self.client.post(reverse('api-forgot-password'), data={"email": "laurent.gina@oasis.com"})
+        queued = OutboundEmail.objects.get(to='laurent.gina@oasis.com')
+
+        with mock.patch('users.mail.EmailMessage.send', side_effect=OSError("smtp down")), self.assertLogs('users.mail', 'WARNING'):
+            self.assertEqual(send_queued_emails(), (0, 1))
+
+        queued.refresh_from_db()
+        self.assertEqual(queued.attempts, 1)
+        self.assertEqual(queued.status, OutboundEmail.STATUS_PENDING)
+        self.assertGreater(queued.next_attempt_at, queued.created_at)
+        self.assertEqual(send_queued_emails(), (0, 0))
+
+        with self.settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2):
+            OutboundEmail.objects.filter(pk=queued.pk).update(next_attempt_at=queued.created_at)
+            with mock.patch('users.mail.EmailMessage.send', side_effect=OSError("smtp down")), self.assertLogs('users.mail', 'WARNING'):
+                send_queued_emails()
+
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, OutboundEmail.STATUS_FAILED)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def admin_headers(self):
+        response = self.client.post(reverse('api-login'), data={"email": "laurent.gina@oasis.com", "password": "oasisisgood"}, format='json')
+        return {'HTTP_AUTHORIZATION': 'Bearer ' + response.data['access']}
+
+    def test_user_list_cursor_pagination(self):
+        """
+            Test if the user list is paginated with a cursor
+        """
+        auth_headers = self.admin_headers()
+        with query_budget(3):
+            response = self.client.get(reverse('api-user-list'), {'page_size': 2}, **auth_headers)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+
+        next_response = self.client.get(response.data['next'], **auth_headers)
+        self.assertEqual(len(next_response.data['results']), 1)
+        self.assertIsNone(next_response.data['next'])
+
+    def test_user_list_sparse_fields(self):
+        """
+            Test if ?fields= narrows the response and never exposes the password
+        """
+        auth_headers = self.admin_headers()
+        response = self.client.get(reverse('api-user-list'), {'fields': 'uuid,email,password'}, **auth_headers)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data['results'][0]), {'uuid', 'email'})
+
+    def test_user_list_etag(self):
+        """
+            Test if an unchanged user list answers 304 to If-None-Match
+        """
+        auth_headers = self.admin_headers()
+        response = self.client.get(reverse('api-user-list'), **auth_headers)
+        etag = response['ETag']
+
+        cached_response = self.client.get(reverse('api-user-list'), HTTP_IF_NONE_MATCH=etag, **auth_headers)
+        self.assertEqual(cached_response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        User.objects.create_user(email="new.user@oasis.com", username="Newbie", password="oasisisgood")
+        changed_response = self.client.get(reverse('api-user-list'), HTTP_IF_NONE_MATCH=etag, **auth_headers)
+        self.assertEqual(changed_response.status_code, status.HTTP_200_OK)
+
+    def test_user_export_endpoint(self):
+        """
+            Test if the export streams one NDJSON or CSV line per user
+        """
+        auth_headers = self.admin_headers()
+        with query_budget(2):
+            response = self.client.get(reverse('api-user-export'), **auth_headers)
+            lines = b''.join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(len(lines), User.objects.count())
+        self.assertEqual(json.loads(lines[0])['email'], 'laurent.gina@oasis.com')
+
+        csv_response = self.client.get(reverse('api-user-export'), {'output': 'csv'}, **auth_headers)
+        csv_lines = b''.join(csv_response.streaming_content).decode().splitlines()
+        self.assertEqual(len(csv_lines), User.objects.count() + 1)
+
+    def test_export_users_command(self):
+        """
+            Test if the export command writes the same stream to a file
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'users.csv')
+            # One keyset query per row and the empty one ending the stream
+            with self.assertNumQueries(User.objects.count() + 1):
+                call_command('export_users', path, format='csv', chunk_size=1, stderr=StringIO())
+            with open(path) as output:
+                rows = list(csv.DictReader(output))
+
+        self.assertEqual(len(rows), User.objects.count())
+        self.assertEqual(rows[1]['username'], 'Aricot')
+
+    def test_bulk_import_users_command(self):
+        """
+            Test if the import creates valid users with hashed passwords and unique slugs
+        """
+        rows = [
+            {"email": "john.doe@oasis.com", "username": "John Doe", "password": "oasisisgood", "city": "Paris"},
+            {"email": "john.doe2@oasis.com", "username": "john-doe", "password": "oasisisgood"},
+            {"email": "laurent.gina@oasis.com", "username": "Duplicate", "password": "oasisisgood"},
+            {"email": "not an email", "username": "Dummy", "password": "oasisisgood"},
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'users.jsonl')
+            with open(path, 'w') as source:
+                source.write("\n".join(json.dumps(row) for row in rows))
+            out = StringIO()
+            call_command('bulk_import_users', path, batch_size=2, workers=2, stdout=out, stderr=StringIO())
+
+        self.assertIn("Created 2, skipped 1, rejected 1", out.getvalue())
+        first = User.objects.get(email="john.doe@oasis.com")
+        second = User.objects.get(email="john.doe2@oasis.com")
+        self.assertTrue(first.check_password("oasisisgood"))
+        self.assertTrue(first.is_active)
+        self.assertEqual(first.city, "Paris")
+        self.assertEqual(first.slug, "john-doe")
+        self.assertEqual(second.slug, "john-doe-2")
+
+    def test_bulk_import_rejects_invalid_values(self):
+        """
+            Test if a row with a postal code that isn't a number or a too long value is reported, the others created
+        """
+        report = User.objects.bulk_import([
+            {"email": "john.doe@oasis.com", "username": "John", "postal_code": "75001"},
+            {"email": "jane.doe@oasis.com", "username": "Jane", "postal_code": "75A01"},
+            {"email": "jim.doe@oasis.com", "username": "J" * 60},
+            {"email": "joe.doe@oasis.com", "username": "Joe", "postal_code": ""},
+        ], workers=1)
+
+        self.assertEqual(report['created'], 2)
+        self.assertEqual([line for line, _ in report['errors']], [2, 3])
+        self.assertIn("postal_code", report['errors'][0][1])
+        self.assertIn("username", report['errors'][1][1])
+        self.assertEqual(User.objects.get(email="john.doe@oasis.com").postal_code, 75001)
+        self.assertIsNone(User.objects.get(email="joe.doe@oasis.com").postal_code)
+
+    def test_user_response_cache(self):
+        """
+            Test if user responses are cached and invalidated by a write
+        """
+        cache_stats.reset()
+        caches['default'].clear()
+        auth_headers = self.admin_headers()
+        user = User.objects.get(id=2)
+        url = reverse('api-single-user', kwargs={'uuid': user.uuid})
+
+        self.client.get(url, **auth_headers)
+        # Another spelling of the same uuid reads the same entry
+        response = self.client.get(reverse('api-single-user', kwargs={'uuid': user.uuid.hex.upper()}), **auth_headers)
+        self.assertEqual(response.data['username'], 'Aricot')
+        self.assertEqual(cache_stats.as_dict()['hits'], 1)
+
+        # The version moves once the write is committed, not before
+        with self.captureOnCommitCallbacks() as callbacks:
+            user.city = 'Lyon'
+            user.save()
+        self.assertIsNone(self.client.get(url, **auth_headers).data['city'])
+        for callback in callbacks:
+            callback()
+        response = self.client.get(url, **auth_headers)
+        self.assertEqual(response.data['city'], 'Lyon')
+        self.assertEqual(cache_stats.as_dict()['misses'], 2)
+
+        stats_response = self.client.get(reverse('api-user-cache-stats'), **auth_headers)
+        self.assertEqual(stats_response.data['hits'], 2)
+        self.assertEqual(stats_response.data['misses'], 2)
+
+    def test_write_of_another_worker_seen_after_timeout(self):
+        """
+            Test if a user deactivated by another worker isn't served from a locmem cache past a few seconds
+        """
+        caches['default'].clear()
+        auth_headers = self.admin_headers()
+        user = User.objects.get(id=2)
+        url = reverse('api-single-user', kwargs={'uuid': user.uuid})
+        self.client.get(url, **auth_headers)
+        # Saved elsewhere, the on_commit invalidation bumps the version of that worker only
+        User.objects.filter(pk=user.pk).update(is_active=False)
+
+        self.assertFalse(settings.CACHE_SHARED)
+        self.assertLessEqual(settings.USER_CACHE_TIMEOUT, 5)
+        later = time.time() + settings.USER_CACHE_TIMEOUT + 1
+        with mock.patch('time.time', return_value=later):
+            response = self.client.get(url, **auth_headers)
+        self.assertFalse(response.data['is_active'])
+
+    def test_profile_cache_invalidation(self):
+        """
+            Test if the cached profile reflects an update through the API
+        """
+        caches['default'].clear()
+        auth_headers = self.admin_headers()
+        superuser = User.objects.get(id=1)
+        self.client.get(reverse('api-user-profile'), **auth_headers)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            update_response = self.client.patch(reverse('api-update-user', kwargs={'uuid': superuser.uuid}), data={'city': 'Marseille'}, **auth_headers)
+        self.assertEqual(update_response.status_code, status.HTTP_200_OK)
+
+        profile_response = self.client.get(reverse('api-user-profile'), **auth_headers)
+        self.assertEqual(profile_response.data['city'], 'Marseille')
+
+    async def test_async_profile_endpoint(self):
+        """
+            Test if the async profile endpoint authenticates with a JWT
+        """
+        superuser = await User.objects.aget(id=1)
+        refresh = await sync_to_async(RefreshToken.for_user)(superuser)
+        access_token = str(refresh.access_token)
+
+        response = await self.async_client.get(reverse('api-async-user-profile'), AUTHORIZATION='Bearer ' + access_token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['email'], 'laurent.gina@oasis.com')
+
+        unauthorized_response = await self.async_client.get(reverse('api-async-user-profile'))
+        self.assertEqual(unauthorized_response.status_code, status.HTTP_403_FORBIDDEN)
+
+    async def test_async_activate_and_reset_password(self):
+        """
+            Test the async activation and reset password endpoints
+        """
+        user = await User.objects.aget(id=3)
+        token = account_activation_token.make_token(user)
+        response = await self.async_client.get(reverse('api-async-activate', kwargs={'uidb64': user.uuid, 'token': token}))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        user = await User.objects.aget(id=3)
+        self.assertTrue(user.is_active)
+        token = account_activation_token.make_token(user)
+        context = {
+            "password1" : "silaconfianceexistaitleaunecuiraitpaslepoisson",
+            "password2" : "silaconfianceexistaitleaunecuiraitpaslepoisson"
+        }
+        url = reverse('api-async-confirm-reset-password', kwargs={'uidb64': user.uuid, 'token': token})
+        response = await self.async_client.post(url, data=context, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        forgot_response = await self.async_client.post(reverse('api-async-forgot-password'), data={"email": "test.user@bomduel.com"}, content_type='application/json')
+        self.assertEqual(forgot_response.status_code, status.HTTP_200_OK)
+        self.assertTrue(await OutboundEmail.objects.filter(to="test.user@bomduel.com").aexists())
+
+    async def test_async_anonymous_request_user(self):
+        """
+            Test if an async request without token carries an anonymous user, like the DRF views
+        """
+        request = AsyncRequestFactory().post(
+            reverse('api-async-forgot-password'), data={"email": "test.user@bomduel.com"}, content_type='application/json',
+        )
+        response = await AsyncForgotPasswordAPI.as_view()(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(request.user.is_authenticated)
+        self.assertTrue(request.user.is_anonymous)
+
+    async def test_async_logout_endpoint(self):
+        """
+            Test if the async logout blacklists the refresh token
+        """
+        superuser = await User.objects.aget(id=1)
+        refresh = await sync_to_async(RefreshToken.for_user)(superuser)
+
+        response = await self.async_client.post(
+            reverse('api-async-blacklist'), data={"refresh_token": str(refresh)},
+            content_type='application/json', AUTHORIZATION='Bearer ' + str(refresh.access_token),
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(await BlacklistedToken.objects.filter(token__jti=refresh['jti']).aexists())
+
+    def test_refresh_checks_cached_blacklist(self):
+        """
+            Test if a blacklisted refresh token is rejected from the cache
+        """
+        caches['default'].clear()
+        superuser = User.objects.get(id=1)
+        refresh = RefreshToken.for_user(superuser)
+
+        response = self.client.post(reverse('api-refresh-token'), data={'refresh': str(refresh)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            CachedTokenRefreshSerializer(data={'refresh': str(refresh)}).is_valid()
 
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh.blacklist()
+        with self.assertNumQueries(0), self.assertRaises(TokenError):
+            CachedTokenRefreshSerializer(data={'refresh': str(refresh)}).is_valid()
+        response = self.client.post(reverse('api-refresh-token'), data={'refresh': str(refresh)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_miss_read_during_logout_not_cached_over_it(self):
+        """
+            Test if a miss read while a logout commits doesn't replace the blacklisted entry
+        """
+        caches['default'].clear()
+        refresh = RefreshToken.for_user(User.objects.get(id=1))
+        lookup = BlacklistedToken.objects.filter
+
+        def logout_commits_meanwhile(**kwargs):
+            queryset = lookup(**kwargs)
+            # Evaluated before the logout row is there, its commit lands before the miss is cached
+            missing = queryset.exists()
+            with self.captureOnCommitCallbacks(execute=True):
+                refresh.blacklist()
+            return mock.Mock(exists=lambda: missing)
+
+        with mock.patch.object(BlacklistedToken.objects, 'filter', side_effect=logout_commits_meanwhile):
+            self.assertTrue(CachedTokenRefreshSerializer(data={'refresh': str(refresh)}).is_valid())
+        self.assertIs(caches['default'].get(blacklist_key(refresh['jti'])), True)
+        with self.assertNumQueries(0), self.assertRaises(TokenError):
+            CachedTokenRefreshSerializer(data={'refresh': str(refresh)}).is_valid()
+
+    def test_blacklist_reaches_workers_with_cached_miss(self):
+        """
+            Test if a token blacklisted by another worker is rejected once the cached miss expires
+        """
+        caches['default'].clear()
+        superuser = User.objects.get(id=1)
+        refresh = RefreshToken.for_user(superuser)
+        now = time.time()
+        CachedTokenRefreshSerializer(data={'refresh': str(refresh)}).is_valid()
+        self.assertIs(caches['default'].get(blacklist_key(refresh['jti'])), False)
+
+        # Blacklisted by another worker, the signal updating the cache ran over there
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=OutstandingToken.objects.get(jti=refresh['jti']))])
+        self.assertTrue(CachedTokenRefreshSerializer(data={'refresh': str(refresh)}).is_valid())
+
+        later = now + settings.TOKEN_BLACKLIST_MISS_TIMEOUT + 1
+        with mock.patch('time.time', return_value=later), self.assertRaises(TokenError):
+            CachedTokenRefreshSerializer(data={'refresh': str(refresh)}).is_valid()
+
+    def test_prune_tokens_command(self):
+        """
+            Test if only expired outstanding and blacklisted tokens are pruned
+        """
+        superuser = User.objects.get(id=1)
+        expired = RefreshToken.for_user(superuser)
+        expired.blacklist()
+        OutstandingToken.objects.filter(jti=expired['jti']).update(expires_at=timezone.now() - timedelta(days=1))
+        RefreshToken.for_user(superuser)
+
+        out = StringIO()
+        call_command('prune_tokens', chunk_size=1, sleep=0, stdout=out)
+
+        self.assertIn("Pruned 1 expired token(s)", out.getvalue())
+        self.assertFalse(OutstandingToken.objects.filter(jti=expired['jti']).exists())
+        self.assertFalse(BlacklistedToken.objects.exists())
+        self.assertEqual(OutstandingToken.objects.count(), 1)
+
+    def test_login_throttled_by_email(self):
+        """
+            Test if login bursts on one email get a 429 before password checking
+        """
+        rates = dict(api_settings.DEFAULT_THROTTLE_RATES, login_email='2/min')
+        with self.settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES=rates)):
+            context = {
+                "email": "laurent.gina@oasis.com",
+                "password": "wrongpassword"
+            }
+            for _ in range(2):
+                response = self.client.post(reverse('api-login'), data=context, format='json')
+                self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+            with mock.patch('django.contrib.auth.hashers.PBKDF2PasswordHasher.encode') as encode:
+                response = self.client.post(reverse('api-login'), data=context, format='json')
+                encode.assert_not_called()
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertIn('Retry-After', response)
+
+            other_context = {
+                "email": "harry.covert@bomduel.com",
+                "password": "sicestboncestbomduel"
+            }
+            response = self.client.post(reverse('api-login'), data=other_context, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_sliding_window_weights_previous_window(self):
+        """
+            Test if the previous window still counts in proportion to its overlap
+        """
+        throttle = IPThrottle()
+        view = mock.Mock(throttle_scope='login')
+        request = mock.Mock(META={'REMOTE_ADDR': '10.0.0.1'})
+        rates = dict(api_settings.DEFAULT_THROTTLE_RATES, login_ip='4/min')
+        with self.settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES=rates)):
+            with mock.patch.object(IPThrottle, 'timer', return_value=6000 + 50):
+                self.assertTrue(all(throttle.allow_request(request, view) for _ in range(4)))
+                self.assertFalse(throttle.allow_request(request, view))
+            # 30s in the next window: 5 * 0.5 + 1 requests, still allowed
+            with mock.patch.object(IPThrottle, 'timer', return_value=6060 + 30):
+                self.assertTrue(throttle.allow_request(request, view))
+                self.assertFalse(throttle.allow_request(request, view))
+
+    def test_request_metrics_endpoint(self):
+        """
+            Test if requests are aggregated per view and exposed in Prometheus text format
+        """
+        metrics_registry.clear()
+        superuser = User.objects.get(id=1)
+        auth_headers = {
+            'HTTP_AUTHORIZATION': 'Bearer ' + str(UserTokenObtainPairSerializer.get_token(superuser).access_token),
+        }
+        profile_response = self.client.get(path=reverse('api-user-profile'), **auth_headers)
+
+        with self.settings(METRICS_TOKEN='scraper'):
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scraper')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_request_duration_seconds_count{view="api-user-profile"} 1', body)
+        self.assertIn('http_request_queries_sum{view="api-user-profile"} 1', body)
+        self.assertIn('http_request_queries_bucket{view="api-user-profile",le="+Inf"} 1', body)
+        self.assertIn(
+            'http_response_size_bytes_sum{view="api-user-profile"} %d' % len(profile_response.content), body
+        )
+
+        with self.settings(METRICS_TOKEN='scraper'):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+        # Closed while no token is configured
+        with self.settings(METRICS_TOKEN=''):
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer ')
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_metrics_summed_across_workers(self):
+        """
+            Test if /metrics serves the sum of the worker snapshots, the exited workers included without their gauges
+        """
+        metrics_registry.clear()
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        other_worker = {
+            'histograms': [['http_request_queries', 'api-user-profile', [0, 2] + [0] * 9, 2, 2]],
+            'lines': [
+                '# HELP db_pool_connections Open pooled database connections',
+                '# TYPE db_pool_connections gauge',
+                'db_pool_connections{alias="default",state="idle"} 3',
+                '# HELP db_pool_checkouts_total Connections checked out of the pool',
+                '# TYPE db_pool_checkouts_total counter',
+                'db_pool_checkouts_total{alias="default"} 7',
+            ],
+        }
+        write_snapshot(os.path.join(metrics_dir, '1001.json'), other_worker)
+        write_snapshot(os.path.join(metrics_dir, '1002.json'), other_worker)
+        retire_worker(metrics_dir, 1002)
+        metrics_registry.observe('http_request_queries', 'api-user-profile', 1)
+
+        with self.settings(METRICS_TOKEN='scraper', METRICS_DIR=metrics_dir):
+            body = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scraper').content.decode()
+        self.assertIn('http_request_queries_count{view="api-user-profile"} 5', body)
+        self.assertIn('http_request_queries_sum{view="api-user-profile"} 5', body)
+        self.assertIn('http_request_queries_bucket{view="api-user-profile",le="1"} 5', body)
+        self.assertIn('db_pool_connections{alias="default",state="idle"} 3\n', body)
+        self.assertIn('db_pool_checkouts_total{alias="default"} 14\n', body)
+        self.assertEqual(body.count('# TYPE db_pool_connections gauge'), 1)
+        self.assertEqual(sorted(os.listdir(metrics_dir)), ['1001.json', '%d.json' % os.getpid(), 'retired.json'])
+
+    def test_slow_request_log(self):
+        """
+            Test if a request above the query threshold is written to the performance log
+        """
+        superuser = User.objects.get(id=1)
+        auth_headers = {
+            'HTTP_AUTHORIZATION': 'Bearer ' + str(UserTokenObtainPairSerializer.get_token(superuser).access_token),
+        }
+        with self.settings(PERF_SLOW_REQUEST_QUERIES=1), self.assertLogs('performance', 'WARNING') as logs:
+            self.client.get(path=reverse('api-user-profile'), **auth_headers)
+            self.client.get(path=reverse('api-user-profile'), **auth_headers)
+
+        # The second request is served from the cache without a query
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('view=api-user-profile', logs.output[0])
+        self.assertIn('queries=1', logs.output[0])
+
+    async def test_async_request_metrics(self):
+        """
+            Test if queries run by async views through sync_to_async are counted
+        """
+        metrics_registry.clear()
+        superuser = await User.objects.aget(id=1)
+        refresh = await sync_to_async(RefreshToken.for_user)(superuser)
+        await self.async_client.get(reverse('api-async-user-profile'), AUTHORIZATION='Bearer ' + str(refresh.access_token))
+
+        body = metrics_registry.render()
+        self.assertIn('http_request_duration_seconds_count{view="api-async-user-profile"} 1', body)
+        self.assertRegex(body, r'http_request_queries_sum\{view="api-async-user-profile"\} [1-9]')
+
+    @allow_query_repeats(None)
+    def test_query_budget_reports_repeated_shapes(self):
+        """
+            Test if a per row lookup is reported as an N+1 while the batched lookup passes
+        """
+        ids = list(User.objects.values_list('id', flat=True))
+        with self.assertRaisesMessage(AssertionError, 'query shape repeated 3 times'):
+            with query_budget(max_repeats=2):
+                for user_id in ids:
+                    User.objects.get(pk=user_id)
+
+        with query_budget(max_queries=1, max_repeats=1):
+            list(User.objects.filter(pk__in=ids))
+
+        with self.assertRaisesMessage(AssertionError, '2 queries executed, budget is 1'):
+            with query_budget(1):
+                User.objects.get(pk=ids[0])
+                User.objects.filter(pk__in=ids[:2]).count()
+
+    @allow_query_repeats(1)
+    def test_query_budget_scoped_per_request(self):
+        """
+            Test if the repeat limit of the mixin applies to each client request, not to the whole test
+        """
+        auth_headers = self.admin_headers()
+        for _ in range(3):
+            response = self.client.get(reverse('api-user-profile'), **auth_headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_user_changes_recorded(self):
+        """
+            Test if user writes append ordered create, update and delete changes to the outbox
+        """
+        user = User.objects.create_user(email="john.doe@oasis.com", username="John Doe", password="oasisisgood")
+        user.city = "Paris"
+        user.save()
+        user.last_login = timezone.now()
+        user.save(update_fields=['last_login'])
+        user_uuid = user.uuid
+        user.delete()
+
+        changes = list(UserChange.objects.filter(user_uuid=user_uuid).order_by('id'))
+        self.assertEqual([change.action for change in changes], ['create', 'update', 'delete'])
+        self.assertEqual(changes[0].payload['email'], "john.doe@oasis.com")
+        self.assertEqual(changes[1].payload['city'], "Paris")
+        self.assertNotIn('password', changes[1].payload)
+        self.assertEqual(changes[2].payload, {})
+
+    def test_user_changes_of_bulk_import(self):
+        """
+            Test if users created by the bulk import are recorded in the outbox as well
+        """
+        report = User.objects.bulk_import([
+            {"email": "john.doe@oasis.com", "username": "John Doe", "password": "oasisisgood"},
+            {"email": "john.doe2@oasis.com", "username": "john-doe", "password": "oasisisgood"},
+        ], workers=1)
+
+        self.assertEqual(report['created'], 2)
+        changes = UserChange.objects.filter(action=UserChange.ACTION_CREATE, payload__username__startswith='john')
+        self.assertEqual(sorted(change.payload['slug'] for change in changes), ['john-doe', 'john-doe-2'])
+
+    def test_prune_user_changes_command(self):
+        """
+            Test if changes older than the retention are deleted
+        """
+        UserChange.objects.update(created_at=timezone.now() - timedelta(days=30))
+        recent = UserChange.objects.create(user_uuid=User.objects.get(id=1).uuid, action=UserChange.ACTION_UPDATE)
+        out = StringIO()
+        call_command('prune_user_changes', days=7, chunk_size=2, sleep=0, stdout=out)
+
+        self.assertEqual(list(UserChange.objects.values_list('id', flat=True)), [recent.id])
+
+
+class TestReplicaRouting(SQLiteReplicasMixin, QueryBudgetMixin, TransactionTestCase):
+    """
+        TEST READ REPLICA ROUTING
+    """
+    replica_models = (User,)
+
+    def setUp(self):
+        """
+            Same user in the primary and each replica, told apart by its first name
+        """
+        super().setUp()
+        caches['default'].clear()
+        lag_monitor.reset()
+        self.user = User.objects.create_user(email="laurent.gina@oasis.com", username="Orangina", password="oasisisgood")
+        User.objects.filter(pk=self.user.pk).update(first_name="Primary")
+        for alias in self.replica_aliases:
+            copy = User.objects.get(pk=self.user.pk)
+            copy.first_name = alias
+            User.objects.using(alias).bulk_create([copy])
+        self.factory = RequestFactory()
+
+    def first_name_view(self, request):
+        return HttpResponse(User.objects.get(pk=self.user.pk).first_name)
+
+    def routed(self, view, cookies=None):
+        request = self.factory.get('/')
+        request.COOKIES.update(cookies or {})
+        return ReplicaRoutingMiddleware(view)(request)
+
+    def test_request_reads_from_replica(self):
+        """
+            Test if the reads of a request are served by one replica
+        """
+        response = self.routed(self.first_name_view)
+
+        self.assertIn(response.content.decode(), self.replica_aliases)
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_cache_filled_from_primary(self):
+        """
+            Test if cached user responses are built from the primary, a lagging replica
+            would store the previous row under the current version
+        """
+        def view(request):
+            cached = cached_user_response(self.user.uuid, 'first-name', lambda: User.objects.get(pk=self.user.pk).first_name)
+            return HttpResponse("%s,%s" % (User.objects.get(pk=self.user.pk).first_name, cached))
+
+        read, cached = self.routed(view).content.decode().split(',')
+        self.assertIn(read, self.replica_aliases)
+        self.assertEqual(cached, "Primary")
+
+    def test_request_reads_its_writes(self):
+        """
+            Test if a request reads the primary after writing and the client stays on it for a while
+        """
+        def view(request):
+            before = User.objects.get(pk=self.user.pk).first_name
+            User.objects.filter(pk=self.user.pk).update(last_name="Written")
+            after = User.objects.get(pk=self.user.pk).first_name
+            return HttpResponse("%s,%s" % (before, after))
+
+        response = self.routed(view)
+        before, after = response.content.decode().split(',')
+        self.assertIn(before, self.replica_aliases)
+        self.assertEqual(after, "Primary")
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+
+        pinned = self.routed(self.first_name_view, cookies={PIN_COOKIE: '1'})
+        self.assertEqual(pinned.content, b"Primary")
+
+    def test_transactions_and_commands_on_primary(self):
+        """
+            Test if reads inside a transaction or outside a request stay on the primary
+        """
+        def view(request):
+            with transaction.atomic():
+                return HttpResponse(User.objects.get(pk=self.user.pk).first_name)
+
+        self.assertEqual(self.routed(view).content, b"Primary")
+        self.assertEqual(User.objects.get(pk=self.user.pk).first_name, "Primary")
+
+    @override_settings(REPLICA_LAG_CHECK_SECONDS=0)
+    def test_lagging_replica_out_of_rotation(self):
+        """
+            Test if a replica over the lag threshold gets no reads until it catches up
+        """
+        lagging, healthy = self.replica_aliases
+        lags = {lagging: 30.0, healthy: 0.0}
+        with mock.patch('auth.replicas.probe_lag', side_effect=lambda alias: lags[alias]):
+            with self.assertLogs('performance', 'WARNING') as logs:
+                served = {self.routed(self.first_name_view).content.decode() for _ in range(10)}
+            self.assertEqual(served, {healthy})
+            self.assertIn("Replica %s out of rotation" % lagging, logs.output[0])
+
+            with self.assertLogs('performance', 'WARNING'):
+                lags[healthy] = None
+                self.assertEqual(self.routed(self.first_name_view).content, b"Primary")
+
+            with self.assertLogs('performance', 'WARNING') as logs:
+                lags.update({lagging: 1.0, healthy: 1.0})
+                served = {self.routed(self.first_name_view).content.decode() for _ in range(20)}
+            self.assertEqual(served, set(self.replica_aliases))
+            self.assertIn("Replica %s back in rotation" % lagging, "\n".join(logs.output))
+
+
+class PooledSQLiteWrapper(PooledDatabaseMixin, SQLiteDatabaseWrapper):
+    unpooled_engine = 'django.db.backends.sqlite3'
+
+
+class TestConnectionPool(QueryBudgetMixin, TestCase):
+    """
+        TEST POOLED DATABASE CONNECTIONS
+    """
+    alias = 'pool_test'
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'pool.sqlite3')
+        self.wrappers = []
+        self.addCleanup(self.close_wrappers)
+
+    def close_wrappers(self):
+        for wrapper in self.wrappers:
+            wrapper.close()
+        pool = pools.pop(self.alias, None)
+        if pool is not None:
+            pool.close()
+
+    def wrapper(self, **pool):
+        settings_dict = connections.configure_settings({
+            'default': {},
+            self.alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': self.path, 'POOL': pool},
+        })[self.alias]
+        wrapper = PooledSQLiteWrapper(settings_dict, self.alias)
+        self.wrappers.append(wrapper)
+        return wrapper
+
+    def connected(self, **pool):
+        wrapper = self.wrapper(**pool)
+        wrapper.ensure_connection()
+        return wrapper
+
+    def test_connections_reused_and_capped(self):
+        """
+            Test if a closed wrapper gives its connection to the next one and checkouts over MAX_SIZE time out
+        """
+        first, second = self.connected(MAX_SIZE=2, TIMEOUT=0.05), self.connected(MAX_SIZE=2, TIMEOUT=0.05)
+        self.assertIsNot(first.connection, second.connection)
+        third = self.wrapper(MAX_SIZE=2, TIMEOUT=0.05)
+        with self.assertLogs('performance', 'WARNING'), self.assertRaises(PoolTimeout):
+            third.ensure_connection()
+
+        raw = first.connection
+        first.close()
+        third.ensure_connection()
+        self.assertIs(third.connection, raw)
+        pool = pools[self.alias]
+        self.assertEqual((pool.in_use, pool.idle), (2, 0))
+        self.assertEqual(pool.counters['opened'], 2)
+        self.assertEqual(pool.counters['checkouts'], 3)
+        self.assertEqual(pool.counters['timeouts'], 1)
+
+    def test_checkout_waits_for_release(self):
+        """
+            Test if a checkout of a full pool gets the connection another thread releases
+        """
+        holder = self.connected(MAX_SIZE=1, TIMEOUT=5)
+        raw = holder.connection
+        waiter = self.wrapper(MAX_SIZE=1, TIMEOUT=5)
+        holder.inc_thread_sharing()
+        releaser = threading.Timer(0.05, holder.close)
+        releaser.start()
+        waiter.ensure_connection()
+        releaser.join()
+        holder.dec_thread_sharing()
+
+        self.assertIs(waiter.connection, raw)
+        self.assertGreaterEqual(pools[self.alias].wait_time.sum, 0.04)
+        self.assertIn('db_pool_wait_seconds_count{alias="pool_test"} 2', metrics_registry.render())
+
+    def test_dead_connection_replaced(self):
+        """
+            Test if the pre-ping drops a connection that died while idle
+        """
+        first = self.connected()
+        raw = first.connection
+        first.close()
+        raw.close()
+
+        second = self.connected()
+        self.assertIsNot(second.connection, raw)
+        with second.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        self.assertEqual(pools[self.alias].counters['closed_ping'], 1)
+
+    def test_idle_and_old_connections_recycled(self):
+        """
+            Test if idle connections above MIN_SIZE and connections past MAX_LIFETIME are closed
+        """
+        first, second = self.connected(MIN_SIZE=1, MAX_IDLE=0), self.connected(MIN_SIZE=1, MAX_IDLE=0)
+        first.close()
+        second.close()
+        self.connected(MIN_SIZE=1, MAX_IDLE=0)
+        pool = pools[self.alias]
+        self.assertEqual(pool.counters['closed_idle'], 1)
+        self.assertEqual((pool.in_use, pool.idle), (1, 0))
+
+        pools.pop(self.alias).close()
+        self.connected(MAX_LIFETIME=0).close()
+        pool = pools[self.alias]
+        self.assertEqual(pool.counters['closed_lifetime'], 1)
+        self.assertEqual(pool.idle, 0)
+
+    def test_open_transaction_rolled_back(self):
+        """
+            Test if a connection released outside autocommit is rolled back before its reuse
+        """
+        writer = self.connected()
+        with writer.cursor() as cursor:
+            cursor.execute('CREATE TABLE pool_rows (id INTEGER)')
+        writer.set_autocommit(False)
+        with writer.cursor() as cursor:
+            cursor.execute('INSERT INTO pool_rows VALUES (1)')
+        writer.close()
+
+        reader = self.connected()
+        with reader.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM pool_rows')
+            self.assertEqual(cursor.fetchone(), (0,))
+
+
+    def test_errored_connection_not_reused(self):
+        """
+            Test if a connection closed after a database error Django couldn't clear is closed, not pooled
+        """
+        first = self.connected()
+        raw = first.connection
+        first.errors_occurred = True
+        first.close()
+
+        second = self.connected()
+        self.assertIsNot(second.connection, raw)
+        pool = pools[self.alias]
+        self.assertEqual(pool.counters['closed_error'], 1)
+        self.assertEqual(pool.counters['opened'], 2)
+
+class TestSharedModules(SimpleTestCase):
+    """
+        TEST MODULES COPIED IN BOTH SERVICES
+    """
+
+    def test_shared_modules_identical(self):
+        """
+            Test if the shared modules have the same code in both services
+        """
+        drift = shared_module_drift()
+        if drift is None:
+            self.skipTest("The other service isn't checked out")
+        self.assertEqual(drift, [])
@@ -0,0 +1,102 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """
+        Sliding window counter: the previous fixed window is weighted by how much
+        of it still overlaps the sliding window. Two integers per key whatever the rate,
+        one get_many and one incr per request.
+        The rate is `DEFAULT_THROTTLE_RATES['<view.throttle_scope>_<key_name>']`.
+    """
+    key_name = None
+    cache_format = 'throttle_%(scope)s_%(window)s_%(ident)s'
+
+    def __init__(self):
+        # The rate depends on the view scope, see allow_request
+        self.cache = caches[settings.THROTTLE_CACHE_ALIAS]
+
+    def get_rate(self):
+        try:
+            return api_settings.DEFAULT_THROTTLE_RATES[self.scope]
+        except KeyError:
+            raise ImproperlyConfigured("No default throttle rate set for '%s' scope" % self.scope)
+
+    def get_ident_value(self, request):
+        """
+            Value the requests are counted by
+            return String or None to skip the throttle
+        """
+        raise NotImplementedError('.get_ident_value() must be overridden')
+
+    def allow_request(self, request, view):
+        view_scope = getattr(view, 'throttle_scope', None)
+        if not view_scope:
+            return True
+        self.scope = "%s_%s" % (view_scope, self.key_name)
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        if self.rate is None:
+            return True
+
+        ident = self.get_ident_value(request)
+        if ident is None:
+            return True
+
+        self.now = self.timer()
+        window = int(self.now // self.duration)
+        current_key = self.cache_format % {'scope': self.scope, 'window': window, 'ident': ident}
+        previous_key = self.cache_format % {'scope': self.scope, 'window': window - 1, 'ident': ident}
+
+        # add() creates the counter with its expiry, incr() is atomic on shared backends
+        self.cache.add(current_key, 0, timeout=self.duration * 2)
+        try:
+            current = self.cache.incr(current_key)
+        except ValueError:
+            current = 1
+        previous = self.cache.get(previous_key, 0)
+
+        self.elapsed = (self.now % self.duration) / self.duration
+        self.estimated = previous * (1 - self.elapsed) + current
+        return self.estimated <= self.num_requests
+
+    def wait(self):
+        return self.duration * (1 - self.elapsed)
+
+
+class IPThrottle(SlidingWindowThrottle):
+    key_name = 'ip'
+
+    def get_ident_value(self, request):
+        return self.get_ident(request)
+
+
+class RequestFieldThrottle(SlidingWindowThrottle):
+    """
+        Count requests by a (normalized, hashed) field of the request body
+    """
+    field = None
+
+    def get_ident_value(self, request):
+        try:
+            value = request.data.get(self.field)
+        except AttributeError:
+            return None
+        if not value:
+            return None
+        return hashlib.sha1(str(value).strip().lower().encode()).hexdigest()
+
+
+class EmailThrottle(RequestFieldThrottle):
+    key_name = 'email'
+    field = 'email'
+
+
+class UsernameThrottle(RequestFieldThrottle):
+    key_name = 'username'
+    field = 'username'
@@ -0,0 +1,70 @@
+"""
+    Blacklisted JTI lookups served from the USER_CACHE_ALIAS cache.
+    A blacklisted JTI maps to True until its token expires, a JTI found nowhere to False
+    for TOKEN_BLACKLIST_MISS_TIMEOUT seconds at most. BlacklistedToken signals write True
+    once committed and a miss is only added, so a miss read before the logout committed
+    never replaces it. On a shared cache the miss lives as long as the token, on locmem
+    the other workers see the logout once their miss expires.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+def blacklist_key(jti):
+    return "token:blacklisted:%s" % jti
+
+
+def remaining_lifetime(exp):
+    return max(int(exp - time.time()), 1)
+
+
+def is_blacklisted(jti, exp):
+    """
+        Cached membership of a JTI in the token blacklist
+        return Boolean
+    """
+    cache = caches[settings.USER_CACHE_ALIAS]
+    blacklisted = cache.get(blacklist_key(jti))
+    if blacklisted is None:
+        blacklisted = BlacklistedToken.objects.filter(token__jti=jti).exists()
+        if blacklisted:
+            cache.set(blacklist_key(jti), True, timeout=remaining_lifetime(exp))
+        else:
+            cache.add(blacklist_key(jti), False, timeout=min(remaining_lifetime(exp), settings.TOKEN_BLACKLIST_MISS_TIMEOUT))
+    return blacklisted
+
+
+class CachedRefreshToken(RefreshToken):
+    """
+        Refresh token checking the blacklist through the cache
+    """
+    def check_blacklist(self):
+        if is_blacklisted(self.payload[api_settings.JTI_CLAIM], self.payload['exp']):
+            raise TokenError(_("Token is blacklisted"))
+
+
+class CachedTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = CachedRefreshToken
+
+
+def cache_blacklisted(sender, instance, created, **kwargs):
+    # Written once committed, a miss read meanwhile is added before and replaced
+    key, timeout = blacklist_key(instance.token.jti), remaining_lifetime(instance.token.expires_at.timestamp())
+    transaction.on_commit(lambda: caches[settings.USER_CACHE_ALIAS].set(key, True, timeout=timeout))
+
+def uncache_blacklisted(sender, instance, **kwargs):
+    key = blacklist_key(instance.token.jti)
+    transaction.on_commit(lambda: caches[settings.USER_CACHE_ALIAS].delete(key))
+
+post_save.connect(cache_blacklisted, sender=BlacklistedToken)
+post_delete.connect(uncache_blacklisted, sender=BlacklistedToken)
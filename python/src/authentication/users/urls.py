@@ -1,18 +1,27 @@
 from django.urls import path
-from users import api
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from users import api, async_api
+from rest_framework_simplejwt.views import TokenRefreshView
 
 urlpatterns = [
-    path('login/', TokenObtainPairView.as_view(), name='api-login'),
+    path('login/', api.LoginAPI.as_view(), name='api-login'),
     path('resfresh/', TokenRefreshView.as_view(), name='api-refresh-token'),
     path('forgot-password/', api.ForgotPasswordAPI.as_view(), name='api-forgot-password'),
     path('register/', api.UserCreateAPI.as_view(), name='api-register'),
     path('profile/', api.ProfileAPI.as_view(), name='api-user-profile'),
     path('all/', api.UserListAPI.as_view(), name='api-user-list'),
+    path('export/', api.UserExportAPI.as_view(), name='api-user-export'),
+    path('cache-stats/', api.UserCacheStatsAPI.as_view(), name='api-user-cache-stats'),
     path('<uuid>/', api.UserAPI.as_view(), name='api-single-user'),
     path('<uuid>/update', api.UserUpdateAPI.as_view(), name='api-update-user'),
     path('<uuid>/delete', api.UserUpdateAPI.as_view(), name='api-delete-user'),
     path('logout/blacklist/', api.BlacklistAPI.as_view(), name='api-blacklist'),
     path('activate/<uidb64>/<token>', api.ActiveAccountAPI.as_view(), name='api-activate'),
     path('reset-password/<uidb64>/<token>/', api.ResetPasswordAPI.as_view(), name='api-confirm-reset-password'),
+
+    # Async versions, served without a thread per request under auth.asgi
+    path('async/profile/', async_api.AsyncProfileAPI.as_view(), name='api-async-user-profile'),
+    path('async/forgot-password/', async_api.AsyncForgotPasswordAPI.as_view(), name='api-async-forgot-password'),
+    path('async/logout/blacklist/', async_api.AsyncBlacklistAPI.as_view(), name='api-async-blacklist'),
+    path('async/activate/<uidb64>/<token>', async_api.AsyncActiveAccountAPI.as_view(), name='api-async-activate'),
+    path('async/reset-password/<uidb64>/<token>/', async_api.AsyncResetPasswordAPI.as_view(), name='api-async-confirm-reset-password'),
 ]
\ No newline at end of file
@@ -0,0 +1,89 @@
+"""
+Local HTTP load test for the authentication and blog services
+
+    python loadtest.py http://127.0.0.1:8000/api/users/profile/ -c 50 -n 5000 -H "Authorization: Bearer <token>"
+
+Run it against `manage.py runserver` then `gunicorn -c gunicorn.conf.py` to compare throughput.
+"""
+import argparse
+import http.client
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+
+def percentile(values, rank):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * rank / 100))]
+
+
+def run(url, concurrency, total, headers, method='GET', body=None):
+    """
+        Send total requests over concurrency keep-alive connections
+        return Dict (latencies in seconds, statuses, elapsed)
+    """
+    parts = urlsplit(url)
+    path = parts.path + ('?' + parts.query if parts.query else '')
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    local = threading.local()
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def request(_):
+        if not hasattr(local, 'connection'):
+            local.connection = connection_class(parts.netloc, timeout=30)
+        start = time.perf_counter()
+        try:
+            local.connection.request(method, path, body=body, headers=headers)
+            response = local.connection.getresponse()
+            response.read()
+            code = response.status
+        except (OSError, http.client.HTTPException):
+            local.connection.close()
+            del local.connection
+            code = 'error'
+        latency = time.perf_counter() - start
+        with lock:
+            latencies.append(latency)
+            statuses[code] = statuses.get(code, 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(request, range(total)))
+    return {'latencies': latencies, 'statuses': statuses, 'elapsed': time.perf_counter() - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('url')
+    parser.add_argument('-c', '--concurrency', type=int, default=20)
+    parser.add_argument('-n', '--requests', type=int, default=2000)
+    parser.add_argument('-m', '--method', default='GET')
+    parser.add_argument('-d', '--data', default=None, help="Request body (JSON)")
+    parser.add_argument('-H', '--header', action='append', default=[], help="Extra header, 'Name: value'")
+    args = parser.parse_args()
+
+    headers = {'Connection': 'keep-alive'}
+    if args.data:
+        headers['Content-Type'] = 'application/json'
+    for header in args.header:
+        name, value = header.split(':', 1)
+        headers[name.strip()] = value.strip()
+
+    result = run(args.url, args.concurrency, args.requests, headers, method=args.method, body=args.data)
+    latencies = [latency * 1000 for latency in result['latencies']]
+    print("Requests:    %s in %.2fs" % (len(latencies), result['elapsed']))
+    print("Throughput:  %.1f req/s" % (len(latencies) / result['elapsed']))
+    print("Latency ms:  mean %.1f  p50 %.1f  p95 %.1f  p99 %.1f" % (
+        statistics.mean(latencies), percentile(latencies, 50), percentile(latencies, 95), percentile(latencies, 99)
+    ))
+    print("Statuses:    %s" % ", ".join("%s=%s" % item for item in sorted(result['statuses'].items(), key=str)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,404 @@
+# Copied in both services, keep the copies identical (SHARED_MODULES in testing.py)
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+logger = logging.getLogger('performance')
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Metric name -> (help text, bucket upper bounds)
+METRICS = {
+    'http_request_duration_seconds': ("Wall time spent in the view and middlewares", TIME_BUCKETS),
+    'http_request_queries': ("SQL queries issued per request", QUERY_BUCKETS),
+    'http_request_query_duration_seconds': ("Time spent in SQL per request", TIME_BUCKETS),
+    'http_response_size_bytes': ("Bytes sent in the response body", SIZE_BUCKETS),
+}
+UNRESOLVED_VIEW = '<unresolved>'
+# Snapshot of the workers that exited, kept in METRICS_DIR next to the live ones
+RETIRED_SNAPSHOT = 'retired.json'
+
+
+class Histogram:
+    """
+        Fixed buckets histogram, rendered cumulatively as Prometheus expects
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+    """
+        In-process histograms per (metric, view)
+        Every gunicorn worker keeps its own registry and a scrape reaches a single
+        worker, with METRICS_DIR set the workers write snapshots there and /metrics
+        serves their sum (collect_metrics)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._collectors = []
+
+    def register_collector(self, collector):
+        """
+            Add a callable returning extra exposition lines (counters, gauges)
+        """
+        if collector not in self._collectors:
+            self._collectors.append(collector)
+
+    def observe(self, name, view, value):
+        with self._lock:
+            histogram = self._histograms.get((name, view))
+            if histogram is None:
+                histogram = self._histograms[(name, view)] = Histogram(METRICS[name][1])
+            histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def snapshot(self):
+        """
+            State of the registry, JSON serializable
+            return Dict of histograms [name, view, bucket counts, sum, count] and collector lines
+        """
+        with self._lock:
+            histograms = [
+                [name, view, list(histogram.counts), histogram.sum, histogram.count]
+                for (name, view), histogram in sorted(self._histograms.items())
+            ]
+        lines = []
+        for collector in self._collectors:
+            lines.extend(collector())
+        return {'histograms': histograms, 'lines': lines}
+
+    def render(self):
+        """
+            Prometheus text exposition format 0.0.4 of this process
+            return String
+        """
+        return render_snapshot(self.snapshot())
+
+
+registry = MetricsRegistry()
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def parse_number(text):
+    return int(text) if text.lstrip('-').isdigit() else float(text)
+
+
+def merge_snapshots(snapshots, gauges=True):
+    """
+        Sum of registry snapshots, histograms bucket by bucket and collector samples by name and labels
+        gauges=False leaves the gauges out, they describe a process that is gone
+        return Dict
+    """
+    histograms = {}
+    lines = {}
+    kinds = {}
+    for snapshot in snapshots:
+        for name, view, counts, total, count in snapshot['histograms']:
+            merged = histograms.get((name, view))
+            if merged is None:
+                histograms[(name, view)] = [name, view, list(counts), total, count]
+            else:
+                merged[2] = [left + right for left, right in zip(merged[2], counts)]
+                merged[3] += total
+                merged[4] += count
+        for line in snapshot['lines']:
+            if line.startswith('#'):
+                if line.startswith('# TYPE '):
+                    metric, kind = line.split(' ')[2:4]
+                    kinds[metric] = kind
+                lines.setdefault(line, None)
+                continue
+            sample, value = line.rsplit(' ', 1)
+            if not gauges and kinds.get(sample.split('{', 1)[0]) == 'gauge':
+                continue
+            lines[sample] = (lines.get(sample) or 0) + parse_number(value)
+    return {
+        'histograms': [histograms[key] for key in sorted(histograms)],
+        'lines': [key if value is None else '%s %r' % (key, value) for key, value in lines.items()],
+    }
+
+
+def render_snapshot(snapshot):
+    """
+        Prometheus text exposition format 0.0.4
+        return String
+    """
+    lines = []
+    for name, (help_text, buckets) in METRICS.items():
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s histogram" % name)
+        for metric, view, counts, total, count in snapshot['histograms']:
+            if metric != name:
+                continue
+            label = escape_label(view)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('%s_bucket{view="%s",le="%s"} %d' % (name, label, le, cumulative))
+            lines.append('%s_sum{view="%s"} %r' % (name, label, total))
+            lines.append('%s_count{view="%s"} %d' % (name, label, count))
+    lines.extend(snapshot['lines'])
+    return "\n".join(lines) + "\n"
+
+
+def snapshot_path(directory, pid):
+    return os.path.join(directory, '%d.json' % pid)
+
+
+def write_snapshot(path, snapshot):
+    # Written aside then renamed, a scrape never reads half a file
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    with open(temporary, 'w') as file:
+        json.dump(snapshot, file)
+    os.replace(temporary, path)
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def flush_metrics():
+    """
+        Write the snapshot of this worker to METRICS_DIR
+    """
+    if settings.METRICS_DIR:
+        write_snapshot(snapshot_path(settings.METRICS_DIR, os.getpid()), registry.snapshot())
+
+
+_flusher_lock = threading.Lock()
+_flusher_pid = None
+
+
+def flush_periodically():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_SECONDS)
+        try:
+            flush_metrics()
+        except OSError:
+            logger.exception("Metrics snapshot not written to %s", settings.METRICS_DIR)
+
+
+def start_flusher():
+    """
+        Flush the snapshot of this worker every METRICS_FLUSH_SECONDS, once per process
+    """
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid != os.getpid():
+            _flusher_pid = os.getpid()
+            threading.Thread(target=flush_periodically, name='metrics-flush', daemon=True).start()
+
+
+def collect_metrics():
+    """
+        Snapshot served on /metrics: this process alone, or with METRICS_DIR the sum of
+        this worker, the other workers as last flushed and the workers that exited
+        return Dict
+    """
+    if not settings.METRICS_DIR:
+        return registry.snapshot()
+    flush_metrics()
+    names = sorted(name for name in os.listdir(settings.METRICS_DIR) if name.endswith('.json'))
+    snapshots = (read_snapshot(os.path.join(settings.METRICS_DIR, name)) for name in names)
+    return merge_snapshots(snapshot for snapshot in snapshots if snapshot is not None)
+
+
+def retire_worker(directory, pid):
+    """
+        Fold the snapshot of an exited worker into the retired one, run by the gunicorn master
+        Its counters and histograms keep counting in the sum, its gauges are dropped
+    """
+    path = snapshot_path(directory, pid)
+    snapshot = read_snapshot(path)
+    if snapshot is None:
+        return
+    retired_path = os.path.join(directory, RETIRED_SNAPSHOT)
+    retired = read_snapshot(retired_path) or {'histograms': [], 'lines': []}
+    write_snapshot(retired_path, merge_snapshots([retired, snapshot], gauges=False))
+    os.remove(path)
+
+
+def clear_snapshots(directory):
+    """
+        Remove the snapshots of a previous server, run by the gunicorn master on start
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith(('.json', '.tmp')):
+            os.remove(os.path.join(directory, name))
+
+
+class QueryStats:
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+
+# Set by the middleware for the duration of a request, sync_to_async copies it
+# to the thread running the ORM so async views are measured as well
+current_query_stats = ContextVar('current_query_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+        Connection execute wrapper, counts and times the query of the current request
+    """
+    stats = current_query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.duration += time.perf_counter() - start
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install_query_recorders(**kwargs):
+    for connection in connections.all():
+        install_query_recorder(connection)
+
+
+connection_created.connect(install_query_recorder)
+request_started.connect(install_query_recorders)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return UNRESOLVED_VIEW
+    return match.view_name or match._func_path
+
+
+class PerformanceMiddleware:
+    """
+        Records wall time, SQL queries, SQL time and bytes out per view name
+        Must be the first middleware so the whole stack is measured
+        Requests above PERF_SLOW_REQUEST_MS or PERF_SLOW_REQUEST_QUERIES are logged
+        on the `performance` logger
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_query_stats.reset(token)
+        return self.record(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_query_stats.reset(token)
+        return self.record(request, response, stats, time.perf_counter() - start)
+
+    def record(self, request, response, stats, duration):
+        if settings.METRICS_DIR:
+            start_flusher()
+        view = view_name(request)
+        registry.observe('http_request_duration_seconds', view, duration)
+        registry.observe('http_request_queries', view, stats.count)
+        registry.observe('http_request_query_duration_seconds', view, stats.duration)
+        if response.streaming:
+            # Size is only known once the server has consumed the body
+            response.streaming_content = self.count_streamed(response.streaming_content, view)
+            size = None
+        else:
+            size = len(response.content)
+            registry.observe('http_response_size_bytes', view, size)
+
+        if (duration * 1000 >= settings.PERF_SLOW_REQUEST_MS
+                or stats.count >= settings.PERF_SLOW_REQUEST_QUERIES):
+            logger.warning(
+                "Slow request %s %s view=%s status=%s duration=%.1fms queries=%d sql=%.1fms bytes=%s",
+                request.method, request.path, view, response.status_code, duration * 1000,
+                stats.count, stats.duration * 1000, 'streamed' if size is None else size,
+            )
+        return response
+
+    @staticmethod
+    def count_streamed(content, view):
+        size = 0
+        try:
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            registry.observe('http_response_size_bytes', view, size)
+
+
+def metrics_view(request):
+    """
+        Prometheus scrape endpoint
+        Role: Bearer METRICS_TOKEN, closed while the setting is empty
+    """
+    if not settings.METRICS_TOKEN or request.META.get('HTTP_AUTHORIZATION') != 'Bearer %s' % settings.METRICS_TOKEN:
+        return HttpResponse(status=403)
+    return HttpResponse(render_snapshot(collect_metrics()), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,321 @@
+# Copied in both services, keep the copies identical (SHARED_MODULES in testing.py)
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import closing
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError
+
+from blog.metrics import Histogram, escape_label, registry
+
+logger = logging.getLogger('performance')
+
+WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# DATABASES[alias]['POOL'] keys
+POOL_DEFAULTS = {
+    'MIN_SIZE': 1,
+    'MAX_SIZE': 4,
+    'TIMEOUT': 5.0,
+    'MAX_IDLE': 300.0,
+    'MAX_LIFETIME': 1800.0,
+    'PRE_PING': True,
+}
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class PooledConnection:
+    __slots__ = ('connection', 'created_at', 'released_at')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = self.released_at = time.monotonic()
+
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool:
+    """
+        Driver connections of one alias shared by the threads of a process
+        At most MAX_SIZE are open (checked out or idle), a checkout waits up to TIMEOUT
+        for one to be released. Connections are only opened by checkouts: MIN_SIZE is how
+        many the pool keeps once opened, idle ones above it are closed after MAX_IDLE
+        seconds, any connection after MAX_LIFETIME seconds (before MySQL wait_timeout
+        or a proxy drops it). With PRE_PING an idle connection is checked before reuse
+    """
+
+    def __init__(self, alias, options, target=None):
+        options = {**POOL_DEFAULTS, **options}
+        if not 0 <= options['MIN_SIZE'] <= options['MAX_SIZE']:
+            raise ImproperlyConfigured("Pool of %s needs 0 <= MIN_SIZE <= MAX_SIZE" % alias)
+        self.alias = alias
+        self.min_size = options['MIN_SIZE']
+        self.max_size = options['MAX_SIZE']
+        self.timeout = options['TIMEOUT']
+        self.max_idle = options['MAX_IDLE']
+        self.max_lifetime = options['MAX_LIFETIME']
+        self.pre_ping = options['PRE_PING']
+        self.pid = os.getpid()
+        # Database the connections point to, see get_pool
+        self.target = target
+        self._condition = threading.Condition()
+        # Most recently released last, checkouts take it so the oldest ones go idle and get reaped
+        self._idle = deque()
+        self.in_use = 0
+        self.counters = Counter()
+        self.wait_time = Histogram(WAIT_BUCKETS)
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def _expired(self, entry, now):
+        return now - entry.created_at >= self.max_lifetime
+
+    def _reap(self, now):
+        """
+            Remove idle connections past MAX_IDLE (above MIN_SIZE) or MAX_LIFETIME, lock held
+            return List of connections to close once the lock is released
+        """
+        reaped = []
+        for entry in list(self._idle):
+            if self._expired(entry, now):
+                self.counters['closed_lifetime'] += 1
+            elif now - entry.released_at >= self.max_idle and self.idle + self.in_use > self.min_size:
+                self.counters['closed_idle'] += 1
+            else:
+                continue
+            self._idle.remove(entry)
+            reaped.append(entry.connection)
+        return reaped
+
+    def acquire(self, connect, ping):
+        """
+            Check out a connection, opening one with connect() while under MAX_SIZE
+            ping(connection) returns whether an idle connection still works
+            return PooledConnection
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        entry = None
+        with self._condition:
+            reaped = self._reap(start)
+            while not self._idle and self.in_use >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+                reaped += self._reap(time.monotonic())
+            waited = time.monotonic() - start
+            self.wait_time.observe(waited)
+            exhausted = not self._idle and self.in_use >= self.max_size
+            if exhausted:
+                self.counters['timeouts'] += 1
+            else:
+                if self._idle:
+                    entry = self._idle.pop()
+                self.in_use += 1
+                self.counters['checkouts'] += 1
+        for connection in reaped:
+            close_quietly(connection)
+        if exhausted:
+            logger.warning("Database pool %s exhausted, %d connections checked out for %.1fs",
+                           self.alias, self.max_size, waited)
+            raise PoolTimeout("No connection of %s released within %ss" % (self.alias, self.timeout))
+
+        if entry is not None and self.pre_ping and not ping(entry.connection):
+            self.counters['closed_ping'] += 1
+            close_quietly(entry.connection)
+            entry = None
+        if entry is None:
+            try:
+                entry = PooledConnection(connect())
+            except BaseException:
+                self.release(None)
+                raise
+            with self._condition:
+                self.counters['opened'] += 1
+        return entry
+
+    def release(self, entry, reusable=True):
+        """
+            Return a checked out connection, closed instead when it can't be reused
+        """
+        if os.getpid() != self.pid:
+            # Inherited from the parent process, the socket is shared with it
+            return
+        now = time.monotonic()
+        close = None
+        with self._condition:
+            self.in_use -= 1
+            if entry is not None:
+                if reusable and not self._expired(entry, now):
+                    entry.released_at = now
+                    self._idle.append(entry)
+                else:
+                    self.counters['closed_lifetime' if reusable else 'closed_error'] += 1
+                    close = entry.connection
+            self._condition.notify()
+        if close is not None:
+            close_quietly(close)
+
+    def close(self):
+        """
+            Close the idle connections, checked out ones are closed when released
+        """
+        with self._condition:
+            idle, self._idle = self._idle, deque()
+            # Every connection is expired from now on
+            self.max_lifetime = 0
+        for entry in idle:
+            close_quietly(entry.connection)
+
+    def samples(self):
+        """
+            return Dict metric name -> list of (sample name, labels, value)
+        """
+        alias = 'alias="%s"' % escape_label(self.alias)
+        with self._condition:
+            wait_buckets = [
+                ('db_pool_wait_seconds_bucket', '%s,le="%s"' % (alias, '+Inf' if bound == float('inf') else repr(bound)), total)
+                for bound, total in self.wait_time.cumulative()
+            ]
+            return {
+                'db_pool_connections': [
+                    ('db_pool_connections', '%s,state="idle"' % alias, self.idle),
+                    ('db_pool_connections', '%s,state="in_use"' % alias, self.in_use),
+                ],
+                'db_pool_max_connections': [('db_pool_max_connections', alias, self.max_size)],
+                'db_pool_checkouts_total': [('db_pool_checkouts_total', alias, self.counters['checkouts'])],
+                'db_pool_timeouts_total': [('db_pool_timeouts_total', alias, self.counters['timeouts'])],
+                'db_pool_opened_total': [('db_pool_opened_total', alias, self.counters['opened'])],
+                'db_pool_closed_total': [
+                    ('db_pool_closed_total', '%s,reason="%s"' % (alias, reason), self.counters['closed_' + reason])
+                    for reason in ('idle', 'lifetime', 'ping', 'error')
+                ],
+                'db_pool_wait_seconds': wait_buckets + [
+                    ('db_pool_wait_seconds_sum', alias, self.wait_time.sum),
+                    ('db_pool_wait_seconds_count', alias, self.wait_time.count),
+                ],
+            }
+
+
+_pools_lock = threading.Lock()
+pools = {}
+
+
+def pool_target(settings_dict):
+    return tuple(settings_dict.get(key) for key in ('HOST', 'PORT', 'NAME', 'USER'))
+
+
+def get_pool(alias, settings_dict):
+    """
+        Pool of the alias in this process, a forked worker starts with empty pools
+        Pointing the alias to another database (test database creation) retires its pool
+    """
+    target = pool_target(settings_dict)
+    retired = None
+    with _pools_lock:
+        pool = pools.get(alias)
+        if pool is None or pool.pid != os.getpid() or pool.target != target:
+            if pool is not None and pool.pid == os.getpid():
+                retired = pool
+            pool = pools[alias] = ConnectionPool(alias, settings_dict.get('POOL') or {}, target)
+    if retired is not None:
+        retired.close()
+    return pool
+
+
+def close_pools():
+    with _pools_lock:
+        closing = list(pools.values())
+        pools.clear()
+    for pool in closing:
+        if pool.pid == os.getpid():
+            pool.close()
+
+
+# Metric name -> (help text, type)
+POOL_METRICS = {
+    'db_pool_connections': ("Open pooled database connections", 'gauge'),
+    'db_pool_max_connections': ("Per process limit of the pool", 'gauge'),
+    'db_pool_checkouts_total': ("Connections checked out of the pool", 'counter'),
+    'db_pool_timeouts_total': ("Checkouts that gave up waiting for a connection", 'counter'),
+    'db_pool_opened_total': ("Connections opened by the pool", 'counter'),
+    'db_pool_closed_total': ("Connections closed by the pool", 'counter'),
+    'db_pool_wait_seconds': ("Time spent waiting for a pooled connection", 'histogram'),
+}
+
+
+def prometheus_lines():
+    with _pools_lock:
+        current = [pool for _, pool in sorted(pools.items()) if pool.pid == os.getpid()]
+    if not current:
+        return []
+    samples = [pool.samples() for pool in current]
+    lines = []
+    for name, (help_text, kind) in POOL_METRICS.items():
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for pool_samples in samples:
+            for sample, labels, value in pool_samples[name]:
+                lines.append('%s{%s} %r' % (sample, labels, value))
+    return lines
+
+
+registry.register_collector(prometheus_lines)
+
+
+class PooledDatabaseMixin:
+    """
+        DatabaseWrapper mixin checking driver connections out of a ConnectionPool
+        instead of opening one per thread. Closing the wrapper (end of request with
+        CONN_MAX_AGE = 0) gives the connection back, so the threads of a worker share
+        POOL['MAX_SIZE'] connections
+    """
+    # Engine of the same database without the pool, for latency comparisons
+    unpooled_engine = None
+    _pool = None
+    _pool_entry = None
+
+    def ping_connection(self, connection):
+        try:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except self.Database.Error:
+            return False
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias, self.settings_dict)
+        self._pool_entry = pool.acquire(
+            lambda: super(PooledDatabaseMixin, self).get_new_connection(conn_params),
+            self.ping_connection,
+        )
+        self._pool = pool
+        return self._pool_entry.connection
+
+    def _close(self):
+        entry, self._pool_entry = self._pool_entry, None
+        if entry is None or entry.connection is not self.connection:
+            return super()._close()
+        # A transaction left open would leak into the next checkout, a connection that
+        # raised a database error may be broken (Django resets the flag once is_usable() passed)
+        reusable = not self.in_atomic_block and not self.errors_occurred
+        if reusable and not self.autocommit:
+            try:
+                self.connection.rollback()
+            except self.Database.Error:
+                reusable = False
+        self._pool.release(entry, reusable)
@@ -0,0 +1,217 @@
+# Copied in both services, keep the copies identical (SHARED_MODULES in testing.py)
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger('performance')
+
+# Set on responses of requests that wrote, the next requests of the client read the primary
+PIN_COOKIE = 'primary_pin'
+
+
+class RequestRouting:
+    """
+        Database choices of the current request, shared with the threads sync_to_async runs it in
+    """
+    __slots__ = ('pinned', 'wrote', 'replica')
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+        self.replica = None
+
+
+# Only requests read from replicas, commands, workers and background threads stay on the primary
+current_routing = ContextVar('current_routing', default=None)
+
+
+def mysql_lag(cursor):
+    """
+        Seconds_Behind_Source of a MySQL replica (8.0.22+ or older syntax)
+        return Float or None when it isn't replicating
+    """
+    for statement, column in (('SHOW REPLICA STATUS', 'Seconds_Behind_Source'),
+                              ('SHOW SLAVE STATUS', 'Seconds_Behind_Master')):
+        try:
+            cursor.execute(statement)
+        except DatabaseError:
+            continue
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        value = dict(zip([column[0] for column in cursor.description], row)).get(column)
+        return None if value is None else float(value)
+    return None
+
+
+# Connection vendor -> lag probe, vendors without one (SQLite stand-ins) report no lag
+LAG_PROBES = {
+    'mysql': mysql_lag,
+}
+
+
+def probe_lag(alias):
+    """
+        Replication lag of a replica in seconds
+        return Float or None when it is unknown (unreachable, replication stopped)
+    """
+    connection = connections[alias]
+    probe = LAG_PROBES.get(connection.vendor)
+    if probe is None:
+        return 0.0
+    try:
+        with connection.cursor() as cursor:
+            return probe(cursor)
+    except DatabaseError as exc:
+        logger.warning("Replica %s lag probe failed: %s", alias, exc)
+        return None
+
+
+class ReplicaLagMonitor:
+    """
+        Lag of each replica, probed at most every REPLICA_LAG_CHECK_SECONDS per process
+        A replica over REPLICA_MAX_LAG_SECONDS, or whose lag is unknown, is out of rotation
+        until a later probe finds it caught up
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._probes = {}
+
+    def reset(self):
+        with self._lock:
+            self._probes.clear()
+
+    def lag(self, alias):
+        now = time.monotonic()
+        with self._lock:
+            probed = self._probes.get(alias)
+        if probed is not None and now - probed[0] < settings.REPLICA_LAG_CHECK_SECONDS:
+            return probed[1]
+        lag = probe_lag(alias)
+        with self._lock:
+            self._probes[alias] = (now, lag)
+        was_available = probed is None or self.acceptable(probed[1])
+        if was_available != self.acceptable(lag):
+            logger.warning("Replica %s %s rotation, lag=%s", alias, 'back in' if self.acceptable(lag) else 'out of', lag)
+        return lag
+
+    @staticmethod
+    def acceptable(lag):
+        return lag is not None and lag <= settings.REPLICA_MAX_LAG_SECONDS
+
+    def available(self, aliases):
+        return [alias for alias in aliases if self.acceptable(self.lag(alias))]
+
+
+lag_monitor = ReplicaLagMonitor()
+
+
+@contextmanager
+def primary_reads():
+    """
+        Route the reads of the block to the primary, for rows kept beyond the request
+        (cache fills): a replica may serve them up to REPLICA_MAX_LAG_SECONDS old
+    """
+    routing = current_routing.get()
+    if routing is None:
+        yield
+        return
+    pinned, routing.pinned = routing.pinned, True
+    try:
+        yield
+    finally:
+        routing.pinned = pinned
+
+
+def primary_required(routing):
+    # Inside a transaction reads must see its writes
+    return routing.pinned or routing.wrote or connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+
+class ReplicaRouter:
+    """
+        Reads of a request go to one replica of DATABASE_REPLICAS, writes to the primary
+        After its first write a request reads the primary (read your writes) and the client
+        keeps reading it for REPLICA_PIN_SECONDS through the PIN_COOKIE
+    """
+
+    def db_for_read(self, model, **hints):
+        routing = current_routing.get()
+        if routing is None or not settings.DATABASE_REPLICAS or primary_required(routing):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Related rows are read where their instance was
+            return instance._state.db
+        if routing.replica is None:
+            replicas = lag_monitor.available(settings.DATABASE_REPLICAS)
+            if not replicas:
+                return DEFAULT_DB_ALIAS
+            # One replica per request, its reads are consistent with each other
+            routing.replica = random.choice(replicas)
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = current_routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+        Scope replica reads to the request, must come right after PerformanceMiddleware
+        so every other middleware is routed
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        routing = RequestRouting(pinned=PIN_COOKIE in request.COOKIES)
+        token = current_routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        return self.pin(routing, response)
+
+    async def __acall__(self, request):
+        routing = RequestRouting(pinned=PIN_COOKIE in request.COOKIES)
+        token = current_routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        return self.pin(routing, response)
+
+    @staticmethod
+    def pin(routing, response):
+        if routing.wrote and settings.DATABASE_REPLICAS:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,24 @@
+from django.conf import settings
+
+# Unmanaged models mapping tables of the authentication service
+AUTH_MODELS = {'users.AuthUser', 'users.AuthUserChange'}
+
+
+class AuthDatabaseRouter:
+    """
+        Send the authentication service tables to the USER_REPLICATION_DATABASE alias,
+        that database belongs to the other project and is never migrated from here
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label in AUTH_MODELS:
+            return settings.USER_REPLICATION_DATABASE
+        return None
+
+    def db_for_write(self, model, **hints):
+        return self.db_for_read(model, **hints)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == settings.USER_REPLICATION_DATABASE:
+            return False
+        return None
@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 import os
 from django.utils.translation import gettext_lazy as _
 
@@ -46,6 +46,7 @@ INSTALLED_APPS = [
     
     # Usefull Packages
     'corsheaders',
+    'rest_framework',
     'django_filters',
     'drf_spectacular',
 
@@ -54,6 +55,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'blog.metrics.PerformanceMiddleware',
+    'blog.replicas.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
@@ -61,6 +64,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'users.authentication.JWTAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -91,16 +95,91 @@ WSGI_APPLICATION = 'blog.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# Connection pool
+# With DB_POOL the threads of a worker share at most DB_POOL_MAX_SIZE connections per alias,
+# checked out for the duration of a request (CONN_MAX_AGE is then 0). Keep
+# pods * WEB_CONCURRENCY * DB_POOL_MAX_SIZE under MySQL max_connections.
+# DB_POOL_MIN_SIZE connections are kept once opened, the pool doesn't open them ahead of requests
+DB_POOL = config('DB_POOL', default=True, cast=bool)
+DATABASE_POOL = {
+    'MIN_SIZE': config('DB_POOL_MIN_SIZE', default=1, cast=int),
+    'MAX_SIZE': config('DB_POOL_MAX_SIZE', default=4, cast=int),
+    'TIMEOUT': config('DB_POOL_TIMEOUT', default=5, cast=float),
+    'MAX_IDLE': config('DB_POOL_MAX_IDLE', default=300, cast=float),
+    'MAX_LIFETIME': config('DB_POOL_MAX_LIFETIME', default=1800, cast=float),
+    'PRE_PING': config('DB_POOL_PRE_PING', default=True, cast=bool),
+}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'blog.pooled_mysql' if DB_POOL else 'django.db.backends.mysql',
         'NAME': config("DB_NAME"),
         'USER':  config("DB_USER"),
         'PASSWORD': config("DB_PASSWORD"),
         'HOST': config("DB_HOST"),
         'PORT': config("DB_PORT"),
+        'CONN_MAX_AGE': 0 if DB_POOL else int(config('CONN_MAX_AGE')),
+        'POOL': DATABASE_POOL,
+    },
+    # Authentication service database, only its user outbox and users are read
+    'auth': {
+        'ENGINE': config('AUTH_DB_ENGINE', default='django.db.backends.mysql'),
+        'NAME': config('AUTH_DB_NAME', default='auth'),
+        'USER': config('AUTH_DB_USER', default=config('DB_USER')),
+        'PASSWORD': config('AUTH_DB_PASSWORD', default=config('DB_PASSWORD')),
+        'HOST': config('AUTH_DB_HOST', default=config('DB_HOST')),
+        'PORT': config('AUTH_DB_PORT', default=config('DB_PORT')),
         'CONN_MAX_AGE': int(config('CONN_MAX_AGE')),
-    }
+    },
+}
+DATABASE_ROUTERS = ['blog.routers.AuthDatabaseRouter', 'blog.replicas.ReplicaRouter']
+
+# Read replicas
+# DB_REPLICA_HOSTS lists hosts replicating the default database with the same credentials.
+# Reads of a request go to one of them until it writes, replicas more than REPLICA_MAX_LAG_SECONDS
+# behind (probed every REPLICA_LAG_CHECK_SECONDS) are left out until they catch up
+DATABASE_REPLICAS = []
+for index, host in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv()), start=1):
+    DATABASES['replica_%d' % index] = dict(DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append('replica_%d' % index)
+REPLICA_MAX_LAG_SECONDS = config('REPLICA_MAX_LAG_SECONDS', default=5, cast=float)
+REPLICA_LAG_CHECK_SECONDS = config('REPLICA_LAG_CHECK_SECONDS', default=10, cast=float)
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=10, cast=int)
+
+# User replication
+# `replicate_users` applies the authentication UserChange outbox to users.User in batches,
+# changes are read once older than USER_REPLICATION_SETTLE_SECONDS so slower transactions have committed
+USER_REPLICATION_DATABASE = 'auth'
+USER_REPLICATION_BATCH_SIZE = config('USER_REPLICATION_BATCH_SIZE', default=500, cast=int)
+USER_REPLICATION_SETTLE_SECONDS = config('USER_REPLICATION_SETTLE_SECONDS', default=5, cast=int)
+
+# Rest Framework Config
+REST_FRAMEWORK = {
+    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_AUTHENTICATION_CLASSES': (
+        'users.authentication.StatelessJWTAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+    )
+}
+
+# Simple JWT Configuration
+# Tokens are minted by the authentication service, this service only verifies them.
+# HS256 needs the same JWT_SIGNING_KEY on both sides, RS256 only the public JWT_VERIFYING_KEY.
+SIMPLE_JWT = {
+    'ALGORITHM': config('JWT_ALGORITHM', default='HS256'),
+    'SIGNING_KEY': config('JWT_SIGNING_KEY', default=SECRET_KEY),
+    'VERIFYING_KEY': config('JWT_VERIFYING_KEY', default=None),
+    'AUDIENCE': None,
+    'ISSUER': None,
+    'LEEWAY': 0,
+
+    'AUTH_HEADER_TYPES': ('Bearer', 'JWT'),
+    'AUTH_HEADER_NAME': 'HTTP_AUTHORIZATION',
+    'USER_ID_CLAIM': 'user_id',
+    'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
+    'TOKEN_TYPE_CLAIM': 'token_type',
+    'TOKEN_USER_CLASS': 'users.authentication.ClaimsUser',
+    'JTI_CLAIM': 'jti',
 }
 
 FIXTURE_DIRS = [
@@ -146,6 +225,13 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Content addressed media: files are stored once per content under MEDIA_CAS_PREFIX and served immutable.
+# gc_media deletes the ones no row references, after MEDIA_GC_GRACE_SECONDS
+DEFAULT_FILE_STORAGE = 'blog.storage.ContentAddressedStorage'
+MEDIA_CAS_PREFIX = 'cas'
+MEDIA_CACHE_MAX_AGE = config('MEDIA_CACHE_MAX_AGE', default=365 * 24 * 3600, cast=int)
+MEDIA_GC_GRACE_SECONDS = config('MEDIA_GC_GRACE_SECONDS', default=24 * 3600, cast=int)
+
 # CORS HEADERS CONFIGURATION
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_ALLOWED_ORIGINS = [
@@ -173,6 +259,85 @@ CORS_ALLOW_HEADERS = [
     "x-requested-with",
 ]
 
+# Cache Configuration
+# locmem by default, set CACHE_BACKEND/CACHE_LOCATION to share it between workers (redis, memcached)
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='blog-cache'),
+    }
+}
+# Rendered article pages, an in-process LRU capped in bytes in front of the shared cache.
+# After an edit the previous page is served for up to ARTICLE_CACHE_STALE_SECONDS while it is re-rendered.
+# Pages are keyed by the updated_at of their article, read again every ARTICLE_CACHE_STATE_SECONDS.
+# Run several workers with a shared CACHE_BACKEND: with locmem an edit only reaches the cache of the
+# worker that saved it, the others serve the previous page until its state expires.
+ARTICLE_CACHE_ALIAS = 'default'
+ARTICLE_CACHE_TIMEOUT = config('ARTICLE_CACHE_TIMEOUT', default=3600, cast=int)
+ARTICLE_CACHE_STATE_SECONDS = config('ARTICLE_CACHE_STATE_SECONDS', default=5, cast=int)
+ARTICLE_CACHE_STALE_SECONDS = config('ARTICLE_CACHE_STALE_SECONDS', default=60, cast=int)
+ARTICLE_CACHE_LOCAL_MAX_BYTES = config('ARTICLE_CACHE_LOCAL_MAX_BYTES', default=32 * 1024 * 1024, cast=int)
+# Threads per process running the page re-renders and image variant tasks, extra tasks wait in a queue
+BACKGROUND_THREADS = config('BACKGROUND_THREADS', default=2, cast=int)
+
+# Media uploads
+# Thumbnails and medias are checked while they stream: the request is cut past MEDIA_UPLOAD_MAX_SIZE
+# and files whose magic bytes aren't in MEDIA_UPLOAD_TYPES are dropped before being buffered
+MEDIA_UPLOAD_MAX_SIZE = config('MEDIA_UPLOAD_MAX_SIZE', default=5 * 1024 * 1024, cast=int)
+MEDIA_UPLOAD_FIELDS = ('thumbnail', 'media')
+MEDIA_UPLOAD_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp')
+FILE_UPLOAD_HANDLERS = [
+    'blog.uploads.MediaMemoryFileUploadHandler',
+    'blog.uploads.MediaTemporaryFileUploadHandler',
+]
+
+# Article image variants
+# Resized copies of thumbnails and medias, rendered in a process pool after upload (0 workers renders inline)
+IMAGE_VARIANT_WIDTHS = tuple(config('IMAGE_VARIANT_WIDTHS', default='320,640,1280', cast=lambda value: [int(width) for width in value.split(',')]))
+IMAGE_VARIANT_FORMATS = tuple(config('IMAGE_VARIANT_FORMATS', default='webp,jpeg', cast=lambda value: value.split(',')))
+IMAGE_VARIANT_QUALITY = config('IMAGE_VARIANT_QUALITY', default=80, cast=int)
+IMAGE_VARIANT_WORKERS = config('IMAGE_VARIANT_WORKERS', default=2, cast=int)
+IMAGE_VARIANT_LOCK_SECONDS = config('IMAGE_VARIANT_LOCK_SECONDS', default=300, cast=int)
+
+# Article search
+# Inverted index of title, short_desc and description kept up to date on save, results ranked with BM25.
+# Articles written before the index (or without signals) are indexed by `manage.py rebuild_search_index`.
+# Article count and average length are cached SEARCH_STATS_CACHE_SECONDS, queries keep their first SEARCH_MAX_QUERY_TERMS terms.
+# Terms in more than SEARCH_COMMON_TERM_RATIO of the articles only rank the articles matched by the rarer terms of the query
+SEARCH_BM25_K1 = config('SEARCH_BM25_K1', default=1.2, cast=float)
+SEARCH_BM25_B = config('SEARCH_BM25_B', default=0.75, cast=float)
+SEARCH_STATS_CACHE_SECONDS = config('SEARCH_STATS_CACHE_SECONDS', default=60, cast=int)
+SEARCH_MAX_QUERY_TERMS = config('SEARCH_MAX_QUERY_TERMS', default=10, cast=int)
+SEARCH_COMMON_TERM_RATIO = config('SEARCH_COMMON_TERM_RATIO', default=0.1, cast=float)
+
+# Performance instrumentation
+# Histograms are served on /metrics, requests above either threshold are logged on `performance`
+PERF_SLOW_REQUEST_MS = config('PERF_SLOW_REQUEST_MS', default=500, cast=int)
+PERF_SLOW_REQUEST_QUERIES = config('PERF_SLOW_REQUEST_QUERIES', default=50, cast=int)
+# Required, /metrics answers 403 until it is set
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+# Directory shared by the workers of a server, /metrics then sums them instead of answering for one worker
+# (gunicorn.conf.py clears it on start), snapshots are written every METRICS_FLUSH_SECONDS
+METRICS_DIR = config('METRICS_DIR', default='')
+METRICS_FLUSH_SECONDS = config('METRICS_FLUSH_SECONDS', default=5, cast=int)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'performance': {
+            'handlers': ['console'],
+            'level': config('PERF_LOG_LEVEL', default='WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -0,0 +1,169 @@
+# Copied in both services, keep the copies identical (SHARED_MODULES in testing.py)
+"""
+    Unique slugs of the models with a slug field (users, articles)
+"""
+import itertools
+import random
+import re
+import string
+import threading
+from collections import OrderedDict
+
+from django.db import IntegrityError, transaction
+from django.utils.text import slugify
+
+
+def random_string_generator(size=10, chars=string.ascii_lowercase + string.digits):
+    """
+        Generate a random string
+        return String (ascii && lowercase)
+    """
+    return ''.join(random.choice(chars) for _ in range(size))
+
+def unique_user_slug_generator(instance, new_slug=None):
+    """
+        Unique slug generator with model username field
+        return String
+    """
+    return new_slug or allocate_slug(instance.__class__, instance.username)
+
+def unique_slug_generator(instance, new_slug=None):
+    """
+        Unique slug generator with model title field
+        return String
+    """
+    return new_slug or allocate_slug(instance.__class__, instance.title)
+
+
+class SlugCache:
+    """
+        Thread safe LRU of the next free suffix per (model, base slug)
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def next_suffix(self, key):
+        """
+            Reserve the cached suffix of a key
+            return Integer or None when the key isn't cached
+        """
+        with self._lock:
+            suffix = self._data.get(key)
+            if suffix is None:
+                return None
+            self._data[key] = suffix + 1
+            self._data.move_to_end(key)
+            return suffix
+
+    def set(self, key, suffix):
+        with self._lock:
+            self._data[key] = suffix
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+slug_cache = SlugCache()
+SLUG_SAVE_ATTEMPTS = 5
+
+
+def reserved_slugs(klass):
+    """
+        Slugs never allocated to a model, e.g. the ones shadowed by a fixed url
+        of its routes, set with a RESERVED_SLUGS model attribute
+        return Tuple of String
+    """
+    return tuple(getattr(klass, 'RESERVED_SLUGS', ()))
+
+
+def slug_base(klass, value):
+    """
+        Slugified value truncated to leave room for a -N suffix
+        return String
+    """
+    max_length = klass._meta.get_field('slug').max_length
+    return slugify(value)[:max_length - 7].strip('-') or random_string_generator(size=8)
+
+
+def allocate_slug(klass, value):
+    """
+        Unique slug allocator shared by every model with a slug field
+        Free suffixes are found with a single prefix query, then served from the cache
+        The first free one of base, base-2, base-3... is taken: a slug such as
+        top-10 from the title "Top 10" isn't read as the tenth "Top"
+        Reserved slugs of the model count as taken
+        return String
+    """
+    base = slug_base(klass, value)
+    key = (klass._meta.label, base)
+    suffix = slug_cache.next_suffix(key)
+    if suffix is not None:
+        return "%s-%s" % (base, suffix)
+
+    pattern = re.compile(r'^%s(?:-(\d+))?$' % re.escape(base))
+    used = set()
+    taken = klass._default_manager.filter(slug__startswith=base).values_list('slug', flat=True).iterator()
+    for slug in itertools.chain(reserved_slugs(klass), taken):
+        match = pattern.match(slug)
+        if match:
+            used.add(int(match.group(1) or 1))
+    suffix = 1
+    while suffix in used:
+        suffix += 1
+    # A cached suffix running into an unrelated slug fails the save, which allocates again
+    slug_cache.set(key, suffix + 1)
+    return base if suffix == 1 else "%s-%s" % (base, suffix)
+
+
+def save_with_unique_slug(instance, source, save, *args, **kwargs):
+    """
+        Call a model save, allocating a new slug from the source field
+        when a concurrent writer took the generated one
+        return Save result
+    """
+    generated = not instance.slug
+    klass = instance.__class__
+    for attempt in range(SLUG_SAVE_ATTEMPTS):
+        try:
+            with transaction.atomic(using=kwargs.get('using')):
+                return save(*args, **kwargs)
+        except IntegrityError:
+            conflict = generated and klass._default_manager.filter(slug=instance.slug).exists()
+            if not conflict or attempt == SLUG_SAVE_ATTEMPTS - 1:
+                raise
+            slug_cache.discard((klass._meta.label, slug_base(klass, getattr(instance, source))))
+            instance.slug = allocate_slug(klass, getattr(instance, source))
+
+
+def bulk_unique_slugs(klass, values):
+    """
+        Unique slugs for a batch of values, resolved in memory
+        Collisions get the first free -2, -3... suffix, one query per round
+        return List of String (same order as values)
+    """
+    slugs = [slug_base(klass, value) for value in values]
+    candidates = dict(enumerate(slugs))
+    reserved = set(reserved_slugs(klass))
+    suffix = 1
+    while candidates:
+        taken = set(klass.objects.filter(slug__in=set(candidates.values())).values_list('slug', flat=True))
+        collided = {}
+        for index, slug in candidates.items():
+            if slug in taken or slug in reserved:
+                collided[index] = slug
+            else:
+                reserved.add(slug)
+                slugs[index] = slug
+        suffix += 1
+        candidates = {index: "%s-%s" % (slug_base(klass, values[index]), suffix) for index in collided}
+    return slugs
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import posixpath
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.http import FileResponse, Http404
+
+from blog.uploads import SNIFF_LENGTH, sniff_content_type
+
+# Sniffed content type -> blob extension, anything else is stored without one
+BLOB_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+}
+BLOB_CONTENT_TYPES = {extension: content_type for content_type, extension in BLOB_EXTENSIONS.items()}
+
+
+def content_sha256(content):
+    """
+        Hex sha256 of a file, read by chunks
+        Uploads hashed while they streamed (blog.uploads) aren't read again
+        return String
+    """
+    digest = getattr(content, 'content_sha256', None)
+    if digest:
+        return digest
+    sha256 = hashlib.sha256()
+    for chunk in content.chunks():
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def content_extension(content):
+    """
+        Blob extension from the magic bytes of a file, the name given by the client is never trusted
+        Uploads sniffed while they streamed (blog.uploads) aren't read again
+        return String, empty when the content isn't a known image
+    """
+    content_type = getattr(content, 'sniffed_content_type', None)
+    if not content_type:
+        content.seek(0)
+        content_type = sniff_content_type(content.read(SNIFF_LENGTH))
+        content.seek(0)
+    return BLOB_EXTENSIONS.get(content_type, '')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+        File system storage naming files after the sha256 of their content
+        cas/ab/ab12...ef.png whatever the upload_to and file name, the extension
+        follows the sniffed content so an uploaded x.html is never served as a page. Saving a content
+        already stored returns the existing name without writing it again.
+        A stored file never changes so it can be cached forever (serve_blob),
+        rows referencing it are counted by core.blobs and gc_media removes the others
+    """
+
+    @property
+    def prefix(self):
+        return settings.MEDIA_CAS_PREFIX
+
+    def blob_name(self, digest, extension):
+        return posixpath.join(self.prefix, digest[:2], digest + extension)
+
+    def is_blob(self, name):
+        return name.startswith(self.prefix + '/')
+
+    def _save(self, name, content):
+        target = self.blob_name(content_sha256(content), content_extension(content))
+        if self.exists(target):
+            # A row is about to reference it again, keep it out of the collector grace window
+            os.utime(self.path(target))
+            return target
+        saved = super()._save(target, content)
+        if saved != target:
+            # Written concurrently by another upload, same content under the same name
+            self.delete(saved)
+        return target
+
+
+def serve_blob(request, path):
+    """
+        Content addressed media, the URL changes with the content so it never expires
+        Served with the type of its extension, which only ever comes from the sniffed
+        content, and nosniff so browsers don't guess another one
+        Role: Public
+    """
+    full_path = default_storage.path(path)
+    if not os.path.isfile(full_path):
+        raise Http404("Media not found")
+    content_type = BLOB_CONTENT_TYPES.get(posixpath.splitext(path)[1], 'application/octet-stream')
+    response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    response['X-Content-Type-Options'] = 'nosniff'
+    response['Cache-Control'] = 'public, max-age=%d, immutable' % settings.MEDIA_CACHE_MAX_AGE
+    return response
@@ -0,0 +1,209 @@
+# Copied in both services, keep the copies identical (SHARED_MODULES in testing.py)
+import os
+import re
+import shutil
+import sys
+import tempfile
+from collections import Counter
+from contextlib import ContextDecorator
+from functools import wraps
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from decouple import config
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext, override_settings
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+# Modules copied in both services, identical but for the project package (auth, blog)
+# A fix goes in both copies, shared_module_drift() tells which ones differ
+SHARED_MODULES = (
+    'metrics.py',
+    'pool.py',
+    'pooled_mysql/__init__.py',
+    'pooled_mysql/base.py',
+    'replicas.py',
+    'slugs.py',
+    'testing.py',
+)
+# Service directory -> project package
+SERVICE_PACKAGES = {
+    'authentication': 'auth',
+    'service': 'blog',
+}
+
+# Same shape repeated above this in a single test client request is reported as an N+1
+DEFAULT_QUERY_REPEAT_LIMIT = config('TEST_QUERY_REPEAT_LIMIT', default=5, cast=int)
+
+
+def shared_module_drift():
+    """
+        SHARED_MODULES whose copies differ once the package names are folded
+        return List of module paths, None when the services aren't both checked out (built image)
+    """
+    src = Path(__file__).resolve().parents[2]
+    packages = re.compile(r'\b(?:%s)\b' % '|'.join(SERVICE_PACKAGES.values()))
+    copies = {}
+    for service, package in SERVICE_PACKAGES.items():
+        directory = src / service / package
+        if not directory.is_dir():
+            return None
+        for module in SHARED_MODULES:
+            source = (directory / module).read_text()
+            copies.setdefault(module, set()).add(packages.sub('PROJECT', source))
+    return [module for module, sources in copies.items() if len(sources) > 1]
+
+
+def sql_shape(sql):
+    """
+        SQL with literals and IN lists folded, so the same query with other values
+        has the same shape
+        return String
+    """
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER_LITERAL.sub('?', sql)
+    sql = PLACEHOLDER_LIST.sub('(...)', sql)
+    return WHITESPACE.sub(' ', sql).strip()
+
+
+class query_budget(ContextDecorator):
+    """
+        Fails when the wrapped block issues more than max_queries queries, or
+        repeats one query shape more than max_repeats times
+        Works as a context manager and as a decorator of sync or async tests
+
+            with query_budget(2):
+                self.client.get(reverse('api-user-profile'))
+    """
+
+    def __init__(self, max_queries=None, max_repeats=None, using=DEFAULT_DB_ALIAS):
+        self.max_queries = max_queries
+        self.max_repeats = max_repeats
+        self.using = using
+        self.context = None
+
+    def _recreate_cm(self):
+        # Each call of a decorated function, nested ones included, counts its own queries
+        return type(self)(self.max_queries, self.max_repeats, self.using)
+
+    def __call__(self, func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def inner(*args, **kwargs):
+                # Captured on the thread running the ORM calls of async code
+                budget = self._recreate_cm()
+                await sync_to_async(budget.__enter__)()
+                try:
+                    result = await func(*args, **kwargs)
+                except BaseException:
+                    await sync_to_async(budget.__exit__)(*sys.exc_info())
+                    raise
+                await sync_to_async(budget.__exit__)(None, None, None)
+                return result
+            return inner
+        return super().__call__(func)
+
+    def __enter__(self):
+        self.context = CaptureQueriesContext(connections[self.using])
+        self.context.__enter__()
+        return self.context
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.context.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None:
+            self.check(self.context.captured_queries)
+        return False
+
+    def check(self, queries):
+        problems = []
+        if self.max_queries is not None and len(queries) > self.max_queries:
+            problems.append("%d queries executed, budget is %d" % (len(queries), self.max_queries))
+        if self.max_repeats is not None:
+            shapes = Counter(sql_shape(query['sql']) for query in queries)
+            problems.extend(
+                "query shape repeated %d times, limit is %d (N+1?): %s" % (count, self.max_repeats, shape)
+                for shape, count in shapes.most_common() if count > self.max_repeats
+            )
+        if problems:
+            captured = "\n".join(
+                "%d. %s" % (index, query['sql']) for index, query in enumerate(queries, start=1)
+            )
+            raise AssertionError("\n".join(problems) + "\nCaptured queries were:\n" + captured)
+
+
+def allow_query_repeats(limit):
+    """
+        Raise QueryBudgetMixin repeat limit for a single test, None disables it
+    """
+    def decorator(test):
+        test.query_repeat_limit = limit
+        return test
+    return decorator
+
+
+class QueryBudgetMixin:
+    """
+        TestCase mixin failing any request of the test clients where one SQL shape
+        repeats more than query_repeat_limit times. Each request is counted on its own,
+        queries of the test body are checked with query_budget blocks
+    """
+    query_repeat_limit = DEFAULT_QUERY_REPEAT_LIMIT
+
+    def setUp(self):
+        super().setUp()
+        # Looked up on the class, async tests are wrapped on the instance by Django
+        test = getattr(type(self), self._testMethodName)
+        limit = getattr(test, 'query_repeat_limit', self.query_repeat_limit)
+        if limit is not None:
+            for client in (self.client, self.async_client):
+                client.request = query_budget(max_repeats=limit)(client.request)
+
+
+class SQLiteReplicasMixin:
+    """
+        TransactionTestCase mixin standing SQLite files in for read replicas
+        DATABASE_REPLICAS points to replica_count files with empty replica_models tables,
+        put rows in them with .using(alias) to tell which database answered a read
+    """
+    replica_count = 2
+    replica_models = ()
+
+    @classmethod
+    def setUpClass(cls):
+        directory = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, directory, ignore_errors=True)
+        cls.replica_aliases = ['replica_test_%d' % index for index in range(1, cls.replica_count + 1)]
+        for alias in cls.replica_aliases:
+            connections.settings[alias] = connections.configure_settings({
+                DEFAULT_DB_ALIAS: {},
+                alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(directory, alias + '.sqlite3')},
+            })[alias]
+            cls.addClassCleanup(cls.remove_replica, alias)
+        cls.databases = set(cls.databases) | set(cls.replica_aliases)
+        replicas = override_settings(DATABASE_REPLICAS=cls.replica_aliases)
+        replicas.enable()
+        cls.addClassCleanup(replicas.disable)
+        super().setUpClass()
+
+    @classmethod
+    def remove_replica(cls, alias):
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+
+    def setUp(self):
+        super().setUp()
+        for alias in self.replica_aliases:
+            with connections[alias].schema_editor() as editor:
+                for model in self.replica_models:
+                    editor.create_model(model)
+            self.addCleanup(self.drop_replica_tables, alias)
+
+    def drop_replica_tables(self, alias):
+        with connections[alias].schema_editor() as editor:
+            for model in self.replica_models:
+                editor.delete_model(model)
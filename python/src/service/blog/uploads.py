@@ -0,0 +1,142 @@
+import hashlib
+
+from django.conf import settings
+from django.core.files.uploadhandler import (MemoryFileUploadHandler,
+                                             SkipFile, StopUpload,
+                                             TemporaryFileUploadHandler)
+
+# Leading bytes -> content type, WebP also needs `WEBP` at offset 8
+MAGIC_NUMBERS = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'RIFF', 'image/webp'),
+)
+SNIFF_LENGTH = 12
+
+
+def sniff_content_type(head):
+    """
+        Content type from the first bytes of a file
+        return String or None when the signature is unknown
+    """
+    for magic, content_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            if content_type == 'image/webp' and head[8:12] != b'WEBP':
+                return None
+            return content_type
+    return None
+
+
+def upload_field(field_name):
+    """
+        Model field behind a form field name, inline prefixes are dropped
+        articleimage_set-0-media -> media
+    """
+    return field_name.rsplit('-', 1)[-1]
+
+
+def size_error():
+    return "La taille maximal autorisée est de %s MB" % (settings.MEDIA_UPLOAD_MAX_SIZE // (1024 * 1024))
+
+
+class MediaUploadMixin:
+    """
+        Validate media uploads while they stream, before they are buffered
+        Counts bytes and aborts the request past MEDIA_UPLOAD_MAX_SIZE, checks the
+        magic bytes against MEDIA_UPLOAD_TYPES and hashes the content in the same pass.
+        Rejections are kept in request.upload_errors, accepted files get
+        content_sha256 and sniffed_content_type attributes
+    """
+
+    def new_file(self, field_name, *args, **kwargs):
+        # Set first, the memory handler stops the chain from its new_file
+        self.guarded = upload_field(field_name) in settings.MEDIA_UPLOAD_FIELDS
+        self.received = 0
+        self.head = b''
+        self.sniffed_type = None
+        self.sha256 = hashlib.sha256()
+        super().new_file(field_name, *args, **kwargs)
+
+    def stores_data(self):
+        """
+            Whether this handler keeps the chunks, only that one validates them
+        """
+        return True
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.guarded and self.stores_data():
+            self.received += len(raw_data)
+            if self.received > settings.MEDIA_UPLOAD_MAX_SIZE:
+                self.reject(size_error())
+                # Stop reading the request body, the rest is never received
+                raise StopUpload(connection_reset=True)
+            if self.sniffed_type is None:
+                self.head += raw_data[:SNIFF_LENGTH - len(self.head)]
+                if len(self.head) >= SNIFF_LENGTH and not self.check_type():
+                    raise SkipFile()
+            self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        validated = self.guarded and self.stores_data()
+        if validated and self.sniffed_type is None:
+            # Shorter than the signature, kept but reported on the form
+            self.check_type()
+        file = super().file_complete(file_size)
+        if file is not None and validated:
+            file.content_sha256 = self.sha256.hexdigest()
+            file.sniffed_content_type = self.sniffed_type
+            file.content_type = self.sniffed_type
+        return file
+
+    def check_type(self):
+        """
+            Sniff the received head, the rejection is recorded when the type isn't allowed
+            return Boolean
+        """
+        self.sniffed_type = sniff_content_type(self.head)
+        if self.sniffed_type not in settings.MEDIA_UPLOAD_TYPES:
+            self.reject("Type de fichier non autorisé, formats acceptés : %s" % ", ".join(settings.MEDIA_UPLOAD_TYPES))
+            return False
+        return True
+
+    def reject(self, message):
+        if not hasattr(self.request, 'upload_errors'):
+            self.request.upload_errors = {}
+        self.request.upload_errors[self.field_name] = message
+
+
+class MediaMemoryFileUploadHandler(MediaUploadMixin, MemoryFileUploadHandler):
+    def stores_data(self):
+        return self.activated
+
+
+class MediaTemporaryFileUploadHandler(MediaUploadMixin, TemporaryFileUploadHandler):
+    pass
+
+
+class UploadErrorsFormMixin:
+    """
+        Report the uploads rejected by the handlers on the form fields
+    """
+    upload_errors = {}
+
+    def clean(self):
+        cleaned_data = super().clean()
+        for name in self.fields:
+            message = self.upload_errors.get(self.add_prefix(name))
+            if message is not None:
+                self.add_error(name, message)
+        return cleaned_data
+
+
+def form_with_upload_errors(form_class, request):
+    """
+        Subclass of a form bound to the rejections of a request
+        return Form class
+    """
+    return type(form_class.__name__, (UploadErrorsFormMixin, form_class), {
+        'upload_errors': getattr(request, 'upload_errors', {}),
+    })
@@ -13,9 +13,16 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path, re_path
+
+from blog.metrics import metrics_view
+from blog.storage import serve_blob
 
 urlpatterns = [
+    path('api/articles/', include('core.urls')),
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
+    re_path(r'^%s(?P<path>%s/.+)$' % (settings.MEDIA_URL.lstrip('/'), settings.MEDIA_CAS_PREFIX), serve_blob, name='media-blob'),
 ]
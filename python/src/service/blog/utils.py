@@ -1,53 +1,19 @@
-import random
-import string
-
 import six
+from django.conf import settings
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from django.core.exceptions import ValidationError
-from django.utils.text import slugify
 
 
 def validate_media(file):
     """
-        Check if image length is greater than 5 Mb
+        Check if image length is greater than MEDIA_UPLOAD_MAX_SIZE (5 Mb)
+        Uploads are already cut at the limit by blog.uploads, this covers other writes
     """
     file_size = file.size
-    limit_mb = 5
-    if file_size > limit_mb * 1024 * 1024:
+    limit_mb = settings.MEDIA_UPLOAD_MAX_SIZE // (1024 * 1024)
+    if file_size > settings.MEDIA_UPLOAD_MAX_SIZE:
         raise ValidationError("La taille maximal autorisée est de %s MB" % limit_mb)
 
-def random_string_generator(size=10, chars=string.ascii_lowercase + string.digits):
-    """
-        Generate a random string
-        return String (ascii && lowercase)
-    """
-    return ''.join(random.choice(chars) for _ in range(size))
-
-def unique_user_slug_generator(instance, new_slug=None):
-    """
-        Unique slug generator with model username field
-        return String
-    """
-    return slugify(instance.username)
-
-def unique_slug_generator(instance, new_slug=None):
-    """
-        Unique slug generator with model username field
-        return String
-    """
-    if new_slug is not None:
-        slug = new_slug
-    else:
-        slug = slugify(instance.title)
-
-    klass = instance.__class__
-    qs_exists = klass.objects.filter(slug=slug)
-    if qs_exists:
-        new_slug = "{slug}-{randstr}".format(slug=slug, randstr=random_string_generator(size=4))
-        return unique_slug_generator(instance, new_slug=new_slug)
-    return slug
-
-
 class TokenGenerator(PasswordResetTokenGenerator):
     def _make_hash_value(self, user, timestamp):
         return (
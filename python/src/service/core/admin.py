@@ -1,20 +1,37 @@
 from django.contrib import admin
 
+from blog.uploads import form_with_upload_errors
 from core.models import Article, ArticleImage
+from core.search import matching_articles
 
 
 class ArticleImageAdmin(admin.StackedInline):
     model = ArticleImage
     extra = 1
 
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.form = form_with_upload_errors(formset.form, request)
+        return formset
+
 
 @admin.register(Article)
 class ArticleAdmin(admin.ModelAdmin):
     inlines = [ArticleImageAdmin,]
-    search_fields = ('created_at',)
+    # Looked up in the search index, not with LIKE scans of these columns
+    search_fields = ('title', 'short_desc', 'description')
+    search_help_text = "Words of the title, short description or description"
     list_filter = ('created_at',)
     list_display = ('id', 'title', 'slug', 'created_at', 'updated_at')
     ordering = ("-created_at",)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(pk__in=matching_articles(search_term)), False
+
+    def get_form(self, request, obj=None, change=False, **kwargs):
+        return form_with_upload_errors(super().get_form(request, obj, change, **kwargs), request)
     fieldsets = (
         (None, {'fields': ('title', 'description', 'short_desc')}),
         ('General', {'fields': ('link', 'thumbnail', 'slug')})        
@@ -0,0 +1,100 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import (GenericAPIView, ListAPIView,
+                                     RetrieveAPIView, get_object_or_404)
+from rest_framework.permissions import AllowAny
+
+from core.models import Article, article_lookup
+from core.pagination import ArticleCursorPagination, ArticleSearchPagination
+from core.search import rank_articles
+from core.serializers import (ArticleListSerializer, ArticleSearchSerializer,
+                              ArticleSerializer)
+
+
+def article_list_etag(request, *args, **kwargs):
+    """
+        Validator of the article list built from one aggregate query
+        Image writes touch their article so updated_at covers them
+        return String
+    """
+    state = Article.objects.aggregate(count=Count('id'), last_id=Max('id'), last_write=Max('updated_at'))
+    raw = "%s|%s|%s|%s" % (state['count'], state['last_id'], state['last_write'], request.META.get('QUERY_STRING', ''))
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def article_etag(request, key, *args, **kwargs):
+    """
+        Validator of a single article from its updated_at
+        return String or None when the article doesn't exist
+    """
+    updated_at = Article.objects.filter(article_lookup(key)).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None
+    return hashlib.md5(("%s|%s" % (key, updated_at.isoformat())).encode()).hexdigest()
+
+
+class ArticleListAPI(ListAPIView):
+    """
+        Article list endpoint, cursor paginated with images prefetched
+        A page costs the same number of queries whatever its size
+        Role: Allow any
+    """
+    permission_classes = [AllowAny]
+    queryset = Article.objects.defer('description').prefetch_related('articleimage_set')
+    serializer_class = ArticleListSerializer
+    pagination_class = ArticleCursorPagination
+
+    @method_decorator(condition(etag_func=article_list_etag))
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class ArticleAPI(RetrieveAPIView):
+    """
+        Article detail endpoint, looked up by uuid or slug
+        Role: Allow any
+    """
+    permission_classes = [AllowAny]
+    queryset = Article.objects.prefetch_related('articleimage_set')
+    serializer_class = ArticleSerializer
+
+    def get_object(self):
+        return get_object_or_404(self.get_queryset(), article_lookup(self.kwargs['key']))
+
+    @method_decorator(condition(etag_func=article_etag))
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class ArticleSearchAPI(GenericAPIView):
+    """
+        Article search endpoint, ?q= words looked up in the title, short description
+        and description, most relevant first. A page costs the ranking query, its count
+        and the articles of the page with their images
+        Role: Allow any
+    """
+    permission_classes = [AllowAny]
+    serializer_class = ArticleSearchSerializer
+    pagination_class = ArticleSearchPagination
+
+    def get_queryset(self):
+        query = self.request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': ["This field is required."]})
+        return rank_articles(query)
+
+    def get(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        scores = {row['document_id']: row['score'] for row in page}
+        articles = Article.objects.defer('description').prefetch_related('articleimage_set').in_bulk(list(scores))
+        results = []
+        for pk, score in scores.items():
+            # Deleted between the ranking and this read
+            if pk in articles:
+                articles[pk].score = score
+                results.append(articles[pk])
+        return self.get_paginated_response(self.get_serializer(results, many=True).data)
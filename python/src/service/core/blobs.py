@@ -0,0 +1,119 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.fields.files import FieldFile
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.utils import timezone
+
+from core.models import IMAGE_FIELDS, MediaBlob
+
+
+def variant_names(record):
+    return {variant['name'] for variant in (record or {}).get('variants', [])}
+
+
+def stored_name(value):
+    """
+        Name of a stored file field value, None for an empty or not yet saved file
+    """
+    if isinstance(value, FieldFile):
+        return value.name if value._committed and value.name else None
+    if isinstance(value, str):
+        return value or None
+    return None
+
+
+def blob_names(instance):
+    """
+        Stored files referenced by a row, its file and the variants of that file
+        return Set or None when one of the fields is deferred
+    """
+    field_name, variants_field = IMAGE_FIELDS[type(instance)]
+    values = instance.__dict__
+    if field_name not in values or variants_field not in values:
+        return None
+    names = variant_names(values[variants_field])
+    name = stored_name(values[field_name])
+    if name is not None:
+        names.add(name)
+    return names
+
+
+def adjust_references(added, removed):
+    """
+        Count a row in the blobs it now references and out of the ones it dropped,
+        in the caller's transaction so counts follow the rows
+    """
+    added, removed = set(added) - set(removed), set(removed) - set(added)
+    now = timezone.now()
+    if added:
+        MediaBlob.objects.bulk_create([MediaBlob(name=name) for name in added], ignore_conflicts=True)
+        MediaBlob.objects.filter(name__in=added).update(refcount=F('refcount') + 1, updated_at=now)
+    if removed:
+        MediaBlob.objects.filter(name__in=removed).update(refcount=F('refcount') - 1, updated_at=now)
+
+
+def load_stored_blobs(sender, instance, update_fields=None, **kwargs):
+    """
+        What the row references in the database before the write, the instance may be
+        older than the variants recorded since by the pipeline
+    """
+    instance._stored_blobs = None
+    fields = IMAGE_FIELDS[sender]
+    if update_fields is not None and not set(fields) & set(update_fields):
+        return
+    row = None
+    if not instance._state.adding:
+        row = sender.objects.filter(pk=instance.pk).values(*fields).first()
+    instance._stored_blobs = blob_names(sender(**row)) if row else set()
+
+
+def load_deleted_blobs(sender, instance, origin=None, **kwargs):
+    # Rows reached by a cascade or a queryset delete were just read, only a deleted instance may be stale
+    names = blob_names(instance) if origin is not instance else None
+    if names is None:
+        load_stored_blobs(sender, instance)
+    else:
+        instance._stored_blobs = names
+
+
+def count_saved_blobs(sender, instance, **kwargs):
+    names = blob_names(instance)
+    if instance._stored_blobs is not None and names is not None:
+        adjust_references(names, instance._stored_blobs)
+
+
+def count_deleted_blobs(sender, instance, **kwargs):
+    adjust_references([], instance._stored_blobs)
+
+
+def recount_references():
+    """
+        Rebuild every count from the rows, repairs writes made without signals
+        (update(), bulk_create(), raw SQL)
+        return Integer number of blobs whose count changed
+    """
+    counts = Counter()
+    for model, fields in IMAGE_FIELDS.items():
+        for instance in model.objects.only('pk', *fields).iterator():
+            counts.update(blob_names(instance))
+
+    with transaction.atomic():
+        MediaBlob.objects.bulk_create([MediaBlob(name=name) for name in counts], ignore_conflicts=True)
+        changed = []
+        for blob in MediaBlob.objects.select_for_update().only('pk', 'name', 'refcount').iterator():
+            if blob.refcount != counts[blob.name]:
+                blob.refcount = counts[blob.name]
+                blob.updated_at = timezone.now()
+                changed.append(blob)
+        MediaBlob.objects.bulk_update(changed, ['refcount', 'updated_at'], batch_size=500)
+    return len(changed)
+
+
+for model in IMAGE_FIELDS:
+    pre_save.connect(load_stored_blobs, sender=model)
+    pre_delete.connect(load_deleted_blobs, sender=model)
+    post_save.connect(count_saved_blobs, sender=model)
+    post_delete.connect(count_deleted_blobs, sender=model)
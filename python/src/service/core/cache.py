@@ -0,0 +1,395 @@
+import copy
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Count, Max
+from django.db.models.signals import post_delete, post_save
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+
+from blog.metrics import registry
+from blog.replicas import primary_reads
+from core.models import Article, ArticleImage, article_lookup
+
+# Conditional headers are answered from the cached entry, never by the view
+CONDITIONAL_HEADERS = ('HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE')
+# Rough per entry overhead of the key, dict and headers in the local tier
+ENTRY_OVERHEAD = 512
+
+
+class PageCacheStats:
+    """
+        Lookup counters of the article page cache (per process)
+    """
+    RESULTS = ('local_hit', 'shared_hit', 'stale', 'miss')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = dict.fromkeys(self.RESULTS, 0)
+
+    def record(self, result):
+        with self._lock:
+            self.counts[result] += 1
+
+    def as_dict(self):
+        with self._lock:
+            counts = dict(self.counts)
+        total = sum(counts.values())
+        hits = counts['local_hit'] + counts['shared_hit'] + counts['stale']
+        counts['hit_ratio'] = round(hits / total, 4) if total else None
+        return counts
+
+    def prometheus_lines(self):
+        counts = self.as_dict()
+        lines = [
+            "# HELP article_cache_requests_total Article page cache lookups by result",
+            "# TYPE article_cache_requests_total counter",
+        ]
+        lines.extend(
+            'article_cache_requests_total{result="%s"} %d' % (result, counts[result]) for result in self.RESULTS
+        )
+        # No hit ratio gauge, ratios of the workers can't be summed, it is computed from the counters
+        lines.extend([
+            "# HELP article_cache_local_bytes Bytes held by the in-process tier",
+            "# TYPE article_cache_local_bytes gauge",
+            "article_cache_local_bytes %d" % local_cache.size,
+            "# HELP article_cache_local_evictions_total Entries evicted from the in-process tier",
+            "# TYPE article_cache_local_evictions_total counter",
+            "article_cache_local_evictions_total %d" % local_cache.evictions,
+        ])
+        return lines
+
+
+stats = PageCacheStats()
+
+
+class LocalPageCache:
+    """
+        Thread safe LRU of rendered pages, capped in bytes by ARTICLE_CACHE_LOCAL_MAX_BYTES
+    """
+    def __init__(self):
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.evictions = 0
+
+    @property
+    def max_bytes(self):
+        return settings.ARTICLE_CACHE_LOCAL_MAX_BYTES
+
+    @staticmethod
+    def entry_size(key, entry):
+        return len(key) + len(entry['content']) + ENTRY_OVERHEAD
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        size = self.entry_size(key, entry)
+        with self._lock:
+            self._discard(key)
+            if size > self.max_bytes:
+                return
+            self._data[key] = entry
+            self.size += size
+            while self.size > self.max_bytes:
+                old_key, old_entry = self._data.popitem(last=False)
+                self.size -= self.entry_size(old_key, old_entry)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size -= self.entry_size(key, entry)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+            self.evictions = 0
+
+
+local_cache = LocalPageCache()
+
+
+def get_cache():
+    return caches[settings.ARTICLE_CACHE_ALIAS]
+
+
+def get_page(key):
+    """
+        Rendered page from the local tier, then the shared cache
+        return Tuple (entry, result) or (None, 'miss')
+    """
+    entry = local_cache.get(key)
+    if entry is not None:
+        return entry, 'local_hit'
+    entry = get_cache().get(key)
+    if entry is not None:
+        local_cache.set(key, entry)
+        return entry, 'shared_hit'
+    return None, 'miss'
+
+
+def set_page(key, entry):
+    local_cache.set(key, entry)
+    get_cache().set(key, entry, timeout=settings.ARTICLE_CACHE_TIMEOUT)
+
+
+def state_key(lookup):
+    return "article:state:%s" % lookup
+
+
+def lookups_key(pk):
+    return "article:lookups:%s" % pk
+
+
+def list_state_key():
+    return "article:list:changed"
+
+
+def article_state(key):
+    """
+        (pk, updated_at timestamp) of the article behind a slug or uuid,
+        from the cache or from one narrow query
+        Kept ARTICLE_CACHE_STATE_SECONDS only: invalidation reaches the cache of the
+        writing process, the others read the row again to see the write. Read on the
+        primary, a lagging replica would cache the previous updated_at
+        return Tuple or None when the article doesn't exist
+    """
+    cache = get_cache()
+    state = cache.get(state_key(key))
+    if state is None:
+        row = Article.objects.using(DEFAULT_DB_ALIAS).filter(article_lookup(key)).values_list('pk', 'updated_at').first()
+        if row is None:
+            return None
+        state = (row[0], row[1].timestamp())
+        cache.set(state_key(key), state, timeout=settings.ARTICLE_CACHE_STATE_SECONDS)
+        # Remember every lookup of the article so a renamed slug is invalidated too
+        lookups = cache.get(lookups_key(row[0]), [])
+        if key not in lookups:
+            cache.set(lookups_key(row[0]), lookups + [key], timeout=settings.ARTICLE_CACHE_TIMEOUT)
+    return state
+
+
+def list_state():
+    """
+        (article count, last updated_at timestamp) of the articles, image writes move
+        the updated_at of their article and deletes the count. Cached like article_state
+        return Tuple
+    """
+    cache = get_cache()
+    state = cache.get(list_state_key())
+    if state is None:
+        row = Article.objects.using(DEFAULT_DB_ALIAS).aggregate(count=Count('pk'), changed=Max('updated_at'))
+        state = (row['count'], row['changed'].timestamp() if row['changed'] else 0.0)
+        cache.set(list_state_key(), state, timeout=settings.ARTICLE_CACHE_STATE_SECONDS)
+    return state
+
+
+def detail_scope(key, **kwargs):
+    state = article_state(key)
+    if state is None:
+        return None
+    return key, "%r" % state[1], state[1]
+
+
+def list_scope(**kwargs):
+    count, changed_at = state = list_state()
+    return 'list', "%d-%r" % state, changed_at
+
+
+def variant(request):
+    """
+        Scheme, host, query string and Accept header the page depends on,
+        absolute links (pagination, media) are rendered from the first two
+        return String
+    """
+    raw = "%s|%s|%s|%s" % (
+        request.scheme, request.get_host(), request.META.get('QUERY_STRING', ''), request.META.get('HTTP_ACCEPT', ''),
+    )
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def not_modified(request, etag):
+    """
+        Whether the client already holds this ETag, never without an If-None-Match header
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    return bool(if_none_match and etag) and if_none_match == etag
+
+
+def page_response(request, entry, result):
+    if not_modified(request, entry['etag']):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    if entry['etag']:
+        response['ETag'] = entry['etag']
+    response['X-Cache'] = result
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def render_page(view, request, args, kwargs, key, latest_key):
+    """
+        Render the view and store a 200 response under its key and as the latest page
+        return HttpResponse
+    """
+    # The view must render a full page, conditional requests are answered from the entry
+    request = copy.copy(request)
+    request.META = {name: value for name, value in request.META.items() if name not in CONDITIONAL_HEADERS}
+    # Stored under the state read on the primary, the page must not come from an older replica
+    with primary_reads():
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+    if response.status_code == 200 and not response.streaming:
+        entry = {
+            'content': response.content,
+            'content_type': response['Content-Type'],
+            'etag': response.get('ETag'),
+            'rendered_at': time.time(),
+        }
+        set_page(key, entry)
+        set_page(latest_key, entry)
+    return response
+
+
+_background_lock = threading.Lock()
+_background = (None, None)
+
+
+def get_background_executor():
+    """
+        Threads of the background renders, BACKGROUND_THREADS per process
+        Created again in a forked worker, threads don't survive the fork
+        return ThreadPoolExecutor
+    """
+    global _background
+    pid, executor = _background
+    if pid != os.getpid():
+        with _background_lock:
+            pid, executor = _background
+            if pid != os.getpid():
+                executor = ThreadPoolExecutor(max_workers=settings.BACKGROUND_THREADS, thread_name_prefix='background')
+                _background = (os.getpid(), executor)
+    return executor
+
+
+def run_in_background(func, *args):
+    """
+        Queue func(*args) on the background threads, callers dedupe their tasks with a cache lock
+    """
+    def run():
+        try:
+            func(*args)
+        finally:
+            connections.close_all()
+    get_background_executor().submit(run)
+
+
+def revalidation_task(view, request, args, kwargs, key, latest_key, lock_key):
+    try:
+        render_page(view, request, args, kwargs, key, latest_key)
+    finally:
+        get_cache().delete(lock_key)
+
+
+def revalidate(view, request, args, kwargs, key, latest_key):
+    """
+        Render the current page once in the background while the stale one is served
+    """
+    lock_key = "article:revalidating:%s" % key
+    if get_cache().add(lock_key, 1, timeout=30):
+        run_in_background(revalidation_task, view, request, args, kwargs, key, latest_key, lock_key)
+
+
+def cache_article_page(scope_func):
+    """
+        Full response cache of an article view
+        scope_func(**kwargs) gives (scope, version string, changed_at) or None to bypass the cache,
+        pages are keyed by scope and version so a write never serves an outdated key,
+        the previous page of the scope is served stale for ARTICLE_CACHE_STALE_SECONDS
+        after changed_at while it is re-rendered
+
+            path('', cache_article_page(list_scope)(ArticleListAPI.as_view()))
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            scope = scope_func(**kwargs)
+            if scope is None:
+                return view(request, *args, **kwargs)
+            name, version, changed_at = scope
+            page_variant = variant(request)
+            key = "article:page:%s:%s:%s" % (name, version, page_variant)
+            latest_key = "article:latest:%s:%s" % (name, page_variant)
+
+            entry, result = get_page(key)
+            if entry is None:
+                stale, _ = get_page(latest_key)
+                if stale is not None and time.time() - changed_at <= settings.ARTICLE_CACHE_STALE_SECONDS:
+                    entry, result = stale, 'stale'
+                    revalidate(view, request, args, kwargs, key, latest_key)
+            stats.record(result)
+            if entry is not None:
+                return page_response(request, entry, result)
+
+            response = render_page(view, request, args, kwargs, key, latest_key)
+            if response.status_code == 200 and not_modified(request, response.get('ETag')):
+                response = HttpResponseNotModified()
+                response['ETag'] = request.META['HTTP_IF_NONE_MATCH']
+            response['X-Cache'] = result
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate_article_pages(pk, lookups):
+    """
+        Drop the state of every lookup of an article and of the list
+        Pages are keyed by updated_at so they don't need to be deleted, a deleted
+        article resolves to nothing and is never served from its latest page
+    """
+    cache = get_cache()
+    lookups = set(lookups) | set(cache.get(lookups_key(pk), []))
+    cache.delete_many([state_key(lookup) for lookup in lookups] + [list_state_key()])
+
+
+def invalidate_article(sender, instance, **kwargs):
+    lookups = [instance.slug, str(instance.uuid)]
+    transaction.on_commit(lambda: invalidate_article_pages(instance.pk, lookups))
+
+
+def invalidate_article_image(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_article_pages(instance.project_id, []))
+
+post_save.connect(invalidate_article, sender=Article)
+post_delete.connect(invalidate_article, sender=Article)
+post_save.connect(invalidate_article_image, sender=ArticleImage)
+post_delete.connect(invalidate_article_image, sender=ArticleImage)
+
+registry.register_collector(stats.prometheus_lines)
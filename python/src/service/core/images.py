@@ -0,0 +1,166 @@
+import hashlib
+import logging
+import posixpath
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from core.cache import invalidate_article_pages, run_in_background
+from core.blobs import adjust_references, variant_names
+from core.models import IMAGE_FIELDS, Article, ArticleImage
+
+PIL_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+
+logger = logging.getLogger(__name__)
+
+
+def variant_name(original_name, digest, width, image_format):
+    """
+        Content addressed name of a variant, next to its original
+        articles/medias/variants/ab/ab12.../640w.webp
+        ContentAddressedStorage only keeps the extension and names it after its own bytes
+        return String
+    """
+    directory = posixpath.join(posixpath.dirname(original_name), 'variants', digest[:2], digest)
+    return posixpath.join(directory, '%dw.%s' % (width, EXTENSIONS[image_format]))
+
+
+def render_variants(content, widths, formats, quality):
+    """
+        Resize and re-encode an image, runs in a pool process
+        Widths above the original are skipped, the original width is used when all are
+        return List of (width, height, format, bytes)
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(content)) as image:
+        image = ImageOps.exif_transpose(image)
+        targets = sorted({width for width in widths if width < image.width} or {image.width})
+        variants = []
+        for width in targets:
+            resized = image.copy()
+            resized.thumbnail((width, image.height), Image.LANCZOS)
+            for image_format in formats:
+                frame = resized
+                if image_format == 'jpeg' and frame.mode != 'RGB':
+                    background = Image.new('RGB', frame.size, 'white')
+                    rgba = frame.convert('RGBA')
+                    background.paste(rgba, mask=rgba.getchannel('A'))
+                    frame = background
+                buffer = BytesIO()
+                frame.save(buffer, format=PIL_FORMATS[image_format], quality=quality)
+                variants.append((resized.width, resized.height, image_format, buffer.getvalue()))
+        return variants
+
+
+_executor = None
+
+
+def get_variant_executor():
+    """
+        Process pool resizing images, Pillow holds the GIL for most of the work
+        return ProcessPoolExecutor or None to render inline (IMAGE_VARIANT_WORKERS=0)
+    """
+    global _executor
+    if not settings.IMAGE_VARIANT_WORKERS:
+        return None
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS)
+    return _executor
+
+
+def generate_variants(model, pk, force=False):
+    """
+        Build the variants of an image row and record them in its JSON field
+        The row is only updated if its file didn't change in the meantime,
+        force rebuilds variants already recorded for the current file
+        return Dict record or None when there is nothing to do
+    """
+    field_name, variants_field = IMAGE_FIELDS[model]
+    related = ['project'] if model is ArticleImage else []
+    instance = model.objects.filter(pk=pk).only(field_name, variants_field, *related).first()
+    file = getattr(instance, field_name, None)
+    if not file:
+        return None
+    with file.open('rb'):
+        content = file.read()
+    digest = hashlib.sha256(content).hexdigest()
+    previous = getattr(instance, variants_field)
+    if not force and previous.get('source') == file.name and previous.get('sha256') == digest:
+        return None
+
+    args = (content, settings.IMAGE_VARIANT_WIDTHS, settings.IMAGE_VARIANT_FORMATS, settings.IMAGE_VARIANT_QUALITY)
+    executor = get_variant_executor()
+    rendered = executor.submit(render_variants, *args).result() if executor else render_variants(*args)
+
+    variants = []
+    for width, height, image_format, data in rendered:
+        name = variant_name(file.name, digest, width, image_format)
+        # Same content gives the same name, an existing variant is reused as is
+        if not file.storage.exists(name):
+            name = file.storage.save(name, ContentFile(data))
+        variants.append({'width': width, 'height': height, 'format': image_format, 'name': name, 'size': len(data)})
+    record = {'source': file.name, 'sha256': digest, 'variants': variants}
+
+    with transaction.atomic():
+        updated = model.objects.filter(pk=pk, **{field_name: file.name}).update(**{variants_field: record})
+        if updated:
+            # update() sends no signal, the variants are counted here
+            adjust_references(variant_names(record), variant_names(previous))
+    if updated:
+        touch_article(instance.pk if model is Article else instance.project_id)
+    return record
+
+
+def touch_article(pk):
+    """
+        update() sends no signal, move updated_at and drop cached pages by hand
+    """
+    Article.objects.filter(pk=pk).update(updated_at=timezone.now())
+    invalidate_article_pages(pk, [])
+
+
+def variants_task(model, pk, lock_key):
+    """
+        Background generation, on failure the lock is kept so the row is retried
+        after IMAGE_VARIANT_LOCK_SECONDS instead of on every read
+    """
+    try:
+        generate_variants(model, pk)
+    except Exception:
+        logger.exception("Variants of %s %s failed", model._meta.label, pk)
+    else:
+        caches['default'].delete(lock_key)
+
+
+def schedule_variants(model, pk):
+    """
+        Generate the variants of a row in the background, once at a time per row
+    """
+    lock_key = "image:variants:%s:%s" % (model._meta.label_lower, pk)
+    if caches['default'].add(lock_key, 1, timeout=settings.IMAGE_VARIANT_LOCK_SECONDS):
+        run_in_background(variants_task, model, pk, lock_key)
+
+
+def needs_variants(instance):
+    field_name, variants_field = IMAGE_FIELDS[type(instance)]
+    file = getattr(instance, field_name)
+    return bool(file) and getattr(instance, variants_field).get('source') != file.name
+
+
+def queue_variants(sender, instance, **kwargs):
+    """
+        New or replaced image, variants are built once the row is committed
+    """
+    if needs_variants(instance):
+        transaction.on_commit(lambda: schedule_variants(sender, instance.pk))
+
+post_save.connect(queue_variants, sender=Article)
+post_save.connect(queue_variants, sender=ArticleImage)
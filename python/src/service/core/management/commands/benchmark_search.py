@@ -0,0 +1,106 @@
+import random
+import string
+import time
+from itertools import accumulate
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from core.models import Article
+from core.search import rank_articles, rebuild_index
+
+SLUG_PREFIX = 'benchmark-search-'
+
+
+class Command(BaseCommand):
+    help = "Compare ranked index search with LIKE scans over a generated corpus of articles"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--articles', type=int, default=100000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--vocabulary', type=int, default=30000, help="Distinct words, drawn with a Zipf distribution")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--keep', action='store_true', help="Leave the generated articles in the database")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10))) for _ in range(options['vocabulary'])]
+        weights = list(accumulate(1 / rank for rank in range(1, len(words) + 1)))
+
+        def text(count):
+            return ' '.join(rng.choices(words, cum_weights=weights, k=count))
+
+        start = time.perf_counter()
+        for offset in range(0, options['articles'], options['batch_size']):
+            Article.objects.bulk_create([
+                Article(
+                    title=text(6), short_desc=text(15), description=text(80),
+                    slug='%s%d' % (SLUG_PREFIX, number),
+                )
+                for number in range(offset, min(offset + options['batch_size'], options['articles']))
+            ])
+        self.stdout.write("%d articles written in %.1fs" % (options['articles'], time.perf_counter() - start))
+
+        try:
+            start = time.perf_counter()
+            indexed = rebuild_index(options['batch_size'])
+            self.stdout.write("%d articles indexed in %.1fs" % (indexed, time.perf_counter() - start))
+
+            edited = list(Article.objects.filter(slug__startswith=SLUG_PREFIX)[:100])
+            start = time.perf_counter()
+            for article in edited:
+                article.description = text(80)
+                article.save()
+            self.stdout.write("incremental update %.2f ms/save" % ((time.perf_counter() - start) * 1000 / max(len(edited), 1)))
+
+            # Rare words match a few articles, common ones most of them
+            common, rare = words[:50], words[1000:]
+            mixes = {
+                'rare': lambda: rng.sample(rare, rng.randint(1, 3)),
+                'mixed': lambda: [rng.choice(common), rng.choice(rare)],
+                'common': lambda: rng.sample(common, rng.randint(1, 2)),
+            }
+            self.stdout.write("%-7s %-7s %10s %10s %12s" % ("path", "queries", "p50 ms", "p99 ms", "hits/query"))
+            for mix, draw in mixes.items():
+                queries = [' '.join(draw()) for _ in range(options['queries'])]
+                for label, search in (('index', self.index_search), ('like', self.like_search)):
+                    latencies, hits = [], 0
+                    # Corpus stats stay cached across queries as in production, term frequencies mostly miss
+                    caches['default'].clear()
+                    for query in queries:
+                        start = time.perf_counter()
+                        hits += search(query)
+                        latencies.append(time.perf_counter() - start)
+                    latencies.sort()
+                    self.stdout.write("%-7s %-7s %10.2f %10.2f %12.1f" % (
+                        label, mix,
+                        latencies[len(latencies) // 2] * 1000,
+                        latencies[int(len(latencies) * 0.99) - 1] * 1000,
+                        hits / len(queries),
+                    ))
+        finally:
+            if not options['keep']:
+                Article.objects.filter(slug__startswith=SLUG_PREFIX).delete()
+
+    @staticmethod
+    def index_search(query):
+        """
+            First page of the search endpoint: count and 20 best scores
+        """
+        ranked = rank_articles(query)
+        list(ranked[:20])
+        return ranked.count()
+
+    @staticmethod
+    def like_search(query):
+        """
+            Same page with LIKE '%word%' on the three columns, unranked
+        """
+        condition = Q()
+        for word in query.split():
+            condition |= Q(title__icontains=word) | Q(short_desc__icontains=word) | Q(description__icontains=word)
+        matches = Article.objects.filter(condition)
+        list(matches.values_list('pk', flat=True)[:20])
+        return matches.count()
@@ -0,0 +1,48 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+
+from core.models import Article
+
+
+class Command(BaseCommand):
+    help = "Measure Article saves per second when concurrent writers share one title"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--saves', type=int, default=200, help="Saves per writer")
+        parser.add_argument('--title', default="Benchmark article")
+
+    def handle(self, *args, **options):
+        created = []
+        errors = []
+        lock = threading.Lock()
+
+        def writer():
+            ids = []
+            try:
+                for _ in range(options['saves']):
+                    try:
+                        ids.append(Article.objects.create(title=options['title']).pk)
+                    except DatabaseError as exc:
+                        errors.append(exc)
+            finally:
+                connection.close()
+            with lock:
+                created.extend(ids)
+
+        threads = [threading.Thread(target=writer) for _ in range(options['writers'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        Article.objects.filter(pk__in=created).delete()
+        self.stdout.write(
+            "%s writer(s), %s save(s) in %.2fs: %.0f saves/s, %s failed"
+            % (options['writers'], len(created), elapsed, len(created) / elapsed, len(errors))
+        )
@@ -0,0 +1,84 @@
+import posixpath
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.blobs import recount_references
+from core.models import MediaBlob
+
+
+class Command(BaseCommand):
+    help = "Delete the content addressed media no article or image references anymore"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="List what would be deleted")
+        parser.add_argument('--recount', action='store_true', help="Rebuild the reference counts from the rows first")
+        parser.add_argument(
+            '--grace-seconds', type=int, default=settings.MEDIA_GC_GRACE_SECONDS,
+            help="Keep files written or unreferenced more recently, their row may not be committed yet",
+        )
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.cutoff = timezone.now() - timedelta(seconds=options['grace_seconds'])
+        if options['recount']:
+            self.stdout.write("%d reference counts corrected" % recount_references())
+
+        released = self.delete_unreferenced()
+        orphans = self.delete_untracked()
+        self.stdout.write(self.style.SUCCESS(
+            "%s%d unreferenced and %d untracked files deleted" % ('[dry run] ' if self.dry_run else '', released, orphans)
+        ))
+
+    def expired(self, name):
+        try:
+            return default_storage.get_modified_time(name) < self.cutoff
+        except FileNotFoundError:
+            return True
+
+    def delete(self, name):
+        if self.dry_run:
+            self.stdout.write("would delete %s" % name)
+        else:
+            default_storage.delete(name)
+
+    def delete_unreferenced(self):
+        """
+            Blobs counted down to zero before the grace window
+        """
+        deleted = 0
+        blobs = MediaBlob.objects.filter(refcount__lte=0, updated_at__lt=self.cutoff)
+        for pk, name in blobs.values_list('pk', 'name').iterator():
+            # Reused by a duplicate upload since, see ContentAddressedStorage._save
+            if not self.expired(name):
+                continue
+            if not self.dry_run:
+                # Referenced again meanwhile, the row is kept
+                if not MediaBlob.objects.filter(pk=pk, refcount__lte=0).delete()[0]:
+                    continue
+            self.delete(name)
+            deleted += 1
+        return deleted
+
+    def delete_untracked(self):
+        """
+            Stored files no row ever referenced (form errors, failed transactions)
+            Scanned one fan-out directory at a time
+        """
+        deleted = 0
+        prefix = default_storage.prefix
+        if not default_storage.exists(prefix):
+            return deleted
+        directories, _ = default_storage.listdir(prefix)
+        for directory in sorted(directories):
+            directory = posixpath.join(prefix, directory)
+            names = {posixpath.join(directory, file_name) for file_name in default_storage.listdir(directory)[1]}
+            known = set(MediaBlob.objects.filter(name__in=names).values_list('name', flat=True))
+            for name in sorted(names - known):
+                if self.expired(name):
+                    self.delete(name)
+                    deleted += 1
+        return deleted
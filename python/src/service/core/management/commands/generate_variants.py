@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.images import IMAGE_FIELDS, generate_variants, needs_variants
+
+
+class Command(BaseCommand):
+    help = "Build the missing image variants of every article thumbnail and media"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Rebuild rows that already have variants")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        built = failed = 0
+        for model, (field_name, variants_field) in IMAGE_FIELDS.items():
+            rows = model.objects.exclude(**{field_name: ''}).exclude(**{field_name + '__isnull': True})
+            for instance in rows.only('pk', field_name, variants_field).iterator():
+                if not options['all'] and not needs_variants(instance):
+                    continue
+                try:
+                    generate_variants(model, instance.pk, force=options['all'])
+                    built += 1
+                except (OSError, ValueError) as exc:
+                    failed += 1
+                    self.stderr.write("%s %s: %s" % (model._meta.label, instance.pk, exc))
+        self.stdout.write(self.style.SUCCESS(
+            "%d images processed, %d failed in %.1fs" % (built, failed, time.perf_counter() - start)
+        ))
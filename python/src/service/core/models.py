@@ -1,32 +1,46 @@
 import uuid
 
 from django.db import models
-from django.db.models.signals import pre_save
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
 
-from blog.utils import unique_slug_generator, validate_media
+from blog.slugs import save_with_unique_slug, unique_slug_generator
+from blog.utils import validate_media
 
 
 class Article(models.Model):
     """
         Project model database table
     """
-    uuid = models.UUIDField(default=uuid.uuid4, editable=False)
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     title = models.CharField(max_length=150)
     description = models.TextField(null=True, blank=True)
     short_desc = models.CharField(max_length=255, null=True, blank=True)
     link = models.TextField(null=True, blank=True)
     thumbnail = models.ImageField(upload_to='articles/thumbnail/', null=True, blank=True, validators=[validate_media])
+    thumbnail_variants = models.JSONField(default=dict, blank=True, editable=False)
     slug = models.SlugField(null=True, blank=True, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Fixed urls of core/urls.py matched before <str:key>/, an article can't take them
+    RESERVED_SLUGS = ('search',)
+
     class Meta:
         verbose_name = "Article"
         verbose_name_plural = "Articles"
+        indexes = [
+            # Keyset of ArticleCursorPagination
+            models.Index(fields=['created_at', 'id'], name='core_article_created_id_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        return save_with_unique_slug(self, 'title', super().save, *args, **kwargs)
+
 
 class ArticleImage(models.Model):
     """
@@ -34,6 +48,7 @@ class ArticleImage(models.Model):
     """
     uuid = models.UUIDField(default=uuid.uuid4, editable=False)
     media = models.FileField(max_length=None ,upload_to='articles/medias/', validators=[validate_media])
+    media_variants = models.JSONField(default=dict, blank=True, editable=False)
     project = models.ForeignKey(Article, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -45,9 +60,85 @@ class ArticleImage(models.Model):
     def __str__(self):
         return self.media.url
 
+
+class MediaBlob(models.Model):
+    """
+        Stored file of the content addressed storage, with the number of
+        article and image rows referencing it (file or variant)
+    """
+    name = models.CharField(max_length=255, unique=True)
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Media blob"
+        verbose_name_plural = "Media blobs"
+
+    def __str__(self):
+        return self.name
+
+
+class SearchDocument(models.Model):
+    """
+        Article as seen by the search index, length is its weighted token count
+    """
+    article = models.OneToOneField(Article, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    length = models.PositiveIntegerField(default=0)
+    indexed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Search document"
+        verbose_name_plural = "Search documents"
+
+
+class SearchPosting(models.Model):
+    """
+        Inverted index entry, weighted frequency of a term in an article
+    """
+    term = models.CharField(max_length=64)
+    document = models.ForeignKey(SearchDocument, on_delete=models.CASCADE, related_name='postings')
+    frequency = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name = "Search posting"
+        verbose_name_plural = "Search postings"
+        constraints = [
+            models.UniqueConstraint(fields=['term', 'document'], name='core_searchposting_term_document'),
+        ]
+
+
+# Image field -> JSON field recording its variants
+IMAGE_FIELDS = {
+    Article: ('thumbnail', 'thumbnail_variants'),
+    ArticleImage: ('media', 'media_variants'),
+}
+
+
+def article_lookup(key):
+    """
+        Filter matching an article by uuid, or by slug when key isn't a uuid
+        return Q
+    """
+    try:
+        return Q(uuid=uuid.UUID(key))
+    except ValueError:
+        return Q(slug=key)
+
+
 # Slug Generator
 def slug_generator(sender, instance, *args, **kwargs):
     if not instance.slug:
         instance.slug = unique_slug_generator(instance)
         
-pre_save.connect(slug_generator, sender=Article)
\ No newline at end of file
+pre_save.connect(slug_generator, sender=Article)
+
+
+def touch_article(sender, instance, *args, **kwargs):
+    """
+        Move the article updated_at on image writes, it validates cached responses
+    """
+    Article.objects.filter(pk=instance.project_id).update(updated_at=timezone.now())
+
+post_save.connect(touch_article, sender=ArticleImage)
+post_delete.connect(touch_article, sender=ArticleImage)
@@ -0,0 +1,21 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class ArticleCursorPagination(CursorPagination):
+    """
+        Keyset pagination on (created_at, id), newest first
+        Pages walk core_article_created_id_idx backwards instead of sorting the table
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+
+
+class ArticleSearchPagination(PageNumberPagination):
+    """
+        Page numbers over search results, ranked by score the keyset of the list doesn't apply
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -0,0 +1,242 @@
+import hashlib
+import math
+import re
+import unicodedata
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, router, transaction
+from django.db.models import (Avg, Case, Count, F, FloatField, Sum, Value,
+                              When)
+from django.db.models.signals import post_save
+from django.utils.html import strip_tags
+
+from core.models import Article, SearchDocument, SearchPosting
+
+# Indexed field -> weight of its terms, a title match counts as three description ones
+SEARCH_FIELDS = {
+    'title': 3,
+    'short_desc': 2,
+    'description': 1,
+}
+TOKEN = re.compile(r"\w+")
+COMBINING_MARKS = re.compile(r"[\u0300-\u036f]")
+MAX_TERM_LENGTH = 64
+STOPWORDS = frozenset((
+    # English
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'in', 'is', 'it',
+    'its', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'were', 'will', 'with',
+    # French
+    'au', 'aux', 'ce', 'ces', 'dans', 'de', 'des', 'du', 'en', 'est', 'et', 'il', 'la', 'le',
+    'les', 'leur', 'mais', 'ou', 'par', 'pas', 'pour', 'qu', 'que', 'qui', 'sa', 'se', 'ses',
+    'son', 'sur', 'un', 'une',
+))
+STATS_CACHE_KEY = 'search:corpus'
+
+
+def tokenize(text):
+    """
+        Terms of a text, HTML tags dropped, lowercased and without accents
+        return List
+    """
+    if not text:
+        return []
+    text = strip_tags(text).lower()
+    if not text.isascii():
+        text = COMBINING_MARKS.sub('', unicodedata.normalize('NFKD', text))
+    return [
+        term for term in TOKEN.findall(text)
+        if 1 < len(term) <= MAX_TERM_LENGTH and term not in STOPWORDS
+    ]
+
+
+def article_terms(values):
+    """
+        Weighted term frequencies of an article
+        values: Dict field -> text for SEARCH_FIELDS
+        return Counter
+    """
+    terms = Counter()
+    for field, weight in SEARCH_FIELDS.items():
+        for term in tokenize(values.get(field)):
+            terms[term] += weight
+    return terms
+
+
+def query_terms(query):
+    """
+        Distinct terms of a search query, the first SEARCH_MAX_QUERY_TERMS
+        return List
+    """
+    return list(dict.fromkeys(tokenize(query)))[:settings.SEARCH_MAX_QUERY_TERMS]
+
+
+def index_article(article_id, values, created=False):
+    """
+        Bring the postings of an article in line with its text, only the terms
+        that changed are written. A created article has none to read
+    """
+    terms = article_terms(values)
+    length = sum(terms.values())
+    with transaction.atomic():
+        if created:
+            document, stored = SearchDocument.objects.create(article_id=article_id, length=length), {}
+        else:
+            document, created = SearchDocument.objects.get_or_create(article_id=article_id, defaults={'length': length})
+            stored = {} if created else {
+                term: (pk, frequency)
+                for pk, term, frequency in SearchPosting.objects.filter(document=document).values_list('pk', 'term', 'frequency')
+            }
+        removed = [stored[term][0] for term in stored.keys() - terms.keys()]
+        changed = [
+            SearchPosting(pk=stored[term][0], frequency=terms[term])
+            for term in stored.keys() & terms.keys() if stored[term][1] != terms[term]
+        ]
+        if removed:
+            SearchPosting.objects.filter(pk__in=removed).delete()
+        if changed:
+            SearchPosting.objects.bulk_update(changed, ['frequency'])
+        SearchPosting.objects.bulk_create([
+            SearchPosting(document=document, term=term, frequency=terms[term]) for term in terms.keys() - stored.keys()
+        ])
+        if document.length != length:
+            document.length = length
+            document.save(update_fields=['length', 'indexed_at'])
+
+
+def article_saved(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not set(SEARCH_FIELDS) & set(update_fields):
+        return
+    values = instance.__dict__
+    if not all(field in values for field in SEARCH_FIELDS):
+        # Saved with deferred fields, the stored text is the one to index
+        values = Article.objects.filter(pk=instance.pk).values(*SEARCH_FIELDS).first() or {}
+    index_article(instance.pk, values, created)
+
+
+def insert_postings_sql(connection):
+    quote = connection.ops.quote_name
+    return "INSERT INTO %s (%s, %s, %s) VALUES (%%s, %%s, %%s)" % (
+        quote(SearchPosting._meta.db_table),
+        quote(SearchPosting._meta.get_field('document').column),
+        quote(SearchPosting._meta.get_field('term').column),
+        quote(SearchPosting._meta.get_field('frequency').column),
+    )
+
+
+def rebuild_index(batch_size=1000):
+    """
+        Index every article from scratch, for rows written without signals
+        (bulk_create, update(), raw SQL). Postings are inserted with executemany,
+        model instances cost more than the tokenizing at this volume
+        return Integer number of articles indexed
+    """
+    indexed = 0
+    connection = connections[router.db_for_write(SearchPosting)]
+    with transaction.atomic(using=connection.alias):
+        SearchPosting.objects.all().delete()
+        SearchDocument.objects.all().delete()
+        articles = Article.objects.using(connection.alias).values('pk', *SEARCH_FIELDS).order_by('pk')
+        last_pk = 0
+        while True:
+            batch = list(articles.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            documents, postings = [], []
+            for values in batch:
+                terms = article_terms(values)
+                documents.append(SearchDocument(article_id=values['pk'], length=sum(terms.values())))
+                postings.extend((values['pk'], term, frequency) for term, frequency in terms.items())
+            SearchDocument.objects.bulk_create(documents)
+            with connection.cursor() as cursor:
+                cursor.executemany(insert_postings_sql(connection), postings)
+            indexed += len(batch)
+            last_pk = batch[-1]['pk']
+    caches['default'].delete(STATS_CACHE_KEY)
+    return indexed
+
+
+def corpus_stats():
+    """
+        Number of indexed articles and their average length, cached SEARCH_STATS_CACHE_SECONDS
+        return Tuple (count, average length)
+    """
+    cache = caches['default']
+    stats = cache.get(STATS_CACHE_KEY)
+    if stats is None:
+        state = SearchDocument.objects.aggregate(count=Count('pk'), average=Avg('length'))
+        stats = (state['count'], state['average'] or 0.0)
+        cache.set(STATS_CACHE_KEY, stats, settings.SEARCH_STATS_CACHE_SECONDS)
+    return stats
+
+
+def document_frequencies(terms):
+    """
+        Number of articles containing each term, cached like corpus_stats
+        return Dict term -> count, terms found nowhere left out
+    """
+    cache = caches['default']
+    keys = {'search:df:%s' % hashlib.md5(term.encode()).hexdigest(): term for term in terms}
+    cached = cache.get_many(keys)
+    frequencies = {keys[key]: count for key, count in cached.items()}
+    missing = [term for key, term in keys.items() if key not in cached]
+    if missing:
+        counted = dict(
+            SearchPosting.objects.filter(term__in=missing).values_list('term').annotate(count=Count('pk')).order_by()
+        )
+        # Terms found nowhere aren't cached, the next article may bring them
+        cache.set_many(
+            {key: counted[term] for key, term in keys.items() if term in counted}, settings.SEARCH_STATS_CACHE_SECONDS,
+        )
+        frequencies.update(counted)
+    return frequencies
+
+
+def rank_articles(query):
+    """
+        Articles matching any term of the query, best BM25 score first
+        Scores are summed in SQL over the postings of the query terms, each
+        term weighted by its idf: rare terms count more than common ones.
+        When the query has terms in at most SEARCH_COMMON_TERM_RATIO of the articles,
+        only the articles containing one of them are ranked
+        return QuerySet of dicts (document_id, score)
+    """
+    frequencies = document_frequencies(query_terms(query))
+    if not frequencies:
+        return SearchPosting.objects.none().values('document_id')
+    count, average_length = corpus_stats()
+    k1, b = settings.SEARCH_BM25_K1, settings.SEARCH_BM25_B
+    idf = Case(
+        *[
+            When(term=term, then=Value(math.log(1 + (count - df + 0.5) / (df + 0.5))))
+            for term, df in frequencies.items()
+        ],
+        output_field=FloatField(),
+    )
+    # Longer articles than average need more occurrences for the same score
+    norm = Value(k1 * (1 - b)) + Value(k1 * b / max(average_length, 1.0)) * F('document__length')
+    score = idf * F('frequency') * Value(k1 + 1) / (F('frequency') + norm)
+    postings = SearchPosting.objects.filter(term__in=list(frequencies))
+    rare = [term for term, df in frequencies.items() if df <= count * settings.SEARCH_COMMON_TERM_RATIO]
+    if rare and len(rare) < len(frequencies):
+        # Common terms only add to the score of articles a rarer term matched,
+        # their postings cover most of the table and move few rankings
+        postings = postings.filter(document_id__in=SearchPosting.objects.filter(term__in=rare).values('document_id'))
+    return (
+        postings
+        .values('document_id')
+        .annotate(score=Sum(score, output_field=FloatField()))
+        .order_by('-score', '-document_id')
+    )
+
+
+def matching_articles(query):
+    """
+        Ids of the articles containing any term of the query
+        return QuerySet usable as a pk__in subquery
+    """
+    return SearchPosting.objects.filter(term__in=query_terms(query)).values('document_id')
+
+
+post_save.connect(article_saved, sender=Article)
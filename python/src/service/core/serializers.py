@@ -0,0 +1,81 @@
+from rest_framework import serializers
+
+from core.images import needs_variants, schedule_variants
+from core.models import Article, ArticleImage
+
+
+class VariantsField(serializers.Field):
+    """
+        Resized copies of an image field, read from its variants record
+        Rows uploaded before the pipeline get their variants built on first read
+    """
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        if needs_variants(instance):
+            schedule_variants(type(instance), instance.pk)
+            return []
+        request = self.context.get('request')
+        storage = type(instance)._meta.get_field(self.variants_of).storage
+        variants = []
+        for variant in self.record(instance).get('variants', []):
+            url = storage.url(variant['name'])
+            variants.append({
+                'width': variant['width'],
+                'height': variant['height'],
+                'format': variant['format'],
+                'url': request.build_absolute_uri(url) if request is not None else url,
+            })
+        return variants
+
+    def bind(self, field_name, parent):
+        super().bind(field_name, parent)
+        self.variants_of = field_name[:-len('_variants')]
+
+    def record(self, instance):
+        return getattr(instance, self.field_name)
+
+
+class ArticleImageSerializer(serializers.ModelSerializer):
+    media_variants = VariantsField()
+
+    class Meta:
+        model = ArticleImage
+        fields = ['uuid', 'media', 'media_variants', 'created_at']
+        read_only_fields = fields
+
+
+class ArticleListSerializer(serializers.ModelSerializer):
+    """
+        Article with its images, read from the prefetched articleimage_set
+    """
+    images = ArticleImageSerializer(source='articleimage_set', many=True, read_only=True)
+    thumbnail_variants = VariantsField()
+
+    class Meta:
+        model = Article
+        fields = ['uuid', 'title', 'short_desc', 'link', 'thumbnail', 'thumbnail_variants', 'slug', 'created_at', 'updated_at', 'images']
+        read_only_fields = fields
+
+
+class ArticleSerializer(ArticleListSerializer):
+    """
+        Article detail, adds the description left out of the list
+    """
+    class Meta(ArticleListSerializer.Meta):
+        fields = ArticleListSerializer.Meta.fields + ['description']
+        read_only_fields = fields
+
+
+class ArticleSearchSerializer(ArticleListSerializer):
+    """
+        Search result, an article of the list with its relevance score
+    """
+    score = serializers.FloatField(read_only=True)
+
+    class Meta(ArticleListSerializer.Meta):
+        fields = ArticleListSerializer.Meta.fields + ['score']
+        read_only_fields = fields
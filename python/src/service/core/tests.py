@@ -1,3 +1,869 @@
-from django.test import TestCase
+import hashlib
+import posixpath
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from blog.testing import QueryBudgetMixin, allow_query_repeats, query_budget
+from blog.slugs import slug_cache
+from core.cache import (cache_article_page, get_background_executor, list_scope,
+                        local_cache, run_in_background)
+from core.images import generate_variants
+from core.cache import stats as page_cache_stats
+from core.models import Article, ArticleImage, MediaBlob, SearchPosting
+from core.search import rank_articles, tokenize
+
+
+class TestArticleSlug(QueryBudgetMixin, TestCase):
+    """
+        TEST ARTICLE SLUG ALLOCATION
+    """
+
+    def setUp(self):
+        super().setUp()
+        slug_cache.clear()
+
+    def test_same_title_gets_suffixes(self):
+        """
+            Test if articles sharing a title get -2, -3 suffixes
+        """
+        slugs = [Article.objects.create(title="Hello World").slug for _ in range(3)]
+        self.assertEqual(slugs, ["hello-world", "hello-world-2", "hello-world-3"])
+
+    def test_allocation_with_single_query(self):
+        """
+            Test if a cached prefix is allocated without any lookup query
+        """
+        Article.objects.create(title="Hello World")
+        with CaptureQueriesContext(connection) as context:
+            article = Article.objects.create(title="Hello World")
+        self.assertEqual(article.slug, "hello-world-2")
+        self.assertFalse([query for query in context.captured_queries if query['sql'].startswith('SELECT')])
+
+    def test_long_title_fits_slug_field(self):
+        """
+            Test if a long title is truncated to the slug max length
+        """
+        title = "A very long article title " * 5
+        first = Article.objects.create(title=title)
+        second = Article.objects.create(title=title)
+        self.assertLessEqual(len(second.slug), Article._meta.get_field('slug').max_length)
+        self.assertNotEqual(first.slug, second.slug)
+
+    def test_stale_cache_retry(self):
+        """
+            Test if a slug taken by another writer is reallocated on save
+        """
+        Article.objects.create(title="Hello World")
+        other = Article.objects.create(title="Other")
+        Article.objects.filter(pk=other.pk).update(slug="hello-world-2")
+
+        article = Article.objects.create(title="Hello World")
+        self.assertEqual(article.slug, "hello-world-3")
+
+    def test_numbered_title_isnt_a_slug_suffix(self):
+        """
+            Test if a title ending with a number neither moves the suffixes of its prefix
+            nor gets taken by them
+        """
+        Article.objects.create(title="Top 3")
+        slugs = [Article.objects.create(title="Top").slug for _ in range(4)]
+        self.assertEqual(slugs, ["top", "top-2", "top-4", "top-5"])
+
+    def test_reserved_slug_skipped(self):
+        """
+            Test if an article titled like a fixed url gets a suffix and stays reachable
+        """
+        article = Article.objects.create(title="Search")
+        self.assertEqual(article.slug, "search-2")
+        response = self.client.get(reverse('api-article', args=[article.slug]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['title'], "Search")
+
+
+class TestArticleQueries(QueryBudgetMixin, TestCase):
+    """
+        TEST ARTICLE QUERY BUDGETS
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        slug_cache.clear()
+        for index in range(3):
+            article = Article.objects.create(title="Article %d" % index)
+            ArticleImage.objects.bulk_create(
+                ArticleImage(project=article, media='articles/medias/%d-%d.png' % (index, number))
+                for number in range(2)
+            )
+
+    def test_prefetched_images_query_budget(self):
+        """
+            Test if articles with their images cost two queries whatever the article count
+        """
+        with query_budget(2):
+            images = {
+                article.slug: [image.media.name for image in article.articleimage_set.all()]
+                for article in Article.objects.prefetch_related('articleimage_set')
+            }
+        self.assertEqual(len(images), 3)
+        self.assertEqual(images['article-0'], ['articles/medias/0-0.png', 'articles/medias/0-1.png'])
+
+    @allow_query_repeats(None)
+    def test_images_per_article_detected(self):
+        """
+            Test if reading the images of each article in a loop is reported as an N+1
+        """
+        with self.assertRaisesMessage(AssertionError, 'N+1'):
+            with query_budget(max_repeats=2):
+                for article in Article.objects.all():
+                    list(article.articleimage_set.all())
+
+
+class TestArticleAPI(QueryBudgetMixin, APITestCase):
+    """
+        TEST ARTICLE READ API
+    """
+
+    def setUp(self):
+        """
+            Start every test with empty page caches
+        """
+        super().setUp()
+        caches['default'].clear()
+        local_cache.clear()
+        page_cache_stats.reset()
+        # Fixture images have no file, variants aren't built in these tests
+        patcher = mock.patch('core.images.run_in_background')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @classmethod
+    def setUpTestData(cls):
+        slug_cache.clear()
+        for index in range(3):
+            article = Article.objects.create(title="Article %d" % index, description="Body %d" % index)
+            ArticleImage.objects.bulk_create(
+                ArticleImage(project=article, media='articles/medias/%d-%d.png' % (index, number))
+                for number in range(2)
+            )
+
+    def test_article_list_constant_queries(self):
+        """
+            Test if a page costs the list state, etag, articles and images queries whatever its size
+        """
+        for page_size in (1, 3):
+            with query_budget(4):
+                response = self.client.get(reverse('api-article-list'), {'page_size': page_size})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['results']), page_size)
+
+        first = response.data['results'][0]
+        self.assertEqual(first['slug'], 'article-2')
+        self.assertEqual(len(first['images']), 2)
+        self.assertNotIn('description', first)
+
+    def test_article_list_cursor_pagination(self):
+        """
+            Test if the list is paginated with a cursor
+        """
+        response = self.client.get(reverse('api-article-list'), {'page_size': 2})
+        self.assertIsNotNone(response.data['next'])
+
+        next_response = self.client.get(response.data['next'])
+        self.assertEqual([article['slug'] for article in next_response.data['results']], ['article-0'])
+        self.assertIsNone(next_response.data['next'])
+
+    def test_article_by_slug_or_uuid(self):
+        """
+            Test if an article is found by slug and by uuid with its images
+        """
+        article = Article.objects.get(slug='article-1')
+        by_slug = self.client.get(reverse('api-article', args=[article.slug]))
+        by_uuid = self.client.get(reverse('api-article', args=[str(article.uuid)]))
+
+        self.assertEqual(by_slug.status_code, status.HTTP_200_OK)
+        self.assertEqual(by_slug.data, by_uuid.data)
+        self.assertEqual(by_slug.data['description'], 'Body 1')
+        self.assertEqual(len(by_slug.data['images']), 2)
+
+        missing = self.client.get(reverse('api-article', args=['missing']))
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(ARTICLE_CACHE_STALE_SECONDS=0)
+    def test_article_etag(self):
+        """
+            Test if an unchanged article answers 304 and an image write changes its etag
+        """
+        article = Article.objects.get(slug='article-1')
+        response = self.client.get(reverse('api-article', args=[article.slug]))
+        etag = response['ETag']
+
+        with query_budget(1):
+            cached_response = self.client.get(reverse('api-article', args=[article.slug]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached_response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ArticleImage.objects.create(project=article, media='articles/medias/1-2.png')
+        changed_response = self.client.get(reverse('api-article', args=[article.slug]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(changed_response.data['images']), 3)
+
+    @override_settings(ARTICLE_CACHE_STALE_SECONDS=0)
+    def test_article_list_etag(self):
+        """
+            Test if the list etag changes when an article is edited
+        """
+        etag = self.client.get(reverse('api-article-list'))['ETag']
+        cached_response = self.client.get(reverse('api-article-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached_response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        article = Article.objects.get(slug='article-0')
+        article.title = "Edited"
+        with self.captureOnCommitCallbacks(execute=True):
+            article.save()
+        changed_response = self.client.get(reverse('api-article-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed_response.status_code, status.HTTP_200_OK)
+
+    def test_article_page_cache_hit(self):
+        """
+            Test if a rendered article is served again without any query
+        """
+        first = self.client.get(reverse('api-article', args=['article-1']))
+        self.assertEqual(first['X-Cache'], 'miss')
+
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse('api-article', args=['article-1']))
+            not_modified = self.client.get(reverse('api-article', args=['article-1']), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second['X-Cache'], 'local_hit')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        local_cache.clear()
+        self.assertEqual(self.client.get(reverse('api-article', args=['article-1']))['X-Cache'], 'shared_hit')
+        self.assertEqual(page_cache_stats.as_dict()['hit_ratio'], 0.75)
+
+    def test_stale_while_revalidate(self):
+        """
+            Test if the first request after an edit gets the previous page while it is re-rendered
+        """
+        self.client.get(reverse('api-article', args=['article-1']))
+        article = Article.objects.get(slug='article-1')
+        article.title = "Edited"
+        with self.captureOnCommitCallbacks(execute=True):
+            article.save()
+
+        with mock.patch('core.cache.run_in_background') as run_in_background:
+            stale = self.client.get(reverse('api-article', args=['article-1']))
+            self.assertEqual(stale['X-Cache'], 'stale')
+            self.assertEqual(stale.json()['title'], 'Article 1')
+            self.assertEqual(run_in_background.call_count, 1)
+            # Only one re-render is scheduled per page
+            self.client.get(reverse('api-article', args=['article-1']))
+            self.assertEqual(run_in_background.call_count, 1)
+
+        func, *args = run_in_background.call_args[0]
+        func(*args)
+        fresh = self.client.get(reverse('api-article', args=['article-1']))
+        self.assertEqual(fresh['X-Cache'], 'local_hit')
+        self.assertEqual(fresh.json()['title'], 'Edited')
+
+        article.title = "Edited again"
+        with self.settings(ARTICLE_CACHE_STALE_SECONDS=0):
+            with self.captureOnCommitCallbacks(execute=True):
+                article.save()
+            response = self.client.get(reverse('api-article', args=['article-1']))
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertEqual(response.json()['title'], 'Edited again')
+
+    @override_settings(ARTICLE_CACHE_STALE_SECONDS=0)
+    def test_write_of_another_worker_seen_after_state_expires(self):
+        """
+            Test if an edit saved by another worker is served once the cached state expires
+        """
+        self.client.get(reverse('api-article', args=['article-1']))
+        self.client.get(reverse('api-article-list'))
+        # Saved elsewhere, the on_commit invalidation runs in that worker only
+        Article.objects.filter(slug='article-1').update(title="Edited", updated_at=timezone.now())
+        self.assertEqual(self.client.get(reverse('api-article', args=['article-1'])).json()['title'], 'Article 1')
+
+        later = time.time() + settings.ARTICLE_CACHE_STATE_SECONDS + 1
+        with mock.patch('time.time', return_value=later):
+            detail = self.client.get(reverse('api-article', args=['article-1']))
+            listed = self.client.get(reverse('api-article-list'))
+        self.assertEqual(detail.json()['title'], 'Edited')
+        self.assertEqual(listed['X-Cache'], 'miss')
+        self.assertIn('Edited', [article['title'] for article in listed.json()['results']])
+
+    def test_page_varies_on_host_and_scheme(self):
+        """
+            Test if a page rendered for a host or scheme isn't served to another, its links point there
+        """
+        url = reverse('api-article-list')
+        with self.settings(ALLOWED_HOSTS=['testserver', 'blog.example.com']):
+            self.client.get(url)
+            self.assertEqual(self.client.get(url)['X-Cache'], 'local_hit')
+            other_host = self.client.get(url, {'page_size': 1}, HTTP_HOST='blog.example.com')
+            self.assertEqual(other_host['X-Cache'], 'miss')
+            self.assertTrue(other_host.json()['next'].startswith('http://blog.example.com/'))
+            self.assertEqual(self.client.get(url, secure=True)['X-Cache'], 'miss')
+        self.assertNotIn(' ', list_scope()[1])
+
+    def test_page_without_etag_never_not_modified(self):
+        """
+            Test if a page without ETag is answered in full, with or without If-None-Match
+        """
+        view = cache_article_page(lambda **kwargs: ('plain', '1', 0.0))(lambda request: HttpResponse("Plain"))
+        factory = RequestFactory()
+
+        for result in ('miss', 'local_hit'):
+            response = view(factory.get('/plain/'))
+            self.assertEqual((response.status_code, response['X-Cache']), (200, result))
+            self.assertEqual(response.content, b"Plain")
+        self.assertEqual(view(factory.get('/plain/', HTTP_IF_NONE_MATCH='"x"')).status_code, 200)
+
+    def test_background_renders_bounded(self):
+        """
+            Test if background tasks run on a fixed number of threads per process
+        """
+        release = threading.Event()
+        names = set()
+
+        def task():
+            names.add(threading.current_thread().name)
+            release.wait(5)
+
+        with self.settings(BACKGROUND_THREADS=2), mock.patch('core.cache._background', (None, None)):
+            threads = threading.active_count()
+            for _ in range(5):
+                run_in_background(task)
+            self.assertLessEqual(threading.active_count() - threads, 2)
+            release.set()
+            get_background_executor().shutdown(wait=True)
+        self.assertEqual(len(names), 2)
+
+    def test_deleted_article_not_served(self):
+        """
+            Test if a deleted article answers 404 instead of its cached page
+        """
+        article = Article.objects.get(slug='article-1')
+        self.client.get(reverse('api-article', args=['article-1']))
+        self.client.get(reverse('api-article', args=[str(article.uuid)]))
+        with self.captureOnCommitCallbacks(execute=True):
+            article.delete()
+
+        self.assertEqual(self.client.get(reverse('api-article', args=['article-1'])).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(reverse('api-article', args=[str(article.uuid)])).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_local_tier_memory_cap(self):
+        """
+            Test if the in-process tier evicts the least recently used pages over its byte cap
+        """
+        with self.settings(ARTICLE_CACHE_LOCAL_MAX_BYTES=2 * 1024):
+            for index in range(3):
+                local_cache.set('page-%d' % index, {'content': b'x' * 300})
+                local_cache.get('page-0')
+
+        self.assertIsNotNone(local_cache.get('page-0'))
+        self.assertIsNone(local_cache.get('page-1'))
+        self.assertIsNotNone(local_cache.get('page-2'))
+        self.assertLessEqual(local_cache.size, 2 * 1024)
+        self.assertEqual(local_cache.evictions, 1)
+
+    def test_page_cache_metrics(self):
+        """
+            Test if the page cache counters are exposed on /metrics
+        """
+        self.client.get(reverse('api-article-list'))
+        self.client.get(reverse('api-article-list'))
+
+        with self.settings(METRICS_TOKEN='scraper'):
+            body = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scraper').content.decode()
+        self.assertIn('article_cache_requests_total{result="miss"} 1', body)
+        self.assertIn('article_cache_requests_total{result="local_hit"} 1', body)
+
+
+def png_upload(name, width=800, height=400, color='red'):
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new('RGBA', (width, height), color).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class TestImageVariants(QueryBudgetMixin, TestCase):
+    """
+        TEST IMAGE VARIANT PIPELINE
+    """
+
+    def setUp(self):
+        super().setUp()
+        slug_cache.clear()
+        caches['default'].clear()
+        local_cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = self.settings(MEDIA_ROOT=media_root, IMAGE_VARIANT_WORKERS=0, ARTICLE_CACHE_STALE_SECONDS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch('core.images.run_in_background')
+        self.run_in_background = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_scheduled(self):
+        for call in self.run_in_background.call_args_list:
+            func, *args = call[0]
+            func(*args)
+        self.run_in_background.reset_mock()
+
+    def test_variants_built_after_upload(self):
+        """
+            Test if an uploaded thumbnail gets WebP and JPEG variants at the widths below its own
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            article = Article.objects.create(title="With thumbnail", thumbnail=png_upload('cover.png'))
+        self.assertEqual(self.run_in_background.call_count, 1)
+        self.run_scheduled()
+
+        article.refresh_from_db()
+        variants = article.thumbnail_variants['variants']
+        self.assertEqual(
+            sorted((variant['width'], variant['format']) for variant in variants),
+            [(320, 'jpeg'), (320, 'webp'), (640, 'jpeg'), (640, 'webp')],
+        )
+        self.assertEqual(variants[0]['height'], variants[0]['width'] // 2)
+        for variant in variants:
+            self.assertTrue(variant['name'].startswith('cas/'))
+            self.assertTrue(default_storage.exists(variant['name']))
+
+        response = self.client.get(reverse('api-article', args=[article.slug]))
+        urls = [variant['url'] for variant in response.json()['thumbnail_variants']]
+        self.assertEqual(len(urls), 4)
+        self.assertTrue(all(url.startswith('http://testserver/media/cas/') for url in urls))
+
+    def test_same_content_shares_variants(self):
+        """
+            Test if two uploads of the same image share the stored file and its variants
+        """
+        article = Article.objects.create(title="Gallery")
+        first = ArticleImage.objects.create(project=article, media=png_upload('one.png'))
+        second = ArticleImage.objects.create(project=article, media=png_upload('two.png'))
+        first_record = generate_variants(ArticleImage, first.pk)
+        second_record = generate_variants(ArticleImage, second.pk)
+
+        self.assertEqual(first.media.name, second.media.name)
+        self.assertEqual(first_record['sha256'], second_record['sha256'])
+        self.assertEqual(
+            [variant['name'] for variant in first_record['variants']],
+            [variant['name'] for variant in second_record['variants']],
+        )
+        self.assertIsNone(generate_variants(ArticleImage, first.pk))
+
+    def test_variants_built_on_first_read(self):
+        """
+            Test if an image saved without signals gets its variants scheduled when first served
+        """
+        article = Article.objects.create(title="Imported")
+        upload = png_upload('imported.png', width=300, height=300)
+        name = default_storage.save('articles/medias/imported.png', upload)
+        ArticleImage.objects.bulk_create([ArticleImage(project=article, media=name)])
+
+        response = self.client.get(reverse('api-article', args=[article.slug]))
+        self.assertEqual(response.json()['images'][0]['media_variants'], [])
+        self.assertEqual(self.run_in_background.call_count, 1)
+        self.run_scheduled()
+
+        response = self.client.get(reverse('api-article', args=[article.slug]))
+        variants = response.json()['images'][0]['media_variants']
+        # Smaller than every configured width, rendered once at its own width
+        self.assertEqual(sorted((variant['width'], variant['format']) for variant in variants), [(300, 'jpeg'), (300, 'webp')])
+
+    def test_render_in_process_pool(self):
+        """
+            Test if variants are rendered by the process pool when workers are configured
+        """
+        article = Article.objects.create(title="Pool", thumbnail=png_upload('pool.png', color='blue'))
+        with self.settings(IMAGE_VARIANT_WORKERS=1):
+            record = generate_variants(Article, article.pk)
+        self.assertEqual(len(record['variants']), 4)
+
+
+class CountingStream(BytesIO):
+    """
+        Request body recording how many bytes the parser read
+    """
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+class TestMediaUpload(QueryBudgetMixin, TestCase):
+    """
+        TEST STREAMING MEDIA UPLOAD VALIDATION
+    """
+
+    def multipart_request(self, data):
+        body = encode_multipart(BOUNDARY, data)
+        environ = RequestFactory().generic('POST', '/upload/', body, content_type=MULTIPART_CONTENT).META
+        self.stream = CountingStream(body)
+        request = WSGIRequest(dict(environ, **{'wsgi.input': self.stream}))
+        return request, len(body)
+
+    @override_settings(MEDIA_UPLOAD_MAX_SIZE=64 * 1024)
+    def test_oversize_upload_aborted_while_streaming(self):
+        """
+            Test if an upload is cut at the limit without reading the rest of the body
+        """
+        payload = b'\x89PNG\r\n\x1a\n' + b'0' * (4 * 1024 * 1024)
+        request, length = self.multipart_request({
+            'thumbnail': SimpleUploadedFile('big.png', payload, content_type='image/png'),
+            'title': 'After the file',
+        })
+
+        self.assertNotIn('thumbnail', request.FILES)
+        self.assertIn('thumbnail', request.upload_errors)
+        self.assertLess(self.stream.bytes_read, length // 4)
+
+    def test_magic_bytes_checked(self):
+        """
+            Test if a file whose content isn't an allowed image is dropped and reported
+        """
+        request, _ = self.multipart_request({
+            'articleimage_set-0-media': SimpleUploadedFile('fake.png', b'<?php echo "hello"; ?>' * 10, content_type='image/png'),
+            'title': 'After the file',
+        })
+
+        self.assertNotIn('articleimage_set-0-media', request.FILES)
+        self.assertIn('Type de fichier', request.upload_errors['articleimage_set-0-media'])
+        self.assertEqual(request.POST['title'], 'After the file')
+
+    def test_accepted_upload_hashed(self):
+        """
+            Test if an accepted upload carries its sniffed type and content hash
+        """
+        content = png_upload('cover.png').read()
+        request, _ = self.multipart_request({
+            'thumbnail': SimpleUploadedFile('cover.jpg', content, content_type='image/jpeg'),
+        })
+
+        upload = request.FILES['thumbnail']
+        self.assertEqual(upload.sniffed_content_type, 'image/png')
+        self.assertEqual(upload.content_type, 'image/png')
+        self.assertEqual(upload.content_sha256, hashlib.sha256(content).hexdigest())
+        self.assertFalse(hasattr(request, 'upload_errors'))
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0)
+    def test_temporary_file_upload_hashed(self):
+        """
+            Test if uploads spooled to disk are validated and hashed as well
+        """
+        content = png_upload('cover.png').read()
+        request, _ = self.multipart_request({
+            'thumbnail': SimpleUploadedFile('cover.png', content, content_type='image/png'),
+        })
+        self.assertTrue(hasattr(request.FILES['thumbnail'], 'temporary_file_path'))
+        self.assertEqual(request.FILES['thumbnail'].content_sha256, hashlib.sha256(content).hexdigest())
+
+    def test_admin_reports_rejected_upload(self):
+        """
+            Test if the article admin form shows the rejection and saves nothing
+        """
+        from users.models import User
+
+        admin = User.objects.create_superuser(email="laurent.gina@oasis.com", username="Orangina", password="oasisisgood")
+        self.client.force_login(admin)
+        response = self.client.post(reverse('admin:core_article_add'), {
+            'title': 'Rejected',
+            'thumbnail': SimpleUploadedFile('fake.png', b'not an image at all', content_type='image/png'),
+            'articleimage_set-TOTAL_FORMS': '0',
+            'articleimage_set-INITIAL_FORMS': '0',
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Type de fichier non autoris')
+        self.assertFalse(Article.objects.filter(title='Rejected').exists())
+
+
+class TestMediaStorage(QueryBudgetMixin, TestCase):
+    """
+        TEST CONTENT ADDRESSED MEDIA STORAGE
+    """
+
+    def setUp(self):
+        super().setUp()
+        slug_cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = self.settings(MEDIA_ROOT=media_root, IMAGE_VARIANT_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch('core.images.run_in_background')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.article = Article.objects.create(title="Gallery")
+
+    def refcount(self, *names):
+        counts = dict(MediaBlob.objects.filter(name__in=names).values_list('name', 'refcount'))
+        return [counts.get(name) for name in names] if len(names) > 1 else counts.get(names[0])
+
+    def gc_media(self, *args):
+        output = StringIO()
+        call_command('gc_media', '--grace-seconds=0', *args, stdout=output)
+        return output.getvalue()
+
+    def test_duplicate_upload_stored_once(self):
+        """
+            Test if the same content uploaded twice under other names is stored once and counted twice
+        """
+        content = png_upload('cover.png').read()
+        upload = SimpleUploadedFile('one.png', content)
+        upload.content_sha256 = hashlib.sha256(content).hexdigest()
+        first = ArticleImage.objects.create(project=self.article, media=upload)
+        second = ArticleImage.objects.create(project=self.article, media=SimpleUploadedFile('two.PNG', content))
+
+        self.assertEqual(first.media.name, second.media.name)
+        self.assertEqual(first.media.name, 'cas/%s/%s.png' % (upload.content_sha256[:2], upload.content_sha256))
+        self.assertEqual(default_storage.listdir('cas/' + upload.content_sha256[:2])[1], [upload.content_sha256 + '.png'])
+        self.assertEqual(self.refcount(first.media.name), 2)
+
+    def test_references_follow_rows(self):
+        """
+            Test if replacing a file or deleting rows counts them out, the article cascade included
+        """
+        image = ArticleImage.objects.create(project=self.article, media=png_upload('one.png'))
+        old_name = image.media.name
+        image.media = png_upload('two.png', color='blue')
+        image.save()
+        self.assertEqual(self.refcount(old_name), 0)
+        self.assertEqual(self.refcount(image.media.name), 1)
+
+        # Loaded without its file, the previous references are read before the delete
+        ArticleImage.objects.create(project=self.article, media=png_upload('three.png', color='blue'))
+        ArticleImage.objects.only('pk', 'project').get(pk=image.pk).delete()
+        self.assertEqual(self.refcount(image.media.name), 1)
+        self.article.delete()
+        self.assertEqual(self.refcount(image.media.name), 0)
+
+    def test_variants_counted(self):
+        """
+            Test if variants written by the pipeline are referenced by their row
+        """
+        first = ArticleImage.objects.create(project=self.article, media=png_upload('one.png'))
+        second = ArticleImage.objects.create(project=self.article, media=png_upload('two.png'))
+        record = generate_variants(ArticleImage, first.pk)
+        generate_variants(ArticleImage, second.pk)
+        names = [variant['name'] for variant in record['variants']]
+        self.assertEqual(self.refcount(*names), [2] * len(names))
+
+        first.delete()
+        generate_variants(ArticleImage, second.pk, force=True)
+        self.assertEqual(self.refcount(*names), [1] * len(names))
+
+    def test_gc_deletes_unreferenced(self):
+        """
+            Test if the collector deletes released and untracked files and keeps referenced ones
+        """
+        kept = ArticleImage.objects.create(project=self.article, media=png_upload('kept.png'))
+        released = ArticleImage.objects.create(project=self.article, media=png_upload('released.png', color='blue'))
+        released_name = released.media.name
+        released.delete()
+        untracked = default_storage.save('articles/medias/draft.png', png_upload('draft.png', color='green'))
+
+        output = self.gc_media('--dry-run')
+        self.assertIn('would delete %s' % untracked, output)
+        self.assertTrue(default_storage.exists(released_name))
+
+        self.assertIn('1 unreferenced and 1 untracked files deleted', self.gc_media())
+        self.assertTrue(default_storage.exists(kept.media.name))
+        self.assertFalse(default_storage.exists(released_name))
+        self.assertFalse(default_storage.exists(untracked))
+        self.assertFalse(MediaBlob.objects.filter(name=released_name).exists())
+
+    def test_gc_recount(self):
+        """
+            Test if rows written without signals are counted before collecting
+        """
+        name = default_storage.save('articles/medias/imported.png', png_upload('imported.png'))
+        ArticleImage.objects.bulk_create([ArticleImage(project=self.article, media=name)])
+        MediaBlob.objects.create(name=name, refcount=0)
+
+        self.assertIn('1 reference counts corrected', self.gc_media('--recount'))
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(self.refcount(name), 1)
+
+    def test_served_immutable(self):
+        """
+            Test if stored media are served with a long lived immutable cache policy
+        """
+        image = ArticleImage.objects.create(project=self.article, media=png_upload('one.png'))
+        response = self.client.get(image.media.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(b''.join(response.streaming_content), image.media.read())
+        self.assertEqual(self.client.get('/media/cas/00/missing.png').status_code, 404)
+
+    def test_extension_follows_content(self):
+        """
+            Test if the blob extension comes from the magic bytes and never from the client name
+        """
+        image = ArticleImage.objects.create(project=self.article, media=SimpleUploadedFile('x.html', png_upload('one.png').read()))
+        markup = default_storage.save('articles/medias/page.html', SimpleUploadedFile('page.html', b'<script>alert(1)</script>'))
+
+        self.assertTrue(image.media.name.endswith('.png'))
+        self.assertEqual(posixpath.splitext(markup)[1], '')
+        response = self.client.get(image.media.url)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+        response = self.client.get(default_storage.url(markup))
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+
+class TestArticleSearch(QueryBudgetMixin, APITestCase):
+    """
+        TEST ARTICLE FULL TEXT SEARCH
+    """
+
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        slug_cache.clear()
+        patcher = mock.patch('core.images.run_in_background')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tuning = Article.objects.create(
+            title="Django performance tuning", short_desc="Indexes and caching", description="<p>Queries first.</p>",
+        )
+        self.release = Article.objects.create(
+            title="Release notes",
+            description="Many changes in this release. " * 10 + "Some performance fixes too.",
+        )
+        self.recipes = Article.objects.create(title="Été recipes", description="Cooking in summer")
+
+    def terms(self, article):
+        return dict(SearchPosting.objects.filter(document_id=article.pk).values_list('term', 'frequency'))
+
+    def ranked(self, query):
+        return [row['document_id'] for row in rank_articles(query)]
+
+    def test_terms_weighted_by_field(self):
+        """
+            Test if text is folded to terms, stop words and tags left out and title terms weigh more
+        """
+        self.assertEqual(tokenize("<b>Été</b> à la PLAGE, l'eau"), ['ete', 'plage', 'eau'])
+        self.assertEqual(self.terms(self.tuning), {
+            'django': 3, 'performance': 3, 'tuning': 3, 'indexes': 2, 'caching': 2, 'queries': 1, 'first': 1,
+        })
+
+    def test_bm25_ranking(self):
+        """
+            Test if a title match ranks above a match in a long description and rare terms count more
+        """
+        self.assertEqual(self.ranked("performance"), [self.tuning.pk, self.release.pk])
+        self.assertEqual(self.ranked("ETE"), [self.recipes.pk])
+        self.assertEqual(self.ranked("release performance")[0], self.release.pk)
+        self.assertEqual(self.ranked("the of unknown"), [])
+
+        # In two articles out of three, performance only ranks the ones matching release
+        with self.settings(SEARCH_COMMON_TERM_RATIO=0.5):
+            self.assertEqual(self.ranked("release performance"), [self.release.pk])
+            self.assertEqual(self.ranked("performance"), [self.tuning.pk, self.release.pk])
+
+    def test_index_follows_writes(self):
+        """
+            Test if edits replace the changed terms only, and deletes drop the postings
+        """
+        self.tuning.title = "Django speed tuning"
+        with CaptureQueriesContext(connection) as context:
+            self.tuning.save()
+        # Document and postings read, the dropped term deleted, the new one inserted
+        self.assertEqual(len([query for query in context.captured_queries if 'core_search' in query['sql']]), 4)
+        self.assertNotIn('performance', self.terms(self.tuning))
+        self.assertEqual(self.terms(self.tuning)['speed'], 3)
+        self.assertEqual(self.ranked("performance"), [self.release.pk])
+
+        with CaptureQueriesContext(connection) as context:
+            self.tuning.save(update_fields=['link'])
+        self.assertFalse([query for query in context.captured_queries if 'core_search' in query['sql']])
+
+        deferred = Article.objects.defer('description').get(pk=self.release.pk)
+        deferred.short_desc = "Changelog"
+        deferred.save()
+        self.assertEqual(self.terms(self.release)['changes'], 10)
+
+        self.release.delete()
+        self.assertFalse(SearchPosting.objects.filter(document_id=self.release.pk).exists())
+
+    def test_rebuild_index(self):
+        """
+            Test if articles written without signals are searchable after a rebuild
+        """
+        Article.objects.bulk_create([Article(title="Imported changelog", slug='imported-changelog')])
+        self.assertEqual(self.ranked("imported"), [])
+
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn("4 article(s) indexed", out.getvalue())
+        imported = Article.objects.get(slug='imported-changelog')
+        self.assertEqual(self.ranked("imported"), [imported.pk])
+        self.assertEqual(self.ranked("performance"), [self.tuning.pk, self.release.pk])
+
+    def test_search_api_paginated(self):
+        """
+            Test if the endpoint pages ranked articles with their score in a fixed number of queries
+        """
+        for index in range(3):
+            Article.objects.create(title="Performance report %d" % index)
+        # Document frequencies and corpus stats, then count, ranked page, articles and images
+        with query_budget(6):
+            response = self.client.get(reverse('api-article-search'), {'q': "performance", 'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 5)
+        self.assertIsNotNone(response.data['next'])
+        scores = [article['score'] for article in response.data['results']]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertNotIn('description', response.data['results'][0])
+
+        with query_budget(4):
+            last = self.client.get(response.data['next'].replace('page=2', 'page=3'))
+        self.assertEqual(last.data['results'][0]['slug'], self.release.slug)
+
+        missing = self.client.get(reverse('api-article-search'))
+        self.assertEqual(missing.status_code, status.HTTP_400_BAD_REQUEST)
+        empty = self.client.get(reverse('api-article-search'), {'q': "nothing matches"})
+        self.assertEqual(empty.data['count'], 0)
+
+    def test_admin_search_uses_index(self):
+        """
+            Test if the admin changelist search is answered from the index
+        """
+        from users.models import User
+
+        admin = User.objects.create_superuser(email="laurent.gina@oasis.com", username="Orangina", password="oasisisgood")
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:core_article_changelist'), {'q': "tuning"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(response.context['cl'].result_list), [self.tuning])
@@ -0,0 +1,10 @@
+from django.urls import path
+
+from core import api
+from core.cache import cache_article_page, detail_scope, list_scope
+
+urlpatterns = [
+    path('', cache_article_page(list_scope)(api.ArticleListAPI.as_view()), name='api-article-list'),
+    path('search/', api.ArticleSearchAPI.as_view(), name='api-article-search'),
+    path('<str:key>/', cache_article_page(detail_scope)(api.ArticleAPI.as_view()), name='api-article'),
+]
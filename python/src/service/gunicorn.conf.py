@@ -0,0 +1,80 @@
+"""
+Gunicorn production profile for the blog project
+
+    gunicorn -c gunicorn.conf.py
+
+SERVER_INTERFACE=asgi serves blog.asgi with uvicorn workers, wsgi (default) serves
+blog.wsgi with threaded workers. Every value can be overridden from the environment.
+"""
+import os
+
+from decouple import config as env
+
+
+def available_cpus():
+    """
+        CPUs usable by this container, honouring the cgroup quota
+        return Integer
+    """
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as cpu_max:
+            quota, period = cpu_max.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+server_interface = env('SERVER_INTERFACE', default='wsgi')
+
+bind = env('BIND', default='0.0.0.0:8000')
+if server_interface == 'asgi':
+    wsgi_app = 'blog.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'blog.wsgi:application'
+    worker_class = env('WORKER_CLASS', default='gthread')
+    threads = env('THREADS', default=4, cast=int)
+
+workers = env('WEB_CONCURRENCY', default=available_cpus() * 2 + 1, cast=int)
+backlog = env('BACKLOG', default=2048, cast=int)
+keepalive = env('KEEPALIVE', default=5, cast=int)
+timeout = env('TIMEOUT', default=30, cast=int)
+graceful_timeout = env('GRACEFUL_TIMEOUT', default=30, cast=int)
+max_requests = env('MAX_REQUESTS', default=10000, cast=int)
+max_requests_jitter = env('MAX_REQUESTS_JITTER', default=1000, cast=int)
+preload_app = env('PRELOAD', default=True, cast=bool)
+
+# Per worker metrics snapshots summed by /metrics, see METRICS_DIR in settings
+metrics_dir = env('METRICS_DIR', default='')
+
+accesslog = env('ACCESS_LOG', default='-')
+errorlog = '-'
+loglevel = env('LOG_LEVEL', default='info')
+
+
+def post_fork(server, worker):
+    # Database connections opened while preloading must not be shared between workers
+    from django.db import connections
+    connections.close_all()
+
+
+def on_starting(server):
+    if metrics_dir:
+        from blog.metrics import clear_snapshots
+        clear_snapshots(metrics_dir)
+
+
+def worker_exit(server, worker):
+    if metrics_dir:
+        from blog.metrics import flush_metrics
+        flush_metrics()
+
+
+def child_exit(server, worker):
+    # Requests counted by a recycled worker (max_requests) stay in the sums
+    if metrics_dir:
+        from blog.metrics import retire_worker
+        retire_worker(metrics_dir, worker.pid)
@@ -0,0 +1,60 @@
+from django.contrib.auth.models import AnonymousUser
+from django.utils.functional import SimpleLazyObject, cached_property
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.models import TokenUser
+
+
+class ClaimsUser(TokenUser):
+    """
+        Stateless user built from the claims of a token minted
+        by the authentication service, never backed by users_user
+    """
+    @cached_property
+    def uuid(self):
+        return self.token.get('uuid')
+
+    @cached_property
+    def email(self):
+        return self.token.get('email', '')
+
+    def __str__(self):
+        return self.email or "ClaimsUser %s" % self.id
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+        Validate SIMPLE_JWT access tokens (HS256 or RS256) in-process
+        return (ClaimsUser, token) without any database query
+    """
+    www_authenticate_realm = 'blog'
+
+
+def get_token_user(request):
+    """
+        Resolve the bearer token of a request into a ClaimsUser
+        return ClaimsUser or None
+    """
+    try:
+        result = StatelessJWTAuthentication().authenticate(request)
+    except (InvalidToken, TokenError):
+        return None
+    return result[0] if result is not None else None
+
+
+class JWTAuthenticationMiddleware:
+    """
+        Plain Django counterpart of StatelessJWTAuthentication
+        Must be placed after AuthenticationMiddleware, a valid bearer token
+        replaces the session user and the token is only decoded on first access
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.META.get('HTTP_AUTHORIZATION'):
+            session_user = getattr(request, 'user', None)
+            request.user = SimpleLazyObject(
+                lambda: get_token_user(request) or session_user or AnonymousUser()
+            )
+        return self.get_response(request)
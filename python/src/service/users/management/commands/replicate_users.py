@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from users.replication import apply_changes, backfill_users
+
+
+class Command(BaseCommand):
+    help = "Apply the user changes of the authentication service to the local users"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.USER_REPLICATION_BATCH_SIZE)
+        parser.add_argument('--backfill', action='store_true', help="Copy every user first, resumes an interrupted backfill")
+        parser.add_argument('--loop', action='store_true', help="Keep polling the outbox")
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds between polls when idle")
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            counts = backfill_users(batch_size=options['batch_size'])
+            self.stdout.write("Backfill: %s" % self.summary(counts))
+        while True:
+            counts = apply_changes(batch_size=options['batch_size'])
+            if counts['changes']:
+                self.stdout.write("Applied %s change(s): %s" % (counts['changes'], self.summary(counts)))
+            if not options['loop']:
+                if counts['changes'] < options['batch_size']:
+                    break
+                continue
+            if counts['changes'] < options['batch_size']:
+                time.sleep(options['interval'])
+
+    @staticmethod
+    def summary(counts):
+        return ", ".join("%s %s" % (counts[key], key) for key in ('created', 'updated', 'deleted', 'skipped', 'failed'))
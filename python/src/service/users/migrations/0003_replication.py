@@ -0,0 +1,69 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_uuid_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uuid', models.UUIDField()),
+                ('first_name', models.CharField(max_length=50, null=True)),
+                ('last_name', models.CharField(max_length=50, null=True)),
+                ('email', models.EmailField(max_length=80)),
+                ('username', models.CharField(max_length=50)),
+                ('address', models.TextField(null=True)),
+                ('postal_code', models.IntegerField(null=True)),
+                ('city', models.CharField(max_length=200, null=True)),
+                ('email_verified', models.BooleanField()),
+                ('is_active', models.BooleanField()),
+                ('is_staff', models.BooleanField()),
+                ('is_superuser', models.BooleanField()),
+                ('slug', models.SlugField(null=True)),
+            ],
+            options={
+                'db_table': 'users_user',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='AuthUserChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_uuid', models.UUIDField()),
+                ('action', models.CharField(max_length=10)),
+                ('payload', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'users_userchange',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ReplicationCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('position', models.BigIntegerField(default=0)),
+                ('high_water', models.BigIntegerField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'replication cursor',
+                'verbose_name_plural': 'replication cursors',
+            },
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='replica_version',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -6,7 +6,7 @@ from django.contrib.auth.models import (AbstractUser, BaseUserManager,
 from django.db import models
 from django.db.models.signals import pre_save
 
-from blog.utils import unique_user_slug_generator
+from blog.slugs import save_with_unique_slug, unique_user_slug_generator
 
 
 class UserManager(BaseUserManager):
@@ -54,7 +54,9 @@ class User(AbstractUser, PermissionsMixin):
     is_staff = models.BooleanField(default=False)
     is_superuser = models.BooleanField(default=False)
     slug = models.SlugField(null=True, blank=True, unique=True)
-    uuid = models.UUIDField(default=uuid.uuid4, editable=False)
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    # Id of the last authentication UserChange applied, null for local only users
+    replica_version = models.BigIntegerField(null=True, blank=True, editable=False)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username',]
@@ -68,6 +70,9 @@ class User(AbstractUser, PermissionsMixin):
     def __str__(self):
         return self.email
 
+    def save(self, *args, **kwargs):
+        return save_with_unique_slug(self, 'username', super().save, *args, **kwargs)
+
     def has_perm(self, perm=None, obj=None):
         return self.is_staff
 
@@ -75,6 +80,62 @@ class User(AbstractUser, PermissionsMixin):
         return True
     
 
+class ReplicationCursor(models.Model):
+    """
+        Progress of a replication stream, updated in the transaction applying it
+        position is the last change id applied, or the last source pk copied by a backfill
+        high_water is the change id a running backfill is consistent with
+    """
+    name = models.CharField(max_length=50, unique=True)
+    position = models.BigIntegerField(default=0)
+    high_water = models.BigIntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "replication cursor"
+        verbose_name_plural = "replication cursors"
+
+    def __str__(self):
+        return "%s @ %s" % (self.name, self.position)
+
+
+class AuthUserChange(models.Model):
+    """
+        users.UserChange outbox of the authentication service, read on the `auth` database
+    """
+    user_uuid = models.UUIDField()
+    action = models.CharField(max_length=10)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        db_table = 'users_userchange'
+
+
+class AuthUser(models.Model):
+    """
+        users.User of the authentication service, read on the `auth` database by the backfill
+    """
+    uuid = models.UUIDField()
+    first_name = models.CharField(max_length=50, null=True)
+    last_name = models.CharField(max_length=50, null=True)
+    email = models.EmailField(max_length=80)
+    username = models.CharField(max_length=50)
+    address = models.TextField(null=True)
+    postal_code = models.IntegerField(null=True)
+    city = models.CharField(max_length=200, null=True)
+    email_verified = models.BooleanField()
+    is_active = models.BooleanField()
+    is_staff = models.BooleanField()
+    is_superuser = models.BooleanField()
+    slug = models.SlugField(null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'users_user'
+
+
 # Slug Generator
 def slug_generator(sender, instance, *args, **kwargs):
     if not instance.slug:
@@ -0,0 +1,212 @@
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from users.models import AuthUser, AuthUserChange, ReplicationCursor, User
+
+logger = logging.getLogger(__name__)
+
+# Columns copied from the authentication users, same list as its users.changes
+REPLICATED_FIELDS = (
+    'email', 'username', 'first_name', 'last_name', 'address', 'postal_code', 'city',
+    'email_verified', 'is_active', 'is_staff', 'is_superuser', 'slug',
+)
+# Unique columns -> value freeing them, held by a user until its own change gives it the new one
+RELEASED_VALUES = {
+    'email': lambda user: "%s@released.invalid" % user.uuid.hex,
+    'username': lambda user: "~%s" % user.uuid.hex,
+    'slug': lambda user: None,
+}
+CHANGES_CURSOR = 'users:changes'
+BACKFILL_CURSOR = 'users:backfill'
+
+
+def get_cursor(name):
+    """
+        Cursor row locked until the end of the transaction, one consumer applies a stream at a time
+    """
+    cursor, _ = ReplicationCursor.objects.select_for_update().get_or_create(name=name)
+    return cursor
+
+
+def replicated_values(payload):
+    return {
+        field: User._meta.get_field(field).to_python(payload[field])
+        for field in REPLICATED_FIELDS if field in payload
+    }
+
+
+def release_unique_values(holders, states):
+    """
+        Give a released value to the unique columns the incoming states give to another user
+        A username swapped between two users, or taken over from a user whose change
+        comes later in the stream, would fail the writes and stall the replication.
+        The holders are changed in place so their own state is written over the released values
+        return List of unsaved users carrying the released values, written before the states
+    """
+    wanted = {}
+    for user_uuid, (_, values) in states.items():
+        for field in RELEASED_VALUES:
+            if values and values.get(field) is not None:
+                wanted[(field, values[field])] = user_uuid
+    released = []
+    for holder in holders:
+        fields = [
+            field for field in RELEASED_VALUES
+            if wanted.get((field, getattr(holder, field)), holder.uuid) != holder.uuid
+        ]
+        if fields:
+            logger.warning("Replicated user %s releases its %s", holder.uuid, ", ".join(fields))
+            for field in fields:
+                setattr(holder, field, RELEASED_VALUES[field](holder))
+            released.append(User(pk=holder.pk, **{field: getattr(holder, field) for field in RELEASED_VALUES}))
+    return released
+
+
+def write_versions(created, updated, batch_size=None):
+    User.objects.bulk_create(created, batch_size=batch_size)
+    User.objects.bulk_update(updated, REPLICATED_FIELDS + ('replica_version',), batch_size=batch_size)
+
+
+def write_versions_by_row(created, updated):
+    """
+        Write the users one at a time after a batch failed, a row still conflicting
+        is logged and left out instead of blocking the ones after it
+        return Counter of the rows left out (created, updated)
+    """
+    failed = Counter()
+    rows = [('created', user, [user], []) for user in created] + [('updated', user, [], [user]) for user in updated]
+    for kind, user, to_create, to_update in rows:
+        try:
+            with transaction.atomic():
+                write_versions(to_create, to_update)
+        except IntegrityError:
+            logger.exception("Replicated user %s at version %s not written", user.uuid, user.replica_version)
+            failed[kind] += 1
+    return failed
+
+
+def apply_versions(states):
+    """
+        Write the latest known state of users in bulk statements
+        Rows already at this version or a newer one are left alone, so a change
+        applied twice or out of order is a no-op. Unique values taken over from another
+        user are released first, a row that still can't be written is counted as failed
+        states: Dict uuid -> (version, values or None for a deleted user)
+        return Counter (created, updated, deleted, skipped, failed)
+    """
+    counts = Counter()
+    # The users of the states and the ones holding their unique values, in one query
+    lookup = Q(uuid__in=list(states))
+    for field in RELEASED_VALUES:
+        values = {values[field] for _, values in states.values() if values and values.get(field) is not None}
+        if values:
+            lookup |= Q(**{field + '__in': values})
+    rows = list(User.objects.filter(lookup))
+    existing = {user.uuid: user for user in rows}
+    # Replayed or older states give nothing away
+    newer = {
+        user_uuid: state for user_uuid, state in states.items()
+        if existing.get(user_uuid) is None or existing[user_uuid].replica_version is None
+        or existing[user_uuid].replica_version < state[0]
+    }
+    released = release_unique_values(rows, newer)
+    created, updated, deleted = [], [], []
+    for user_uuid, (version, values) in states.items():
+        user = existing.get(user_uuid)
+        if user is not None and user.replica_version is not None and user.replica_version >= version:
+            counts['skipped'] += 1
+        elif values is None:
+            if user is not None:
+                deleted.append(user.pk)
+            else:
+                counts['skipped'] += 1
+        elif user is None:
+            created.append(User(uuid=user_uuid, password=make_password(None), replica_version=version, **values))
+        else:
+            for field, value in values.items():
+                setattr(user, field, value)
+            user.replica_version = version
+            updated.append(user)
+
+    batch_size = settings.USER_REPLICATION_BATCH_SIZE
+    if deleted:
+        User.objects.filter(pk__in=deleted).delete()
+    if released:
+        User.objects.bulk_update(released, list(RELEASED_VALUES), batch_size=batch_size)
+    try:
+        with transaction.atomic():
+            write_versions(created, updated, batch_size)
+    except IntegrityError:
+        failed = write_versions_by_row(created, updated)
+        counts.subtract(failed)
+        counts['failed'] = sum(failed.values())
+    counts.update(created=len(created), updated=len(updated), deleted=len(deleted))
+    return counts
+
+
+def apply_changes(batch_size=None):
+    """
+        Apply the next batch of the authentication outbox, the cursor moves in the same transaction
+        Only changes older than USER_REPLICATION_SETTLE_SECONDS are read, a change whose
+        transaction committed after a later id was read would be skipped otherwise
+        return Counter, `changes` is the number of outbox rows read
+    """
+    batch_size = batch_size or settings.USER_REPLICATION_BATCH_SIZE
+    settled = timezone.now() - timedelta(seconds=settings.USER_REPLICATION_SETTLE_SECONDS)
+    with transaction.atomic():
+        cursor = get_cursor(CHANGES_CURSOR)
+        changes = list(
+            AuthUserChange.objects.filter(id__gt=cursor.position, created_at__lte=settled).order_by('id')[:batch_size]
+        )
+        if not changes:
+            return Counter()
+        # Several changes of a user in one batch collapse into the last one
+        states = {
+            change.user_uuid: (change.id, None if change.action == 'delete' else replicated_values(change.payload))
+            for change in changes
+        }
+        counts = apply_versions(states)
+        cursor.position = changes[-1].id
+        cursor.save(update_fields=['position', 'updated_at'])
+    counts['changes'] = len(changes)
+    return counts
+
+
+def backfill_users(batch_size=None):
+    """
+        Copy every authentication user, for a new replica or one behind the outbox retention
+        Users are copied at the version of the outbox head when the backfill started and
+        the progress is saved per batch, an interrupted backfill resumes after the last copied user.
+        At the end replicas missing from the source are deleted and the change stream
+        resumes from that version
+        return Counter (created, updated, deleted, skipped)
+    """
+    batch_size = batch_size or settings.USER_REPLICATION_BATCH_SIZE
+    totals = Counter()
+    while True:
+        with transaction.atomic():
+            cursor = get_cursor(BACKFILL_CURSOR)
+            if cursor.high_water is None:
+                cursor.high_water = AuthUserChange.objects.aggregate(head=Max('id'))['head'] or 0
+            users = list(AuthUser.objects.filter(pk__gt=cursor.position).order_by('pk')[:batch_size])
+            if not users:
+                _, deleted = User.objects.filter(replica_version__lt=cursor.high_water).delete()
+                totals['deleted'] += deleted.get(User._meta.label, 0)
+                changes = get_cursor(CHANGES_CURSOR)
+                changes.position = max(changes.position, cursor.high_water)
+                changes.save(update_fields=['position', 'updated_at'])
+                cursor.delete()
+                return totals
+            totals.update(apply_versions({
+                user.uuid: (cursor.high_water, {field: getattr(user, field) for field in REPLICATED_FIELDS})
+                for user in users
+            }))
+            cursor.position = users[-1].pk
+            cursor.save(update_fields=['position', 'high_water', 'updated_at'])
@@ -1,3 +1,414 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.http import HttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from blog.metrics import registry as metrics_registry
+from blog.pool import PooledDatabaseMixin, PoolTimeout, pools
+from blog.replicas import PIN_COOKIE, ReplicaRoutingMiddleware, lag_monitor
+from blog.testing import (QueryBudgetMixin, SQLiteReplicasMixin, query_budget,
+                          shared_module_drift)
+from core.cache import local_cache
+from core.models import Article
+
+from users.authentication import (ClaimsUser, JWTAuthenticationMiddleware,
+                                  StatelessJWTAuthentication)
+from users.models import (AuthUser, AuthUserChange, ReplicationCursor,
+                          User)
+from users.replication import (BACKFILL_CURSOR, CHANGES_CURSOR,
+                               apply_changes, apply_versions, backfill_users)
+
+
+class TestStatelessJWT(QueryBudgetMixin, TestCase):
+    """
+        TEST STATELESS JWT AUTHENTICATION CLASS
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+        self.user_uuid = str(uuid.uuid4())
+        token = AccessToken()
+        token['user_id'] = 42
+        token['uuid'] = self.user_uuid
+        token['email'] = 'laurent.gina@oasis.com'
+        token['username'] = 'Orangina'
+        token['is_staff'] = True
+        self.access_token = str(token)
+
+    def test_authenticate_without_query(self):
+        """
+            Test if a valid token gives a ClaimsUser without hitting the database
+        """
+        request = self.factory.get('/', HTTP_AUTHORIZATION='Bearer ' + self.access_token)
+        with self.assertNumQueries(0):
+            user, token = StatelessJWTAuthentication().authenticate(request)
+
+        self.assertIsInstance(user, ClaimsUser)
+        self.assertEqual(user.id, 42)
+        self.assertEqual(user.uuid, self.user_uuid)
+        self.assertEqual(user.email, 'laurent.gina@oasis.com')
+        self.assertTrue(user.is_staff)
+        self.assertTrue(user.is_authenticated)
+
+    def test_middleware_with_invalid_token(self):
+        """
+            Test if an invalid token falls back to an anonymous user
+        """
+        request = self.factory.get('/', HTTP_AUTHORIZATION='Bearer not-a-token')
+        middleware = JWTAuthenticationMiddleware(lambda request: HttpResponse())
+        middleware(request)
+
+        self.assertFalse(request.user.is_authenticated)
+
+    def test_middleware_with_valid_token(self):
+        """
+            Test if the middleware sets the token user on the request
+        """
+        request = self.factory.get('/', HTTP_AUTHORIZATION='Bearer ' + self.access_token)
+        middleware = JWTAuthenticationMiddleware(lambda request: HttpResponse())
+        with self.assertNumQueries(0):
+            middleware(request)
+            self.assertEqual(request.user.uuid, self.user_uuid)
+
+
+class TestPerformanceMiddleware(QueryBudgetMixin, TestCase):
+    """
+        TEST REQUEST INSTRUMENTATION
+    """
+
+    def test_metrics_endpoint(self):
+        """
+            Test if a request is aggregated under its view name and exposed on /metrics
+        """
+        metrics_registry.clear()
+        self.client.get('/admin/login/')
+        self.client.get('/missing/')
+
+        with self.settings(METRICS_TOKEN='scraper'):
+            body = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scraper').content.decode()
+        self.assertIn('http_request_duration_seconds_count{view="admin:login"} 1', body)
+        self.assertIn('http_response_size_bytes_count{view="admin:login"} 1', body)
+        self.assertIn('http_request_queries_count{view="<unresolved>"} 1', body)
+
+
+@override_settings(USER_REPLICATION_SETTLE_SECONDS=0)
+class TestUserReplication(QueryBudgetMixin, TestCase):
+    """
+        TEST USER REPLICATION FROM THE AUTHENTICATION OUTBOX
+    """
+    databases = {'default', 'auth'}
+
+    @classmethod
+    def setUpClass(cls):
+        # Tables of the authentication service, the auth alias is never migrated from here
+        with connections['auth'].schema_editor() as editor:
+            editor.create_model(AuthUser)
+            editor.create_model(AuthUserChange)
+        cls.addClassCleanup(cls.drop_auth_tables)
+        super().setUpClass()
+
+    @classmethod
+    def drop_auth_tables(cls):
+        with connections['auth'].schema_editor() as editor:
+            editor.delete_model(AuthUserChange)
+            editor.delete_model(AuthUser)
+
+    def change(self, user_uuid, action='update', **payload):
+        return AuthUserChange.objects.create(
+            user_uuid=user_uuid, action=action, payload=payload, created_at=timezone.now() - timedelta(seconds=1),
+        )
+
+    def source_user(self, index):
+        return AuthUser.objects.create(
+            uuid=uuid.uuid4(), email="user%d@oasis.com" % index, username="user%d" % index, slug="user%d" % index,
+            email_verified=True, is_active=True, is_staff=False, is_superuser=False,
+        )
+
+    def test_changes_applied_in_bulk(self):
+        """
+            Test if a batch of changes costs the same queries whatever its size and keeps the last state
+        """
+        uuids = [uuid.uuid4() for _ in range(20)]
+        for index, user_uuid in enumerate(uuids):
+            self.change(user_uuid, 'create', email="user%d@oasis.com" % index, username="user%d" % index, is_active=True)
+        self.change(uuids[0], city="Paris", email="renamed@oasis.com")
+
+        # Cursor creation and the savepoint of the writes included, the auth outbox read is on the other connection
+        with query_budget(11):
+            counts = apply_changes()
+
+        self.assertEqual((counts['changes'], counts['created'], counts['updated']), (21, 20, 0))
+        first = User.objects.get(uuid=uuids[0])
+        self.assertEqual((first.email, first.city), ("renamed@oasis.com", "Paris"))
+        self.assertFalse(first.has_usable_password())
+        self.assertEqual(first.replica_version, AuthUserChange.objects.latest('id').id)
+        self.assertEqual(ReplicationCursor.objects.get(name=CHANGES_CURSOR).position, first.replica_version)
+
+    def test_changes_idempotent(self):
+        """
+            Test if replayed or older changes are skipped
+        """
+        user_uuid = uuid.uuid4()
+        create = self.change(user_uuid, 'create', email="john.doe@oasis.com", username="john")
+        self.change(user_uuid, city="Paris")
+        apply_changes()
+
+        ReplicationCursor.objects.filter(name=CHANGES_CURSOR).update(position=0)
+        counts = apply_changes()
+        self.assertEqual((counts['skipped'], counts['updated']), (1, 0))
+        apply_versions({user_uuid: (create.id, {'city': "Lyon"})})
+        self.assertEqual(User.objects.get(uuid=user_uuid).city, "Paris")
+
+    def test_recent_changes_wait(self):
+        """
+            Test if changes younger than the settle delay are left for a later run
+        """
+        AuthUserChange.objects.create(user_uuid=uuid.uuid4(), action='create', payload={'email': "a@oasis.com", 'username': "a"}, created_at=timezone.now())
+        with self.settings(USER_REPLICATION_SETTLE_SECONDS=60):
+            self.assertEqual(apply_changes()['changes'], 0)
+        self.assertEqual(apply_changes()['created'], 1)
+
+    def test_delete_change(self):
+        """
+            Test if a delete change removes the replica and leaves local users alone
+        """
+        local = User.objects.create_user(email="local@oasis.com", username="local", password="oasisisgood")
+        user_uuid = uuid.uuid4()
+        self.change(user_uuid, 'create', email="john.doe@oasis.com", username="john")
+        apply_changes()
+        self.change(user_uuid, 'delete')
+
+        self.assertEqual(apply_changes()['deleted'], 1)
+        self.assertFalse(User.objects.filter(uuid=user_uuid).exists())
+        self.assertTrue(User.objects.filter(pk=local.pk).exists())
+
+    def test_username_swap_applied(self):
+        """
+            Test if users swapping usernames, or taking one over before the change freeing it, don't stall the replication
+        """
+        first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        self.change(first, 'create', email="first@oasis.com", username="alice", slug="alice")
+        self.change(second, 'create', email="second@oasis.com", username="bob", slug="bob")
+        apply_changes()
+
+        self.change(first, username="bob", slug="bob")
+        self.change(second, username="alice", slug="alice")
+        # Takes over an email freed by a change still to come
+        self.change(third, 'create', email="first@oasis.com", username="carol")
+        counts = apply_changes()
+        self.assertEqual((counts['created'], counts['updated'], counts['failed']), (1, 2, 0))
+        users = {user.uuid: user for user in User.objects.all()}
+        self.assertEqual((users[first].username, users[first].slug), ("bob", "bob"))
+        self.assertEqual((users[second].username, users[second].slug), ("alice", "alice"))
+        self.assertEqual(users[third].email, "first@oasis.com")
+        self.assertEqual(users[first].email, "%s@released.invalid" % first.hex)
+
+        self.change(first, email="renamed@oasis.com")
+        apply_changes()
+        self.assertEqual(User.objects.get(uuid=first).email, "renamed@oasis.com")
+
+    def test_conflicting_row_left_out(self):
+        """
+            Test if a row that can't be written is counted as failed and the others are applied
+        """
+        user_uuid = uuid.uuid4()
+        self.change(user_uuid, 'create', email="john.doe@oasis.com", username="john")
+        self.change(uuid.uuid4(), 'create', email="jane.doe@oasis.com", username="jane")
+        with mock.patch('users.replication.release_unique_values', return_value=[]):
+            User.objects.create(email="john.doe@oasis.com", username="local-john")
+            with self.assertLogs('users.replication', 'ERROR'):
+                counts = apply_changes()
+
+        self.assertEqual((counts['created'], counts['failed']), (1, 1))
+        self.assertTrue(User.objects.filter(username="jane").exists())
+        self.assertEqual(ReplicationCursor.objects.get(name=CHANGES_CURSOR).position, AuthUserChange.objects.latest('id').id)
+
+    def test_backfill_resumes(self):
+        """
+            Test if an interrupted backfill resumes after the last batch and ends on the outbox head
+        """
+        sources = [self.source_user(index) for index in range(5)]
+        self.change(sources[1].uuid, city="Lyon")
+        head = self.change(sources[0].uuid, city="Paris")
+        gone = User.objects.create(email="gone@oasis.com", username="gone", slug="gone", replica_version=1)
+        local = User.objects.create_user(email="local@oasis.com", username="local", password="oasisisgood")
+
+        calls = []
+        def interrupted(states):
+            calls.append(states)
+            if len(calls) == 2:
+                raise ConnectionError("auth database went away")
+            return apply_versions(states)
+
+        with mock.patch('users.replication.apply_versions', side_effect=interrupted):
+            with self.assertRaises(ConnectionError):
+                backfill_users(batch_size=2)
+        self.assertEqual(ReplicationCursor.objects.get(name=BACKFILL_CURSOR).position, sources[1].pk)
+        self.assertEqual(User.objects.filter(replica_version=head.id).count(), 2)
+
+        out = StringIO()
+        call_command('replicate_users', backfill=True, batch_size=2, stdout=out)
+        self.assertIn("Backfill: 3 created, 0 updated, 1 deleted, 0 skipped", out.getvalue())
+        self.assertEqual(User.objects.filter(replica_version=head.id).count(), 5)
+        self.assertFalse(User.objects.filter(pk=gone.pk).exists())
+        self.assertTrue(User.objects.filter(pk=local.pk).exists())
+        self.assertFalse(ReplicationCursor.objects.filter(name=BACKFILL_CURSOR).exists())
+        self.assertEqual(ReplicationCursor.objects.get(name=CHANGES_CURSOR).position, head.id)
+
+
+class TestReplicaRouting(SQLiteReplicasMixin, QueryBudgetMixin, TransactionTestCase):
+    """
+        TEST READ REPLICA ROUTING
+    """
+    replica_models = (User, Article)
+
+    def setUp(self):
+        """
+            Same user in the primary and each replica, told apart by its first name
+        """
+        super().setUp()
+        lag_monitor.reset()
+        self.user = User.objects.create_user(email="laurent.gina@oasis.com", username="Orangina", password="oasisisgood")
+        User.objects.filter(pk=self.user.pk).update(first_name="Primary")
+        for alias in self.replica_aliases:
+            copy = User.objects.get(pk=self.user.pk)
+            copy.first_name = alias
+            User.objects.using(alias).bulk_create([copy])
+        self.factory = RequestFactory()
+
+    def routed(self, view, cookies=None):
+        request = self.factory.get('/')
+        request.COOKIES.update(cookies or {})
+        return ReplicaRoutingMiddleware(view)(request)
+
+    def first_name_view(self, request):
+        return HttpResponse(User.objects.get(pk=self.user.pk).first_name)
+
+    def test_reads_from_replica_until_write(self):
+        """
+            Test if a request reads one replica, then the primary once it wrote, and pins the client
+        """
+        def view(request):
+            first = User.objects.get(pk=self.user.pk).first_name
+            second = User.objects.get(pk=self.user.pk).first_name
+            User.objects.filter(pk=self.user.pk).update(last_name="Written")
+            after = User.objects.get(pk=self.user.pk).first_name
+            return HttpResponse("%s,%s,%s" % (first, second, after))
+
+        response = self.routed(view)
+        first, second, after = response.content.decode().split(',')
+        self.assertIn(first, self.replica_aliases)
+        self.assertEqual(second, first)
+        self.assertEqual(after, "Primary")
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        self.assertEqual(self.routed(self.first_name_view, cookies={PIN_COOKIE: '1'}).content, b"Primary")
+        self.assertNotIn(PIN_COOKIE, self.routed(self.first_name_view).cookies)
+
+    def test_primary_outside_requests(self):
+        """
+            Test if commands, transactions and unhealthy replicas read the primary
+        """
+        def view(request):
+            with transaction.atomic():
+                return HttpResponse(User.objects.get(pk=self.user.pk).first_name)
+
+        self.assertEqual(User.objects.get(pk=self.user.pk).first_name, "Primary")
+        self.assertEqual(self.routed(view).content, b"Primary")
+        with mock.patch('blog.replicas.probe_lag', return_value=None), self.assertLogs('performance', 'WARNING'):
+            self.assertEqual(self.routed(self.first_name_view).content, b"Primary")
+
+    def test_page_cache_filled_from_primary(self):
+        """
+            Test if a cached article page is rendered from the primary, a lagging replica
+            would store its previous text under the current key
+        """
+        caches['default'].clear()
+        local_cache.clear()
+        article = Article.objects.create(title="Primary")
+        for alias in self.replica_aliases:
+            copy = Article.objects.get(pk=article.pk)
+            copy.title = alias
+            Article.objects.using(alias).bulk_create([copy])
+
+        # The replicas have no image table, a render reading them fails
+        response = self.client.get(reverse('api-article', args=[article.slug]))
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertEqual(response.json()['title'], "Primary")
+
+
+class PooledSQLiteWrapper(PooledDatabaseMixin, SQLiteDatabaseWrapper):
+    unpooled_engine = 'django.db.backends.sqlite3'
+
+
+class TestConnectionPool(QueryBudgetMixin, TestCase):
+    """
+        TEST POOLED DATABASE CONNECTIONS
+    """
+    alias = 'pool_test'
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.settings_dict = connections.configure_settings({
+            'default': {},
+            self.alias: {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(directory, 'pool.sqlite3'),
+                'POOL': {'MAX_SIZE': 1, 'TIMEOUT': 0.05},
+            },
+        })[self.alias]
+        self.addCleanup(lambda: pools.pop(self.alias).close())
+
+    def connected(self):
+        wrapper = PooledSQLiteWrapper(self.settings_dict, self.alias)
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_connection_shared_within_limit(self):
+        """
+            Test if wrappers take turns on MAX_SIZE connections and the pool is exported to Prometheus
+        """
+        first = self.connected()
+        raw = first.connection
+        with self.assertLogs('performance', 'WARNING'), self.assertRaises(PoolTimeout):
+            self.connected()
+        first.close()
+
+        self.assertIs(self.connected().connection, raw)
+        metrics = metrics_registry.render()
+        self.assertIn('db_pool_connections{alias="pool_test",state="in_use"} 1', metrics)
+        self.assertIn('db_pool_timeouts_total{alias="pool_test"} 1', metrics)
+        self.assertIn('db_pool_opened_total{alias="pool_test"} 1', metrics)
+
+
+class TestSharedModules(SimpleTestCase):
+    """
+        TEST MODULES COPIED IN BOTH SERVICES
+    """
+
+    def test_shared_modules_identical(self):
+        """
+            Test if the shared modules have the same code in both services
+        """
+        drift = shared_module_drift()
+        if drift is None:
+            self.skipTest("The other service isn't checked out")
+        self.assertEqual(drift, [])